@@ -19,4 +19,5 @@ class EBike(object):
         self.ramp_last_time = time.monotonic_ns()
         self.motor_current_target = 0
         self.assist_level = 0
-        self.speed = 0
\ No newline at end of file
+        self.speed = 0
+        self.command_ack = 0 # sequence of the last command received from the display
\ No newline at end of file
@@ -1,6 +1,7 @@
 import asyncio
 import board
 import time
+import profiler
 
 from buttons import Buttons
 from ebike_data import EBike
@@ -16,14 +17,23 @@ ebike = EBikeBoard(
     board.IO17, # UART RX pin that connect to display UART TX pin
     ebike_data) # EBike data object to hold the EBike data
 
+# execution time profiles of the task bodies, send 'p' on the serial console to enable them and 's' to print them
+profile_ebike_process_data = profiler.Profile('ebike process data')
+profile_ebike_send_data = profiler.Profile('ebike send data')
+profile_display_update = profiler.Profile('display update', bucket_us = 10000) # slow, up to 1 second
+
 async def task_ebike_process_data():
     while True:
+        profile_ebike_process_data.start()
         ebike.process_data()
+        profile_ebike_process_data.stop()
         await asyncio.sleep(0.01) # 10ms
 
 async def task_ebike_send_data():
     while True:
+        profile_ebike_send_data.start()
         ebike.send_data()
+        profile_ebike_send_data.stop()
         await asyncio.sleep(0.1) # 100ms
 
 
@@ -36,11 +46,13 @@ async def task_button_presses():
     while True:
         if buttons.up and ebike_data.assist_level < ASSIST_MAX_LEVEL:
             ebike_data.assist_level += 1
+            ebike.send_command() # send the new assist level right away
             while buttons.up:
                 await asyncio.sleep(0.01)
 
         elif buttons.down and ebike_data.assist_level > 0:
             ebike_data.assist_level -= 1
+            ebike.send_command() # send the new assist level right away
             while buttons.down:
                 await asyncio.sleep(0.01)
 
@@ -64,7 +76,9 @@ async def task_display_update():
             prev_assist_level = ebike_data.assist_level
             prev_motor_current = ebike_data.motor_current
             prev_update = now
+            profile_display_update.start() # includes the time of other tasks running while waiting for the update
             await display.update(ebike_data)
+            profile_display_update.stop()
 
         await asyncio.sleep(0.01) # 10ms
 
@@ -76,7 +90,8 @@ async def main():
             task_ebike_process_data(),
             task_ebike_send_data(),
             task_button_presses(),
-            task_display_update()
+            task_display_update(),
+            profiler.task_serial_stats() # send 's' on the serial console to print the timing statistics
             )
 
 asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,116 @@
+import fixed_point
+
+class ControlStrategy(object):
+    """Motor control strategy, chosen once at boot.
+    Has the limits and the VESC commands of a control scheme, so the motor control loop does not need to check the
+    scheme on each step. The base class is safe on its own, it never drives the motor: send() and stop() set the motor
+    current to 0. New schemes, like duty cycle or blended current / speed, override send() and, when needed,
+    max_target(), limit() and stop()."""
+
+    def __init__(self, motor_setpoint, min_target, max_target, ramp_up_per_second, ramp_down_per_second):
+        """Control strategy
+        :param ~VescSetpointPublisher motor_setpoint: used to send the motor target to VESC
+        :param int min_target: lower targets are set to 0, as a too low value will make the motor vibrate and not run
+        :param int max_target: max motor target, from the vehicle profile limit
+        :param float ramp_up_per_second: ramp up rate, in target units per second
+        :param float ramp_down_per_second: ramp down rate, in target units per second
+        """
+        self._motor_setpoint = motor_setpoint
+        self.min_target = min_target
+        self._max_target = max_target
+        self.ramp = fixed_point.Ramp(ramp_up_per_second, ramp_down_per_second)
+
+    def max_target(self, value):
+        """Max motor target, to map the throttle to: the profile limit, the value is not used"""
+        return self._max_target
+
+    def limit(self, target):
+        """Limit the motor target between 0 and the max target"""
+        return fixed_point.clamp(target, 0, self._max_target)
+
+    def send(self, target, motor_speed_erpm):
+        """Send the motor target to VESC: the base class keeps the motor released"""
+        self.stop()
+
+    def stop(self):
+        """Stop the motor, like when the brakes are active: motor current 0, to let the motor coast"""
+        self._motor_setpoint.set_motor_current_milliamps(0)
+
+    def update(self, target, brakes_are_active, motor_speed_erpm):
+        """Apply the min target, limit and ramp, and send the result to VESC
+        :param int target: motor target
+        :param bool brakes_are_active: stop the motor if True
+        :param int motor_speed_erpm: motor speed in ERPM
+        return: motor target after the ramp
+        """
+        if target < self.min_target:
+            target = 0
+
+        value = self.ramp.update(self.limit(target))
+
+        if brakes_are_active:
+            self.stop()
+            self.ramp.reset(0)
+            return 0
+
+        self.send(value, motor_speed_erpm)
+        return value
+
+class CurrentControl(ControlStrategy):
+    """Motor current control, motor target in mA"""
+
+    def __init__(self, motor_setpoint, min_current_start, max_current_limit, ramp_up_time, ramp_down_time):
+        """Current control
+        :param ~VescSetpointPublisher motor_setpoint: used to send the motor current to VESC
+        :param float min_current_start: min motor current in Amps
+        :param float max_current_limit: max motor current in Amps
+        :param float ramp_up_time: ramp up time in seconds for each 1A
+        :param float ramp_down_time: ramp down time in seconds for each 1A
+        """
+        super().__init__(
+            motor_setpoint,
+            int(min_current_start * 1000),
+            int(max_current_limit * 1000),
+            1000 / ramp_up_time, # mA per second
+            1000 / ramp_down_time) # mA per second
+
+    def send(self, target, motor_speed_erpm):
+        self._motor_setpoint.set_motor_current_milliamps(target)
+
+class SpeedControl(ControlStrategy):
+    """Motor speed control, motor target in ERPM"""
+
+    def __init__(self, motor_setpoint, min_erpm_start, release_erpm, ramp_up_time, ramp_down_time, max_erpm_filter_shift = 7):
+        """Speed control
+        :param ~VescSetpointPublisher motor_setpoint: used to send the motor speed to VESC
+        :param int min_erpm_start: min motor speed in ERPM
+        :param int release_erpm: when the target is 0 and the motor is slower than this, the motor current is set to 0 to release the motor
+        :param float ramp_up_time: ramp up time in seconds for each 1 ERPM
+        :param float ramp_down_time: ramp down time in seconds for each 1 ERPM
+        :param int max_erpm_filter_shift: low pass filter strength of the max ERPM
+        """
+        super().__init__(
+            motor_setpoint,
+            min_erpm_start,
+            0, # the max ERPM is set on each max_target()
+            1 / ramp_up_time, # ERPM per second
+            1 / ramp_down_time) # ERPM per second
+        self._release_erpm = release_erpm
+        self._max_erpm_filter = fixed_point.LowPass(max_erpm_filter_shift)
+
+    def max_target(self, value):
+        """Max motor speed in ERPM, low pass filtered
+        :param int value: max motor speed in ERPM, like from the battery voltage
+        """
+        self._max_target = self._max_erpm_filter.update(value)
+        return self._max_target
+
+    def send(self, target, motor_speed_erpm):
+        # when speed is near zero, set motor current to 0 to release the motor
+        if target == 0 and motor_speed_erpm < self._release_erpm:
+            self._motor_setpoint.set_motor_current_milliamps(0)
+        else:
+            self._motor_setpoint.set_motor_speed_erpm(target)
+
+    def stop(self):
+        self._motor_setpoint.set_motor_speed_erpm(0)
@@ -0,0 +1,89 @@
+import array
+
+def build_curve(input_min, input_max, output_max, exponent = 1.0, factor = 1.0, output_limit = None):
+    """Build a lookup table that maps an integer input to an output x100, as integer
+    :param int input_min: input value for output 0, lower inputs also give 0
+    :param int input_max: input value for output_max, the table has input_max + 1 values
+    :param float output_max: output value at input_max, before the factor
+    :param float exponent: curve shape: 1.0 is linear, higher than 1.0 gives less output on low inputs and more on high inputs
+    :param float factor: the output is multiplied by this factor
+    :param float output_limit: max output value after the factor, defaults to output_max
+    return: array with the output x100 for each input value
+    """
+    if output_limit is None:
+        output_limit = output_max
+    output_limit_x100 = int(output_limit * 100)
+
+    table = array.array('H', [0] * (input_max + 1))
+    for i in range(input_min + 1, input_max + 1):
+        normalized = (i - input_min) / (input_max - input_min)
+        value_x100 = int(output_max * factor * (normalized ** exponent) * 100 + 0.5) # rounded, not truncated
+        table[i] = min(value_x100, output_limit_x100)
+
+    return table
+
+class AssistCurve(object):
+    """Torque sensor and throttle to motor current, from precomputed lookup tables.
+    There is one table for each assist level, over the torque_weight_x10 range, so the motor control only needs to
+    clamp the input and do a table lookup, instead of calculating the map_range() and assist level factor in float.
+    The tables should be built again if the settings change."""
+
+    def __init__(self, torque_weight_min_x10, torque_weight_max_x10, motor_max_current, assist_level_factors, torque_exponent = 1.0, throttle_max = 1000):
+        """Assist curve
+        :param int torque_weight_min_x10: min torque weight x10 to start the motor
+        :param int torque_weight_max_x10: torque weight x10 for the max motor current, higher values are clamped
+        :param float motor_max_current: max motor current in Amps
+        :param list assist_level_factors: motor current factor for each assist level
+        :param float torque_exponent: torque curve shape: 1.0 is linear, higher than 1.0 gives less assist on low torque
+        :param int throttle_max: max throttle value, for the max motor current
+        """
+        self._torque_weight_min_x10 = torque_weight_min_x10
+        self._torque_weight_max_x10 = torque_weight_max_x10
+        self._motor_max_current = motor_max_current
+        self._torque_exponent = torque_exponent
+        self._throttle_max = throttle_max
+        self.build(assist_level_factors)
+
+    def build(self, assist_level_factors):
+        """Build the lookup tables, at boot or when the assist level factors change
+        :param list assist_level_factors: motor current factor for each assist level
+        """
+        self._torque_tables = [
+            build_curve(
+                self._torque_weight_min_x10,
+                self._torque_weight_max_x10,
+                self._motor_max_current,
+                exponent = self._torque_exponent,
+                factor = factor)
+            for factor in assist_level_factors]
+
+        self._throttle_table = build_curve(
+            0,
+            self._throttle_max,
+            self._motor_max_current)
+
+    def torque_motor_current_x100(self, assist_level, torque_weight_x10):
+        """Motor current for the torque sensor weight, with the assist level factor
+        :param int assist_level: assist level
+        :param int torque_weight_x10: torque sensor weight x10
+        return: motor current x100
+        """
+        if torque_weight_x10 > self._torque_weight_max_x10:
+            torque_weight_x10 = self._torque_weight_max_x10
+        elif torque_weight_x10 < 0:
+            torque_weight_x10 = 0
+
+        return self._torque_tables[assist_level][torque_weight_x10]
+
+    def throttle_motor_current_x100(self, throttle_value):
+        """Motor current for the throttle value
+        :param int throttle_value: throttle value
+        return: motor current x100
+        """
+        throttle_value = int(throttle_value)
+        if throttle_value > self._throttle_max:
+            throttle_value = self._throttle_max
+        elif throttle_value < 0:
+            throttle_value = 0
+
+        return self._throttle_table[throttle_value]
@@ -0,0 +1,63 @@
+import canio
+
+# extended CAN IDs are 29 bits
+_EXTENDED_ID_MASK = 0x1FFFFFFF
+
+class CanRouter(object):
+    """Shared listener of a CAN bus, for all the devices on it.
+    ESP32 has a single CAN receive FIFO, so only one listener can be open on the bus. Each device adds the CAN IDs it
+    wants to receive and the messages are routed to the device by the exact ID, so the devices with overlapping IDs
+    do not get each other messages, like the torque sensor 0x1f83100 and VESC with controller ID 0."""
+
+    def __init__(self, can_bus):
+        """CAN router
+        :param ~canio.CAN can_bus: CAN bus
+        """
+        self.can_bus = can_bus
+        self._handlers = {} # CAN ID: function(message)
+        self._listener = None
+
+        # statistics
+        self.received = 0 # messages routed to a device
+        self.unrouted = 0 # messages with an ID no device did add, that passed the hardware filter
+
+    def add_route(self, can_id, handler):
+        """Route the messages with this CAN ID to a device, should be called only at startup
+        :param int can_id: extended CAN ID
+        :param function handler: function(message) called for each message received with this CAN ID
+        """
+        self._handlers[can_id] = handler
+
+        # listen again, with a single match for all the IDs (one match is what the ESP32 hardware filter has):
+        # the mask has only the bits that are the same on all the IDs, the other messages are dropped on receive()
+        if self._listener is not None:
+            self._listener.deinit()
+        ids = list(self._handlers)
+        mask = _EXTENDED_ID_MASK
+        for other_id in ids:
+            mask &= ~(other_id ^ ids[0])
+        self._listener = self.can_bus.listen(
+            matches = [canio.Match(ids[0], mask = mask, extended = True)],
+            timeout = 0)
+
+    def receive(self):
+        """Route the waiting messages to the devices, without blocking
+        return: number of messages routed
+        """
+        listener = self._listener
+        count = 0
+        if listener is None:
+            return count
+
+        handlers = self._handlers
+        while listener.in_waiting():
+            message = listener.receive()
+            handler = handlers.get(message.id)
+            if handler is None:
+                self.unrouted += 1
+            else:
+                handler(message)
+                count += 1
+
+        self.received += count
+        return count
@@ -0,0 +1,181 @@
+import asyncio
+import math
+import vesc_session
+import periodic_task
+import profiler
+import control_strategy
+
+class VehicleProfile(object):
+    """Declarative description of a vehicle, used by ControlEngine.
+    The inputs are functions, so each vehicle maps its own sensors (throttle, torque sensor, brakes) to the motor target,
+    while the limits, ramps, control scheme and wheel geometry are plain values."""
+
+    def __init__(self,
+            name,
+            motor_target,
+            brakes_are_active,
+            max_erpm = None,
+            scheme = 'current',
+            motor_min_current_start = 2.0,
+            motor_max_current_limit = 20.0,
+            ramp_up_time = 0.05,
+            ramp_down_time = 0.05,
+            min_erpm_start = 1000,
+            release_erpm = 750,
+            wheel_diameter_mm = 0,
+            motor_poles_pair = 15,
+            control_period_ms = 20,
+            motor_control_enabled = True,
+            current_deadband = 0.1,
+            erpm_deadband = 20,
+            setpoint_resend_period = 0.1):
+        """Vehicle profile
+        :param str name: vehicle name
+        :param function motor_target: function(max_target) that returns the motor target from the inputs, in mA for current scheme and ERPM for speed scheme
+        :param function brakes_are_active: function() that returns True when the brakes are active
+        :param function max_erpm: function() that returns the max motor speed in ERPM, for the speed scheme
+        :param str scheme: motor control scheme, 'current' or 'speed'
+        :param float motor_min_current_start: min motor current in Amps, as a too low value will make the motor vibrate and not run
+        :param float motor_max_current_limit: max motor current in Amps
+        :param float ramp_up_time: ramp up time in seconds for each 1A (current scheme) or 1 ERPM (speed scheme)
+        :param float ramp_down_time: ramp down time in seconds for each 1A (current scheme) or 1 ERPM (speed scheme)
+        :param int min_erpm_start: min motor speed in ERPM, for the speed scheme
+        :param int release_erpm: with target 0 and lower motor speed, the motor current is set to 0 to release the motor, for the speed scheme
+        :param int wheel_diameter_mm: wheel diameter in mm, for the wheel speed
+        :param int motor_poles_pair: motor poles pair, for the wheel speed
+        :param int control_period_ms: motor control period in milliseconds
+        :param bool motor_control_enabled: if False, the motor control task is not run and only the VESC heart beat and telemetry are
+        :param float current_deadband: min change of motor current in Amps to send a new value to VESC
+        :param int erpm_deadband: min change of motor speed in ERPM to send a new value to VESC
+        :param float setpoint_resend_period: max time in seconds without sending the motor target to VESC
+        """
+        self.name = name
+        self.motor_target = motor_target
+        self.brakes_are_active = brakes_are_active
+        self.max_erpm = max_erpm
+        self.scheme = scheme
+        self.motor_min_current_start = motor_min_current_start
+        self.motor_max_current_limit = motor_max_current_limit
+        self.ramp_up_time = ramp_up_time
+        self.ramp_down_time = ramp_down_time
+        self.min_erpm_start = min_erpm_start
+        self.release_erpm = release_erpm
+        self.wheel_diameter_mm = wheel_diameter_mm
+        self.motor_poles_pair = motor_poles_pair
+        self.control_period_ms = control_period_ms
+        self.motor_control_enabled = motor_control_enabled
+        self.current_deadband = current_deadband
+        self.erpm_deadband = erpm_deadband
+        self.setpoint_resend_period = setpoint_resend_period
+
+# wheel speed factor is in Q16 format
+_SPEED_Q = 16
+
+class ControlEngine(object):
+    """Vehicle control engine: VESC heart beat and telemetry, and the motor control loop, for any vehicle profile.
+    The control scheme is chosen once at boot and the motor control loop runs on fixed deadlines, with integer math."""
+
+    def __init__(self, profile, vesc, vehicle_data, on_telemetry = None):
+        """Control engine
+        :param ~VehicleProfile profile: vehicle profile
+        :param ~Vesc vesc: VESC transport, Vesc or VescCan
+        :param object vehicle_data: vehicle data object, also used by the VESC transport. motor_target is updated on each motor control step
+        :param function on_telemetry: function() called when new VESC data is received
+        """
+        self.profile = profile
+        self._data = vehicle_data
+        self._on_telemetry = on_telemetry
+
+        # VESC
+        self.vesc = vesc_session.VescSession(vesc)
+        self.motor_setpoint = vesc_session.VescSetpointPublisher(
+            self.vesc,
+            current_deadband = profile.current_deadband,
+            erpm_deadband = profile.erpm_deadband,
+            resend_period = profile.setpoint_resend_period)
+
+        # motor control strategy: motor target in mA on current scheme and in ERPM on speed scheme
+        if profile.scheme == 'current':
+            self.strategy = control_strategy.CurrentControl(
+                self.motor_setpoint,
+                profile.motor_min_current_start,
+                profile.motor_max_current_limit,
+                profile.ramp_up_time,
+                profile.ramp_down_time)
+        elif profile.scheme == 'speed':
+            self.strategy = control_strategy.SpeedControl(
+                self.motor_setpoint,
+                profile.min_erpm_start,
+                profile.release_erpm,
+                profile.ramp_up_time,
+                profile.ramp_down_time)
+        else:
+            raise ValueError("unknown motor control scheme: " + profile.scheme)
+
+        # functions bound once, for the motor control loop
+        self._motor_target = profile.motor_target
+        self._brakes_are_active = profile.brakes_are_active
+        self._max_erpm = profile.max_erpm
+        self._max_target = self.strategy.max_target
+        self._update = self.strategy.update
+
+        # wheel speed in km/h = ERPM / poles pair * wheel diameter in mm * pi * 60 minutes / 1000000 mm per km
+        self._speed_factor_q16 = 0
+        if profile.wheel_diameter_mm > 0:
+            self._speed_factor_q16 = int(profile.wheel_diameter_mm * math.pi * 60 / (profile.motor_poles_pair * 1000000) * (1 << _SPEED_Q))
+
+        # execution time profiles, send 'p' on the serial console to enable them and 's' to print them
+        self._profile_vesc_telemetry = profiler.Profile('vesc telemetry')
+        self.motor_control_task = periodic_task.PeriodicTask(
+            'motor control',
+            profiler.Profile('motor control').wrap(self.motor_control),
+            period_ms = profile.control_period_ms)
+
+    def motor_control(self):
+        """One step of the motor control: read the inputs, apply the min target, limit and ramp and send the motor target"""
+        max_target = self._max_target(self._max_erpm() if self._max_erpm is not None else 0)
+        motor_target = self._motor_target(max_target)
+        self._data.motor_target = self._update(motor_target, self._brakes_are_active(), self._data.motor_speed_erpm)
+
+    @property
+    def wheel_speed(self):
+        """Wheel speed in km/h, from the motor speed"""
+        erpm = self._data.motor_speed_erpm
+        if erpm <= 0:
+            return 0
+        return (erpm * self._speed_factor_q16) >> _SPEED_Q
+
+    async def task_vesc_heartbeat(self):
+        while True:
+            # VESC heart beat must be sent more frequently than 1 second, otherwise the motor will stop.
+            # Sent only if no motor command was sent recently
+            self.vesc.heart_beat()
+
+            # idle 100ms
+            await asyncio.sleep(0.1)
+
+    async def task_vesc_telemetry(self):
+        while True:
+            # process the VESC responses as they arrive and ask for new data, without blocking
+            self._profile_vesc_telemetry.start()
+            new_data = self.vesc.telemetry()
+            self._profile_vesc_telemetry.stop()
+
+            if new_data and self._on_telemetry is not None:
+                self._on_telemetry()
+
+            # idle 10ms
+            await asyncio.sleep(0.01)
+
+    async def run(self, *tasks):
+        """Run the engine tasks and the vehicle tasks, forever
+        :param tasks: vehicle specific tasks, like the display
+        """
+        if self.profile.motor_control_enabled:
+            tasks = (self.motor_control_task.run(),) + tasks
+
+        await asyncio.gather(
+            self.task_vesc_heartbeat(),
+            self.task_vesc_telemetry(),
+            profiler.task_serial_stats([self.motor_control_task] + profiler.profiles), # send 's' on the serial console to print the timing statistics
+            *tasks)
@@ -11,12 +11,12 @@ class EBike(object):
         self.motor_power = 0
         self.motor_speed_erpm = 0
         self.motor_temperature_sensor_x10 = 0
-        self.previous_motor_current_target = True
         self.brakes_are_active = False
         self.torque_weight_x10 = 0
         self.cadence = 0
         self.human_pedal_power = 0
         self.ramp_last_time = time.monotonic_ns()
-        self.motor_current_target = 0
+        self.motor_target = 0 # motor current target in mA
         self.assist_level = 0
-        self.speed = 0
\ No newline at end of file
+        self.speed = 0
+        self.command_ack = 0 # sequence of the last command received from the display
\ No newline at end of file
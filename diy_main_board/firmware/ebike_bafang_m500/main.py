@@ -1,17 +1,22 @@
 import board
-import time
 import supervisor
-import array
-import simpleio
+import microcontroller
 import asyncio
 import ebike_data
 import throttle
 import brake_sensor
 import wheel_speed_sensor
 import torque_sensor
+import torque_calibration
+import torque_filter
+import pedal_power
 import motor_temperature_sensor
 import vesc
+import vesc_can
+import profiler
 import display
+import assist_curve
+import control_engine
 import esp32
 
 # Tested on a ESP32-S3-DevKitC-1-N8R2
@@ -21,6 +26,8 @@ import esp32
 
 torque_sensor_weight_min_to_start_x10 = 40 # (value in kgs) let's avoid any false startup, we will need this minimum weight on the pedals to start
 torque_sensor_weight_max_x10 = 400 # torque sensor max value is 40 kgs. Let's use the max range up to 40 kgs
+torque_sensor_curve_exponent = 1.0 # 1.0 is linear, higher values give less assist on low torque and more on high torque
+torque_sensor_revolution_fraction = 2 # torque is averaged over 1 / this value of a crank revolution: 1 is a full revolution, 2 half a revolution
 
 motor_min_current_start = 2 # to much lower value will make the motor vibrate and not run, so, impose a min limit (??)
 motor_max_current_limit = 30.0 # max value, be carefull to not burn your motor
@@ -32,6 +39,16 @@ throttle_enable = True # should throttle be used?
 
 cranck_lenght_mm = 170
 
+wheel_circumference_mm = 2325 # 740mm wheel diameter * pi
+wheel_speed_sensor_magnets = 1 # number of magnets on the wheel
+speed_in_mph = True # speed sent to the display in mph, or in km/h if False
+
+# VESC can be connected by UART or by the CAN bus shared with the torque sensor.
+# Over CAN, VESC broadcasts the motor data at 50 - 100Hz, so there is no need to poll it.
+# The VESC CAN baudrate must be set to 250k (the torque sensor baudrate) and the CAN status messages 1 to 5 enabled.
+vesc_use_can = False
+vesc_can_controller_id = 0 # VESC controller ID, as configured on VESC Tool
+
 # debug options
 enable_print_ebike_data_to_terminal = False
 enable_debug_log_cvs = False
@@ -48,11 +65,20 @@ brake_sensor = brake_sensor.BrakeSensor(
    board.IO10) # brake sensor pin
 
 wheel_speed_sensor = wheel_speed_sensor.WheelSpeedSensor(
-   board.IO46) # wheel speed sensor pin
+   board.IO46, # wheel speed sensor pin
+   wheel_circumference_mm,
+   magnets = wheel_speed_sensor_magnets)
+
+# the torque sensor zero is learned while not pedaling and saved on the NVM
+torque_calibration = torque_calibration.TorqueCalibration(
+    microcontroller.nvm,
+    default_zero_raw = 750) # torque sensor raw value with no weight on the pedals
 
 torque_sensor = torque_sensor.TorqueSensor(
     board.IO21, # CAN tx pin
-    board.IO47) # CAN rx pin
+    board.IO47, # CAN rx pin
+    calibration = torque_calibration,
+    crank_filter = torque_filter.CrankTorqueFilter(torque_sensor_revolution_fraction)) # the torque pulses twice per crank revolution
   
 throttle = throttle.Throttle(
     board.IO18, # ADC pin for throttle
@@ -63,13 +89,36 @@ throttle_over_max_error = 58000 # if throttle value is over this value, somethin
 motor_temperature_sensor = motor_temperature_sensor.MotorTemperatureSensor(
    board.IO3) # motor temperature sensor pin
 
+# torque and throttle to motor current lookup tables, built at boot for each assist level
+assist_curve = assist_curve.AssistCurve(
+    torque_sensor_weight_min_to_start_x10,
+    torque_sensor_weight_max_x10,
+    motor_max_current_limit,
+    assist_level_factor_table,
+    torque_exponent = torque_sensor_curve_exponent)
+
+human_pedal_power = pedal_power.HumanPedalPower(cranck_lenght_mm)
+
 esp32 = esp32.ESP32()
 
 ebike = ebike_data.EBike()
-vesc = vesc.Vesc(
-    board.IO14, # UART TX pin tebike_app_datahat connect to VESC
-    board.IO13, # UART RX pin that connect to VESC
-    ebike) #VESC data object to hold the VESC data
+if vesc_use_can:
+    vesc = vesc_can.VescCan(
+        torque_sensor.can_router, # CAN bus shared with the torque sensor
+        vesc_can_controller_id,
+        ebike) #VESC data object to hold the VESC data
+else:
+    vesc = vesc.Vesc(
+        board.IO14, # UART TX pin that connect to VESC
+        board.IO13, # UART RX pin that connect to VESC
+        ebike, #VESC data object to hold the VESC data
+        telemetry_fields = ( # VESC data used by this firmware
+            vesc.VALUE_TEMPERATURE_MOSFET,
+            vesc.VALUE_MOTOR_CURRENT,
+            vesc.VALUE_BATTERY_CURRENT,
+            vesc.VALUE_ERPM,
+            vesc.VALUE_BATTERY_VOLTAGE,
+            vesc.VALUE_FAULT_CODE))
 
 display = display.Display(
     board.IO12, # UART TX pin that connect to display UART RX pin
@@ -81,8 +130,9 @@ def check_brakes():
     """
     if ebike.brakes_are_active == False and brake_sensor.value == True:
         # brake / coast the motor
-        vesc.brake()
-        ebike.motor_current_target = 0
+        engine.vesc.brake()
+        engine.strategy.ramp.reset(0)
+        ebike.motor_target = 0
         ebike.brakes_are_active = True
       
     elif ebike.brakes_are_active == True and brake_sensor.value == False:
@@ -97,31 +147,14 @@ def print_ebike_data_to_terminal():
     if ebike.motor_current < 0:
        ebike.motor_current = 0
   
-    #print(f" m_cur_t {ebike.motor_current_target:2.1f} | m_cur {ebike.motor_current:2.1f} | b_cur {ebike.battery_current:2.1f}", end='\r')
+    #print(f" m_cur_t {(ebike.motor_target / 1000.0):2.1f} | m_cur {ebike.motor_current:2.1f} | b_cur {ebike.battery_current:2.1f}", end='\r')
     #print(f" trq {ebike.torque_weight_x10: 2.1f} | cad {ebike.cadence: 3} | wheel {ebike.wheel_speed}", end='\r')
     print(f"b_v {ebike.battery_voltage:2.1f} | thr {throttle.adc_value:6} | thr {(throttle.value / 10.0):2.1f} %", end='\n')
     #print(f"mot_cur {ebike.motor_current:2.1f} | b_cur {ebike.battery_current:2.1f} | b_v {ebike.battery_voltage:2.1f} | m_p {int(ebike.motor_power)}")
     #print(f"esp temp {(esp32.temperature_x10 / 10.0):3.1f} | vesc temp {(ebike.vesc_temperature_x10 / 10.0):3.1f} | {(motor_temperature_sensor.value_x10  / 10.0):3.1f}")
+    #print(f"vesc latency {engine.vesc.latency_ms} ms | max {engine.vesc.latency_max_ms} ms | timeouts {engine.vesc.telemetry_timeouts} | heart beats {engine.vesc.heart_beats}")
+    #print(f"motor setpoint sent {engine.motor_setpoint.sent} | suppressed {engine.motor_setpoint.suppressed}")
     
-def utils_step_towards(current_value, target_value, step):
-    """ Move current_value towards the target_value, by increasing / decreasing by step
-    """
-    value = current_value
-
-    if current_value < target_value:
-        if (current_value + step) < target_value:
-            value += step
-        else:
-            value = target_value
-    
-    elif current_value > target_value:
-        if (current_value - step) > target_value:
-            value -= step
-        else:
-            value = target_value
-
-    return value
-
 async def task_log_data():
     while True:
         # log data to local file system CSV file
@@ -139,13 +172,40 @@ async def task_log_data():
         # idle 25ms, fine tunned
         await asyncio.sleep(0.025)
 
+# execution time profiles of the task bodies, send 'p' on the serial console to enable them and 's' to print them
+profile_display_process_data = profiler.Profile('display process data')
+profile_display_send_data = profiler.Profile('display send data')
+profile_torque_sensor_receive = profiler.Profile('torque sensor receive')
+
+async def task_torque_sensor_receive():
+    while True:
+        # move the torque sensor messages from the CAN FIFO to the torque sensor samples ring buffer
+        profile_torque_sensor_receive.start()
+        torque_sensor.receive()
+        profile_torque_sensor_receive.stop()
+
+        # idle 5ms: the torque sensor sends about 100 messages per second
+        await asyncio.sleep(0.005)
+
+async def task_torque_calibration_save():
+    while True:
+        # writing the flash memory is slow and can stall the other tasks, so the learned torque sensor zero
+        # is saved on the NVM only from this low priority task and while the motor is stopped
+        if torque_calibration.save_pending and ebike.motor_target == 0:
+            torque_calibration.save()
+
+        # idle 1 second
+        await asyncio.sleep(1.0)
+
 async def task_display_process_data():
     while True:
         # are breaks active and we should disable the motor?
         #check_brakes()
 
         # need to process display data periodically
+        profile_display_process_data.start()
         display.process_data()
+        profile_display_process_data.stop()
 
         # idle 10ms
         await asyncio.sleep(0.01)
@@ -155,205 +215,91 @@ async def task_display_send_data():
         # are breaks active and we should disable the motor?
         #check_brakes()
 
+        # wheel speed, from the pulses counted by the hardware since the last time
+        profile_display_send_data.start()
+        if speed_in_mph:
+            ebike.speed = (wheel_speed_sensor.speed_x10 * 621) // 10000
+        else:
+            ebike.speed = wheel_speed_sensor.speed_x10 // 10
+
         # need to process display data periodically
         display.send_data()
+        profile_display_send_data.stop()
 
-        # idle 100ms
-        await asyncio.sleep(0.1)
+        # idle 50ms: most packages are small deltas, with only the fields that changed
+        await asyncio.sleep(0.05)
 
-async def task_vesc_heartbeat():
-    while True:
-        # are breaks active and we should disable the motor?
-        #check_brakes()
-        
-        # VESC heart beat must be sent more frequently than 1 second, otherwise the motor will stop
-        vesc.send_heart_beat()
-        
-        # ask for VESC latest data
-        vesc.refresh_data()
-
-        # let's calculate here this:
-        ebike.motor_power = ebike.battery_voltage * ebike.battery_current
-
-        # should we print EBike data to terminal?
-        if enable_print_ebike_data_to_terminal == True:
-            print_ebike_data_to_terminal()
-
-        # idle 500ms
-        await asyncio.sleep(0.5)
-
-
-# to keep time for a timeout count
-pedal_human_power__time = 0
-pedal_human_power__torque_weight_array_x10 = array.array('I', (0 for _ in range(255)))
-pedal_human_power__cadence_array = array.array('I', (0 for _ in range(255)))
-pedal_human_power__average_counter = 0
-pedal_human_power__temp_x10 = 0
-
-def calculate_human_pedal_power(torque_weight, cadence, cranck_lenght_mm):
-    global pedal_human_power__time
-    global pedal_human_power__torque_weight_array_x10
-    global pedal_human_power__cadence_array
-    global pedal_human_power__average_counter
-    global pedal_human_power__temp_x10
-
-     # store values for later average 
-    pedal_human_power__torque_weight_array_x10[pedal_human_power__average_counter] = torque_weight
-    pedal_human_power__cadence_array[pedal_human_power__average_counter] = cadence
-    pedal_human_power__average_counter += 1
-
-    # ever 1 second, calculate the pedal_human_power
-    now = time.monotonic()
-    if now > (pedal_human_power__time + 1.0):
-        pedal_human_power__time = now
-
-        counter = pedal_human_power__average_counter
-        sum_torque_weight_x10 = 0
-        sum_cadence = 0
-        while counter > 1:
-            counter -= 1
-            sum_torque_weight_x10 += pedal_human_power__torque_weight_array_x10[pedal_human_power__average_counter]
-            sum_cadence += pedal_human_power__cadence_array[pedal_human_power__average_counter]
-
-        if pedal_human_power__average_counter > 0:
-            torque_weight_average_x10 = (sum_torque_weight_x10 / pedal_human_power__average_counter)
-            cadence_average = (sum_cadence / pedal_human_power__average_counter)
-
-            # Force (Nm) = weight Kg * 9.81 * arm cranks lenght
-            force = torque_weight_average_x10 * 9.81 * (cranck_lenght_mm / 100.0)
-
-            # pedal_human_power = torque * cadence * ((2 * pi) / 60) 
-            # ((2 * pi) / 60) = 0.10467
-            pedal_human_power__temp_x10 = int(force * cadence_average * 1.0467)
-
-        # need to reset this
-        pedal_human_power__average_counter = 0
-    #print("human power: ", pedal_human_power__temp_x10 / 10.0)
-    return int(pedal_human_power__temp_x10 / 10.0)
-
-motor_current_target__torque_sensor = 0
-def motor_control():
+def vesc_telemetry():
+    # let's calculate here this:
+    ebike.motor_power = ebike.battery_voltage * ebike.battery_current
+
+    # should we print EBike data to terminal?
+    if enable_print_ebike_data_to_terminal == True:
+        print_ebike_data_to_terminal()
+
+def motor_target(motor_max_target):
     ##########################################################################################
     # Torque sensor input processing
 
     # read the values from torque sensor
+    motor_current_target__torque_sensor = 0 # mA
     torque_weight_x10, cadence = torque_sensor.value
     if torque_weight_x10 is not None:
         # store values for later usage if needed
         ebike.torque_weight_x10 = torque_weight_x10
         ebike.cadence = cadence
-        #ebike.human_pedal_power = calculate_human_pedal_power(ebike.torque_weight_x10, ebike.cadence, cranck_lenght_mm)
+
+        # human pedal power, averaged over the last second, is sent to the display
+        human_pedal_power.add(supervisor.ticks_ms(), torque_weight_x10, cadence)
+        ebike.human_pedal_power = human_pedal_power.value
         
-        # map torque value to motor current
-        motor_current_target__torque_sensor = simpleio.map_range(
-            torque_weight_x10,
-            torque_sensor_weight_min_to_start_x10, # min input
-            torque_sensor_weight_max_x10, # max input
-            0, # min output
-            motor_max_current_limit) # max output
-
-        # apply the assist level
-        assist_level_factor = assist_level_factor_table[ebike.assist_level]
-        motor_current_target__torque_sensor *= assist_level_factor
+        # map torque value to motor current, with the assist level
+        motor_current_target__torque_sensor = assist_curve.torque_motor_current_x100(ebike.assist_level, torque_weight_x10) * 10
     ##########################################################################################
 
     ##########################################################################################
     # Throttle
 
     # map throttle value to motor current
-    motor_current_target__throttle = 0
+    motor_current_target__throttle = 0 # mA
     if throttle_enable == True and throttle.adc_value < throttle_over_max_error:
-        # map torque value to motor current
-        motor_current_target__throttle = simpleio.map_range(
-            throttle.value,
-            0, # min input
-            1000, # max input
-            0, # min output
-            motor_max_current_limit) # max output
+        motor_current_target__throttle = assist_curve.throttle_motor_current_x100(throttle.value) * 10
     ##########################################################################################
 
-    # use the max value from either torque sensor or throttle
-    motor_current_target = max(motor_current_target__torque_sensor, motor_current_target__throttle)
-
     # save motor temperature sensor for later usage
     ebike.motor_temperature_sensor_x10 = motor_temperature_sensor.value_x10
 
-    # impose a min motor current value, as to much lower value will make the motor vibrate and not run (??)
-    if motor_current_target < motor_min_current_start:
-        motor_current_target = 0
-
     # provide a quick way to disable the motor
     if ebike.assist_level == 0:
-        motor_current_target = 0
-
-    # apply ramp up / down factor: faster when ramp down
-    if motor_current_target > ebike.motor_current_target:
-        ramp_time = ramp_up_time
-    else:
-        ramp_time = ramp_down_time
-        
-    time_now = time.monotonic_ns()
-    ramp_step = (time_now - ebike.ramp_last_time) / (ramp_time * 1000000000)
-    ebike.ramp_last_time = time_now
-    ebike.motor_current_target = utils_step_towards(ebike.motor_current_target, motor_current_target, ramp_step)
-
-    # let's limit the value
-    if ebike.motor_current_target > motor_max_current_limit:
-        ebike.motor_current_target = motor_max_current_limit
-
-    if ebike.motor_current_target < 0.0:
-        ebike.motor_current_target = 0
-
-    # if brakes are active, reset motor_current_target
-    if ebike.brakes_are_active == True:
-        ebike.motor_current_target = 0
-
-    # let's update the motor current, only if the target value changed
-    if ebike.motor_current_target != ebike.previous_motor_current_target:
-        ebike.previous_motor_current_target = ebike.motor_current_target
-        vesc.set_motor_current_amps(ebike.motor_current_target)
-
-async def task_read_sensors_control_motor():
-    while True:
-        # are breaks active and we should disable the motor?
-        #check_brakes() # no brake sensor
-
-        # motor control
-        motor_control()
-
-        # idle 20ms
-        await asyncio.sleep(0.02)
-
-
-import math
-WHEEL_DIAMETER_M = 0.74  # diameter in meters, adjust as necessary
-WHEEL_CIRCUMFERENCE_M = WHEEL_DIAMETER_M * math.pi
-WHEEL_CIRCUMFERENCE_MILES = WHEEL_CIRCUMFERENCE_M * 0.000621371
-
-async def task_calculate_speed():
-    last_activation_time = None
-
-    while True:
-        # wait for the sensor to be triggered
-        while not wheel_speed_sensor.value:
-            await asyncio.sleep(0.01)
-
-        if last_activation_time is not None:
-            # calculate the time difference in hours
-            rotation_time = time.monotonic_ns() - last_activation_time  # time in nanoseconds
-            rotation_time_hours = rotation_time / (3600.0 * 10**9)  # convert from ns to hours
-
-            # speed in mph
-            speed_mph = WHEEL_CIRCUMFERENCE_MILES / rotation_time_hours
-            ebike.speed = int(speed_mph)
-            #print(f"Speed: {ebike.speed} mph")
-
-        last_activation_time = time.monotonic_ns()
-
-        # wait for the sensor to be reset before the next loop iteration
-        while wheel_speed_sensor.value:
-            await asyncio.sleep(0.001)
-
+        return 0
+
+    # use the max value from either torque sensor or throttle.
+    # The control engine applies the min motor current, the max limit and the ramp up / down
+    return max(motor_current_target__torque_sensor, motor_current_target__throttle)
+
+def brakes_are_active():
+    # are breaks active and we should disable the motor?
+    #check_brakes() # no brake sensor
+    return ebike.brakes_are_active
+
+vehicle_profile = control_engine.VehicleProfile(
+    'Bafang M500',
+    motor_target,
+    brakes_are_active,
+    scheme = 'current',
+    motor_min_current_start = motor_min_current_start,
+    motor_max_current_limit = motor_max_current_limit,
+    ramp_up_time = ramp_up_time,
+    ramp_down_time = ramp_down_time)
+
+# VESC heart beat and telemetry, and the motor control every 20ms, are run by the control engine.
+# The VESC session keeps the heart beat, motor commands and telemetry independent,
+# and the motor current is sent only on meaningful changes, but at least every 100ms
+engine = control_engine.ControlEngine(
+    vehicle_profile,
+    vesc,
+    ebike,
+    on_telemetry = vesc_telemetry)
 
 async def main():
 
@@ -363,25 +309,22 @@ async def main():
     #read_sensors_control_motor_task = asyncio.create_task(task_read_sensors_control_motor())
     #display_process_data_task = asyncio.create_task(task_display_process_data())
     #display_send_data_task = asyncio.create_task(task_display_send_data())
-    #calculate_speed_task = asyncio.create_task(task_calculate_speed())
 
     # Start the tasks. Note that log_data_task may be disabled as a configuration
     if enable_debug_log_cvs == False:
-        await asyncio.gather(
-            task_vesc_heartbeat(),
-            task_read_sensors_control_motor(),
+        await engine.run(
+            task_torque_sensor_receive(),
+            task_torque_calibration_save(),
             task_display_process_data(),
             task_display_send_data(),
-            #task_calculate_speed(),
             )
     else:
         #log_data_task = asyncio.create_task(task_log_data())
-        await asyncio.gather(
-            task_vesc_heartbeat(),
-            task_read_sensors_control_motor(),
+        await engine.run(
+            task_torque_sensor_receive(),
+            task_torque_calibration_save(),
             task_display_process_data(),
             task_display_send_data(),
-            task_calculate_speed(),
             task_log_data(),
             )
   
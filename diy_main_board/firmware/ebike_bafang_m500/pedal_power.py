@@ -0,0 +1,70 @@
+import array
+import math
+from adafruit_ticks import ticks_diff
+
+# the power factor is in Q16 format
+_POWER_Q = 16
+
+class HumanPedalPower(object):
+    """Human pedal power, averaged over a time window.
+    power = torque (Nm) * cadence (RPM) * 2 * pi / 60, with torque = weight on the pedal * 9.81 * crank lenght.
+    The torque weight * cadence of each sample is added to time bins and to a running sum, and when a bin gets out of
+    the window its sum is subtracted, so each sample takes the same time no matter how many samples are in the window."""
+
+    def __init__(self, cranck_lenght_mm, window_ms = 1000, bin_ms = 100):
+        """Human pedal power
+        :param int cranck_lenght_mm: crank lenght in mm
+        :param int window_ms: average time window in milliseconds
+        :param int bin_ms: time bin size in milliseconds, the window moves in steps of this size
+        """
+        # watts for each torque weight x10 * cadence: 0.1 kg * 9.81 * crank lenght in meters * 2 * pi / 60
+        self._power_factor_q16 = int(0.1 * 9.81 * (cranck_lenght_mm / 1000.0) * (2 * math.pi / 60) * (1 << _POWER_Q) + 0.5)
+        self._bin_ms = bin_ms
+        self._bins = window_ms // bin_ms
+        self._bin_sums = array.array('L', [0] * self._bins)
+        self._bin_counts = array.array('L', [0] * self._bins)
+        self._index = 0 # current bin
+        self._bin_start = None # ticks_ms when the current bin started
+        self._sum = 0
+        self._count = 0
+
+    def add(self, time_ms, torque_weight_x10, cadence):
+        """Add a sample
+        :param int time_ms: ticks_ms of the sample
+        :param int torque_weight_x10: calibrated torque sensor weight x10
+        :param int cadence: cadence in RPM
+        """
+        if self._bin_start is None:
+            self._bin_start = time_ms
+
+        # move the window, removing the bins that got out of it
+        elapsed_bins = ticks_diff(time_ms, self._bin_start) // self._bin_ms
+        if elapsed_bins > 0:
+            self._bin_start += elapsed_bins * self._bin_ms
+            if elapsed_bins > self._bins:
+                elapsed_bins = self._bins
+            index = self._index
+            for _ in range(elapsed_bins):
+                index += 1
+                if index == self._bins:
+                    index = 0
+                self._sum -= self._bin_sums[index]
+                self._count -= self._bin_counts[index]
+                self._bin_sums[index] = 0
+                self._bin_counts[index] = 0
+            self._index = index
+
+        if torque_weight_x10 < 0:
+            torque_weight_x10 = 0
+        product = torque_weight_x10 * cadence
+        self._bin_sums[self._index] += product
+        self._bin_counts[self._index] += 1
+        self._sum += product
+        self._count += 1
+
+    @property
+    def value(self):
+        """Human pedal power in watts, averaged over the window"""
+        if self._count == 0:
+            return 0
+        return ((self._sum // self._count) * self._power_factor_q16) >> _POWER_Q
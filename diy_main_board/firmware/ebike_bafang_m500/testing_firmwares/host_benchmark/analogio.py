@@ -0,0 +1,12 @@
+#############################
+# Fake analogio module, to run the analog input drivers on a computer for testing.
+# The ADC value is set with AnalogIn.value.
+#############################
+
+class AnalogIn(object):
+    def __init__(self, pin = None):
+        self.value = 0
+        self.reference_voltage = 3.3
+
+    def deinit(self):
+        pass
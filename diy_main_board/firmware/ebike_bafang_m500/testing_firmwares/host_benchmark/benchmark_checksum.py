@@ -0,0 +1,45 @@
+#############################
+# Benchmark of the CRC-16 checksums, to run on a computer.
+# Compares the per frame cost of the native binascii.crc_hqx path, used when the runtime has it, with the
+# array('H') lookup table path used on CircuitPython and the split bytes table of crc16_ccitt_into(), used to send the
+# VESC frames, for the VESC frames (5 bytes command, 78 bytes COMM_GET_VALUES response) and the display link packages
+# (CRC-16/MODBUS, lookup table only).
+#
+# Run from this folder: python benchmark_checksum.py
+#############################
+
+import sys
+import time
+sys.path.insert(0, '../..') # ebike_bafang_m500 folder
+
+import checksum
+
+CALLS = 20000
+
+def crc_into(data, buffer = bytearray(2)):
+    checksum.crc16_ccitt_into(data, buffer, 0)
+
+def elapsed_us(function, data):
+    start = time.perf_counter_ns()
+    for _ in range(CALLS):
+        function(data)
+    return (time.perf_counter_ns() - start) / CALLS / 1000
+
+# CRC-16/XMODEM and CRC-16/MODBUS check values, of b'123456789'
+assert checksum._crc16_ccitt_native(b'123456789') == 0x31C3
+assert checksum._crc16_ccitt_table(b'123456789') == 0x31C3
+assert checksum.crc16_modbus(b'123456789') == 0x4B37
+
+print(f"crc16_ccitt uses the {'native crc_hqx' if checksum.crc16_ccitt is checksum._crc16_ccitt_native else 'lookup table'} path")
+print(f"{'':32} {'5 bytes':>10} {'78 bytes':>10}")
+for name, function in (
+        ("CCITT native crc_hqx", checksum._crc16_ccitt_native),
+        ("CCITT array('H') table", checksum._crc16_ccitt_table),
+        ("CCITT bytes table, into buffer", crc_into),
+        ("MODBUS array('H') table", checksum.crc16_modbus)):
+    results = []
+    for lenght in (5, 78):
+        # memoryview slice of a bigger buffer, like the drivers use
+        buffer = bytearray(range(lenght + 4))
+        results.append(elapsed_us(function, memoryview(buffer)[2: 2 + lenght]))
+    print(f"{name:32} {results[0]:7.2f} us {results[1]:7.2f} us")
@@ -0,0 +1,65 @@
+#############################
+# Benchmark of the fixed_point integer math and the float math it replaced, to run on a computer.
+# On CircuitPython each float result is a new object on the heap, so the integer versions also avoid the allocations,
+# that this benchmark on CPython does not show.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python benchmark_fixed_point.py
+#############################
+
+import sys
+import time
+sys.path.insert(0, '../..') # ebike_bafang_m500 folder
+
+import fixed_point
+
+CALLS = 100000
+
+def float_map_range(x, in_min, in_max, out_min, out_max):
+    """simpleio.map_range(), the float version used before"""
+    mapped = (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+    if out_min <= out_max:
+        return max(min(mapped, out_max), out_min)
+    return min(max(mapped, out_max), out_min)
+
+class FloatRamp(object):
+    """The float ramp used before: step from the elapsed time, on each update"""
+
+    def __init__(self, up_per_second, down_per_second):
+        self._up_per_ns = up_per_second / 1000000000
+        self._down_per_ns = down_per_second / 1000000000
+        self.value = 0.0
+        self._last_time = time.monotonic_ns()
+
+    def update(self, target_value):
+        now = time.monotonic_ns()
+        rate = self._up_per_ns if target_value > self.value else self._down_per_ns
+        self.value = fixed_point.step_towards(self.value, target_value, (now - self._last_time) * rate)
+        self._last_time = now
+        return self.value
+
+class FloatLowPass(object):
+    def __init__(self, factor):
+        self._factor = factor
+        self.value = 0.0
+
+    def update(self, value):
+        self.value += (value - self.value) * self._factor
+        return self.value
+
+def elapsed_us(function, *args):
+    start = time.perf_counter_ns()
+    for _ in range(CALLS):
+        function(*args)
+    return (time.perf_counter_ns() - start) / CALLS / 1000
+
+results = (
+    ("map_range", elapsed_us(float_map_range, 41234, 32767, 65535, 0, 1000), elapsed_us(fixed_point.map_range, 41234, 32767, 65535, 0, 1000)),
+    ("ramp update", elapsed_us(FloatRamp(20000, 25000).update, 15000), elapsed_us(fixed_point.Ramp(20000, 25000).update, 15000)),
+    ("low pass update", elapsed_us(FloatLowPass(1 / 8).update, 12000), elapsed_us(fixed_point.LowPass(3).update, 12000)),
+    ("clamp", elapsed_us(lambda value: max(0.0, min(value, 20000.0)), 25000.0), elapsed_us(fixed_point.clamp, 25000, 0, 20000)),
+)
+
+print(f"{'':16} {'float us':>9} {'fixed us':>9}")
+for name, float_us, fixed_us in results:
+    print(f"{name:16} {float_us:9.3f} {fixed_us:9.3f}")
@@ -0,0 +1,105 @@
+#############################
+# Benchmark of the display link FrameScanner, to run on a computer.
+# Compares it with the previous byte by byte state machine of Display / EBikeBoard._read_and_unpack, on a clean
+# stream of telemetry packages and on a noisy one, fed in chunks like read from the UART.
+#
+# Run from this folder: python benchmark_frame_scanner.py
+#############################
+
+import sys
+import time
+import random
+sys.path.insert(0, '../..') # ebike_bafang_m500 folder
+
+from checksum import crc16_modbus
+from uart_link import FrameScanner, TELEMETRY_SCHEMA
+
+PACKAGES = 5000
+CHUNK_SIZE = 64 # bytes read from the UART on each call
+NOISE_EVERY = 5 # on the noisy stream, a burst of noise every this number of packages
+
+class StateMachineScanner(object):
+    """The previous parser, byte by byte, with the same 5 states"""
+
+    def __init__(self):
+        self._state = 0
+        self._len = 0
+        self._cnt = 0
+        self.data = bytearray(255)
+        self.frames = 0
+        self.errors = 0
+
+    def feed(self, rx_array):
+        for data in rx_array:
+            if self._state == 0:
+                if data == 0:
+                    self.data[0] = data
+                    self._state = 1
+            elif self._state == 1:
+                if data == 1:
+                    self.data[1] = data
+                    self._state = 2
+                else:
+                    self._state = 0
+            elif self._state == 2:
+                if data == 2:
+                    self.data[2] = data
+                    self._state = 3
+                else:
+                    self._state = 0
+            elif self._state == 3:
+                self.data[3] = data
+                self._len = data
+                self._state = 4
+            elif self._state == 4:
+                self.data[self._cnt + 4] = data
+                self._cnt += 1
+                if self._cnt + 4 >= self._len + 2: # the len byte counts the header, plus the CRC
+                    crc = crc16_modbus(self.data[0: self._len])
+                    if crc == self.data[self._len] | (self.data[self._len + 1] << 8):
+                        self.frames += 1
+                    else:
+                        self.errors += 1
+                    self._cnt = 0
+                    self._state = 0
+
+class Telemetry(object):
+    pass
+
+def stream(noisy):
+    generator = random.Random(1)
+    data = Telemetry()
+    buffer = bytearray(64)
+    packages = bytearray()
+    for i in range(PACKAGES):
+        for name in TELEMETRY_SCHEMA.names:
+            setattr(data, name, generator.randrange(0, 100))
+        lenght = TELEMETRY_SCHEMA.pack_into(buffer, data, i & 0xFF)
+        packages += buffer[:lenght]
+        if noisy and i % NOISE_EVERY == 0:
+            # noise burst, with false start bytes
+            packages += bytes(generator.getrandbits(8) for _ in range(20)) + b'\x00\x01\x02\x30'
+    return bytes(packages)
+
+def run_frame_scanner(data):
+    scanner = FrameScanner()
+    buffer = bytearray(255)
+    for position in range(0, len(data), CHUNK_SIZE):
+        scanner.feed(data[position: position + CHUNK_SIZE])
+        while scanner.next_frame(buffer):
+            pass
+    return scanner
+
+def run_state_machine(data):
+    scanner = StateMachineScanner()
+    for position in range(0, len(data), CHUNK_SIZE):
+        scanner.feed(data[position: position + CHUNK_SIZE])
+    return scanner
+
+print(f"{'':16} {'':14} {'MB/s':>8} {'us/package':>11} {'packages':>9} {'errors':>7}")
+for name, data in (("clean stream", stream(False)), ("noisy stream", stream(True))):
+    for scanner_name, run in (("state machine", run_state_machine), ("FrameScanner", run_frame_scanner)):
+        start = time.perf_counter_ns()
+        scanner = run(data)
+        elapsed_ns = time.perf_counter_ns() - start
+        print(f"{name:16} {scanner_name:14} {len(data) * 1000 / elapsed_ns:8.2f} {elapsed_ns / PACKAGES / 1000:11.2f} {scanner.frames:9} {scanner.errors:7}")
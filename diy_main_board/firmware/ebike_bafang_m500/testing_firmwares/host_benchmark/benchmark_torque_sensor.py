@@ -0,0 +1,49 @@
+#############################
+# Benchmark of the torque sensor driver, to run on a computer with the fake canio module on this folder.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python benchmark_torque_sensor.py
+#############################
+
+import sys
+import time
+sys.path.insert(0, '../..') # ebike_bafang_m500 folder
+
+import canio
+import torque_sensor
+
+TORQUE_SENSOR_FRAMES_PER_TICK = 2 # the torque sensor sends about 100 messages per second, 2 per each 20ms motor control tick
+OTHER_FRAMES_PER_TICK = 5 # other devices on the same CAN bus, like the VESC status messages
+TICKS = 20000
+
+can_bus = canio.CAN()
+sensor = torque_sensor.TorqueSensor(None, None, can_bus = can_bus)
+
+torque_frames = [canio.Message(torque_sensor.TORQUE_SENSOR_CAN_ID, bytes([(1200 + i) & 0xff, (1200 + i) >> 8, i % 3 * 30, i & 0xff, 0, 0, 0, 0]), extended = True) for i in range(256)]
+other_frame = canio.Message(0x901, bytes(8), extended = True)
+
+elapsed_ns = 0
+receive_ns = 0
+average_ns = 0
+for tick in range(TICKS):
+    for i in range(OTHER_FRAMES_PER_TICK):
+        can_bus.inject(other_frame)
+    for i in range(TORQUE_SENSOR_FRAMES_PER_TICK):
+        can_bus.inject(torque_frames[(tick * TORQUE_SENSOR_FRAMES_PER_TICK + i) & 0xff])
+
+    start = time.perf_counter_ns()
+    sensor.receive()
+    receive_ns += time.perf_counter_ns() - start
+
+    start = time.perf_counter_ns()
+    torque_weight_x10, cadence = sensor.value
+    elapsed_ns += time.perf_counter_ns() - start
+
+    if tick % 10 == 0:
+        start = time.perf_counter_ns()
+        sensor.average(100)
+        average_ns += time.perf_counter_ns() - start
+
+print(f"ticks {TICKS} | frames {sensor.frames} | dropped {sensor.dropped_frames}")
+print(f"receive {receive_ns / TICKS / 1000:.2f} us | value {elapsed_ns / TICKS / 1000:.2f} us | average {average_ns / (TICKS // 10) / 1000:.2f} us")
+print(f"latest: torque_x10 {torque_weight_x10} | cadence {cadence} | raw {sensor.value_raw} | average 100ms {sensor.average(100)}")
@@ -0,0 +1,145 @@
+#############################
+# Benchmark of the VESC UART frames encoding and packets parsing, to run on a computer with the fake busio module on this folder.
+# Measures the time and the memory allocated on each call, with tracemalloc. CircuitPython has no binascii.crc_hqx,
+# so the CRC lookup table fallback is used here too, like on the board. The command frames must allocate 0 bytes.
+#
+# Run from this folder: python benchmark_vesc.py
+#############################
+
+import sys
+import time
+import struct
+import tracemalloc
+import collections
+sys.path.insert(0, '../..') # ebike_bafang_m500 folder
+
+import checksum
+import vesc
+
+# use the CRC lookup table, like on CircuitPython, and not the native binascii.crc_hqx
+vesc.crc16_ccitt = checksum._crc16_ccitt_table
+
+CALLS = 20000
+
+class AppData(object):
+    vesc_temperature_x10 = 0
+    motor_current = 0.0
+    battery_current = 0.0
+    motor_speed_erpm = 0
+    battery_voltage = 0.0
+    vesc_fault_code = 0
+
+def previous_encoder(uart, command, value):
+    # how the commands were sent before VescCommandFrame: a new command and a new frame on each call,
+    # and the CRC table list built again on each CRC
+    buf = bytearray(5)
+    buf[0] = command
+    struct.pack_into('>l', buf, 1, value)
+    table = list(checksum._CRC16_CCITT_TABLE)
+    crc = 0
+    for byte in buf:
+        crc = ((crc << 8) ^ table[(crc >> 8) ^ byte]) & 0xFFFF
+    frame = bytearray(1 + 1 + len(buf) + 2 + 1)
+    frame[0] = 2
+    frame[1] = len(buf)
+    frame[2: 2 + len(buf)] = buf
+    frame[-3] = crc >> 8
+    frame[-2] = crc & 0xff
+    frame[-1] = 3
+    uart.write(frame)
+
+def allocated_bytes(function, *args):
+    """Bytes allocated by each call: the most common value over CALLS calls, after a few calls to fill the caches.
+    An allocation done on every call is always counted, while the rare allocations of the measurement loop
+    itself are not"""
+    get_traced_memory = tracemalloc.get_traced_memory
+    reset_peak = tracemalloc.reset_peak
+    for _ in range(10):
+        function(*args)
+    calls = collections.Counter()
+    for _ in range(CALLS):
+        reset_peak()
+        before = get_traced_memory()[0]
+        function(*args)
+        calls[get_traced_memory()[1] - before] += 1
+    return calls.most_common(1)[0][0]
+
+def nothing(*args):
+    pass
+
+def elapsed_us(function, *args):
+    start = time.perf_counter_ns()
+    for _ in range(CALLS):
+        function(*args)
+    return (time.perf_counter_ns() - start) / CALLS / 1000
+
+def response_packet(payload):
+    frame = bytearray(2 + len(payload) + 3)
+    frame[0] = 2
+    frame[1] = len(payload)
+    frame[2: 2 + len(payload)] = payload
+    crc = checksum.crc16_ccitt(payload)
+    frame[-3] = crc >> 8
+    frame[-2] = crc & 0xff
+    frame[-1] = 3
+    return bytes(frame)
+
+def parse(parser, packet):
+    parser.feed(packet)
+    return parser.packet()
+
+def parse_values(motor, parser, packet):
+    motor._process_values(parse(parser, packet), 5)
+
+data = AppData()
+motor = vesc.Vesc(None, None, data, telemetry_fields = (vesc.VALUE_TEMPERATURE_MOSFET, vesc.VALUE_MOTOR_CURRENT, vesc.VALUE_ERPM, vesc.VALUE_BATTERY_VOLTAGE))
+uart = motor._uart
+frame = vesc.VescCommandFrame(vesc.COMM_SET_CURRENT, 4)
+parser = vesc.VescPacketParser()
+
+# COMM_GET_VALUES_SELECTIVE response with the fields asked: mask, temperature, motor current, ERPM, battery voltage
+selective_packet = response_packet(struct.pack('>BLhlLh', vesc.COMM_GET_VALUES_SELECTIVE, motor._telemetry_mask, 360, 1520, 12000, 480))
+# COMM_GET_VALUES response with all the fields, 79 bytes payload
+values_packet = response_packet(bytes([vesc.COMM_GET_VALUES]) + bytes(struct.calcsize('>' + vesc._VALUES_FORMAT)) + bytes(13))
+
+# the frames must be the same as before
+previous_encoder(uart, vesc.COMM_SET_CURRENT, 12345)
+expected = bytes(uart.last_written)
+motor.set_motor_current_milliamps(12345)
+assert bytes(uart.last_written) == expected, "VescCommandFrame differs from the previous encoder"
+assert bytes(parse(parser, selective_packet)) == selective_packet[2: -3]
+
+tracemalloc.start()
+# the measurement itself allocates, to read the traced memory: measured with a function that does nothing
+overhead = allocated_bytes(nothing, 0)
+def allocated(function, *args):
+    return allocated_bytes(function, *args) - overhead
+
+benchmarks = (
+    ("previous encoder, set current", previous_encoder, (uart, vesc.COMM_SET_CURRENT, 12345), None),
+    ("VescCommandFrame.set_value", frame.set_value, (12345,), 0),
+    ("Vesc.set_motor_current_milliamps", motor.set_motor_current_milliamps, (12345,), 0),
+    ("Vesc.set_motor_speed_erpm", motor.set_motor_speed_erpm, (12345,), 0),
+    ("Vesc.send_heart_beat", motor.send_heart_beat, (), 0),
+    ("Vesc.brake", motor.brake, (), 0),
+    ("VescPacketParser, 15 bytes packet", parse, (parser, selective_packet), None),
+    ("VescPacketParser, 84 bytes packet", parse, (parser, values_packet), None),
+    ("VescPacketParser + values, 15 bytes", parse_values, (motor, parser, selective_packet), None),
+)
+
+print(f"{'':38} {'us/call':>8} {'CPython bytes/call':>21}")
+failed = False
+for name, function, args, max_bytes in benchmarks:
+    bytes_allocated = allocated(function, *args)
+    tracemalloc.stop()
+    us = elapsed_us(function, *args)
+    tracemalloc.start()
+    result = ''
+    if max_bytes is not None:
+        ok = bytes_allocated <= max_bytes
+        failed = failed or not ok
+        result = 'no allocation' if ok else 'ALLOCATES'
+    print(f"{name:38} {us:8.2f} {bytes_allocated:21} {result}")
+
+if failed:
+    sys.exit("the command frames should not allocate memory")
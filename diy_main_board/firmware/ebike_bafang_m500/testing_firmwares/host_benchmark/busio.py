@@ -0,0 +1,57 @@
+#############################
+# Fake busio module, to run the UART drivers on a computer for benchmarks.
+# Only the parts used by the drivers are implemented: UART in_waiting, read, readinto and write.
+# Received bytes are added with UART.inject(). Writes only keep the last buffer written, so the fake does not
+# allocate memory when the drivers send, unless the UART is connected to another one with UART.connect().
+#############################
+
+class UART(object):
+    def __init__(self, tx = None, rx = None, baudrate = 9600, timeout = 1, receiver_buffer_size = 64):
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.receiver_buffer_size = receiver_buffer_size
+        self._rx = bytearray()
+        self.last_written = None
+        self._peer = None
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def read(self, nbytes = None):
+        if not self._rx:
+            return None
+        if nbytes is None:
+            nbytes = len(self._rx)
+        data = bytes(self._rx[:nbytes])
+        del self._rx[:nbytes]
+        return data
+
+    def readinto(self, buf):
+        lenght = min(len(buf), len(self._rx))
+        if lenght == 0:
+            return None
+        buf[0: lenght] = self._rx[:lenght]
+        del self._rx[:lenght]
+        return lenght
+
+    def write(self, buf):
+        self.last_written = buf
+        if self._peer is not None:
+            self._peer.inject(buf)
+        return len(buf)
+
+    def reset_input_buffer(self):
+        self._rx = bytearray()
+
+    def deinit(self):
+        pass
+
+    def inject(self, data):
+        """Add bytes to the receive buffer, like if they were received"""
+        self._rx += data
+
+    def connect(self, other):
+        """Connect TX and RX of both UARTs, so the bytes written on each one are received by the other"""
+        self._peer = other
+        other._peer = self
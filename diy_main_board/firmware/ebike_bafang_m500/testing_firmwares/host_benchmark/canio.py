@@ -0,0 +1,81 @@
+#############################
+# Fake canio module, to run the CAN drivers on a computer for benchmarks.
+# Only the parts used by the drivers are implemented: CAN.listen() with matches, Listener and Message.
+# Messages are added to the listeners with CAN.inject().
+# Like on ESP32, only one listener can be open at a time, with up to one match.
+#############################
+
+from collections import deque
+
+class Match(object):
+    def __init__(self, id, mask = None, extended = False):
+        self.id = id
+        self.mask = mask
+        self.extended = extended
+
+    def matches(self, message):
+        if self.mask is None:
+            return message.id == self.id
+        return (message.id & self.mask) == (self.id & self.mask)
+
+class Message(object):
+    def __init__(self, id, data, extended = False):
+        self.id = id
+        self.data = data
+        self.extended = extended
+
+class Listener(object):
+    def __init__(self, can_bus, matches, timeout):
+        self._can_bus = can_bus
+        self._matches = matches
+        self.timeout = timeout
+        self._fifo = deque(maxlen = can_bus.fifo_size)
+        self.overflows = 0
+
+    def _add(self, message):
+        if self._matches and not any(match.matches(message) for match in self._matches):
+            return
+        if len(self._fifo) == self._fifo.maxlen:
+            self.overflows += 1
+        self._fifo.append(message)
+
+    def in_waiting(self):
+        return len(self._fifo)
+
+    def receive(self):
+        return self._fifo.popleft() if self._fifo else None
+
+    def deinit(self):
+        self._can_bus.listeners.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.deinit()
+
+class CAN(object):
+    def __init__(self, tx = None, rx = None, baudrate = 250000, fifo_size = 32, max_listeners = 1, max_matches = 1):
+        self.baudrate = baudrate
+        self.fifo_size = fifo_size
+        self.max_listeners = max_listeners
+        self.max_matches = max_matches
+        self.listeners = []
+        self.sent = []
+
+    def listen(self, matches = None, timeout = 10):
+        if len(self.listeners) >= self.max_listeners:
+            raise ValueError("All RX FIFOs in use")
+        if matches and len(matches) > self.max_matches:
+            raise ValueError("Filters too complex")
+        listener = Listener(self, matches, timeout)
+        self.listeners.append(listener)
+        return listener
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def inject(self, message):
+        """Add a message to the listeners, like if it was received on the bus"""
+        for listener in self.listeners:
+            listener._add(message)
@@ -0,0 +1,35 @@
+#############################
+# Shared pytest fixtures of the host tests.
+# The fake clock is set on the modules with monkeypatch, so it is restored after each test and does not leak
+# into the other tests.
+#############################
+
+import pytest
+
+# adafruit_ticks.ticks_ms() wraps around at 2^29 milliseconds
+TICKS_PERIOD = 1 << 29
+
+class FakeTicks(object):
+    """Simulated adafruit_ticks.ticks_ms(), the time only moves with advance()"""
+
+    def __init__(self, now_ms = 0):
+        self.now_ms = now_ms
+
+    def ticks_ms(self):
+        return self.now_ms
+
+    def advance(self, ms):
+        self.now_ms = (self.now_ms + ms) % TICKS_PERIOD
+
+@pytest.fixture
+def fake_ticks(monkeypatch):
+    """Function(*modules, now_ms = 0) that sets a fake ticks_ms() on the modules and returns the FakeTicks"""
+    ticks = FakeTicks()
+
+    def set_on(*modules, now_ms = 0):
+        ticks.now_ms = now_ms
+        for module in modules:
+            monkeypatch.setattr(module, 'ticks_ms', ticks.ticks_ms)
+        return ticks
+
+    return set_on
@@ -0,0 +1,23 @@
+#############################
+# Fake countio module, to run the pulse counter drivers on a computer for testing.
+# Pulses are added with Counter.pulse().
+#############################
+
+class Edge(object):
+    RISE = 0
+    FALL = 1
+    RISE_AND_FALL = 2
+
+class Counter(object):
+    def __init__(self, pin = None, edge = Edge.FALL, pull = None):
+        self.count = 0
+
+    def pulse(self, pulses = 1):
+        """Count pulses, like if they were received on the pin"""
+        self.count += pulses
+
+    def reset(self):
+        self.count = 0
+
+    def deinit(self):
+        pass
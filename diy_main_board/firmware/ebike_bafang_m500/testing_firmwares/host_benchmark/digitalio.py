@@ -0,0 +1,11 @@
+#############################
+# Fake digitalio module, only the constants used by the drivers.
+#############################
+
+class Pull(object):
+    UP = 1
+    DOWN = 2
+
+class Direction(object):
+    INPUT = 0
+    OUTPUT = 1
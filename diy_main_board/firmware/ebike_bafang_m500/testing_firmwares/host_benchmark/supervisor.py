@@ -0,0 +1,9 @@
+#############################
+# Fake supervisor module, to run the firmware modules on a computer for testing.
+# Only runtime.serial_bytes_available is implemented, there is never serial input.
+#############################
+
+class _Runtime(object):
+    serial_bytes_available = False
+
+runtime = _Runtime()
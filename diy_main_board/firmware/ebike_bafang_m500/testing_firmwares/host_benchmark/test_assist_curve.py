@@ -0,0 +1,63 @@
+#############################
+# Test of the torque and throttle to motor current lookup tables, to run on a computer.
+#
+# Run from this folder: python -m pytest test_assist_curve.py (or python test_assist_curve.py)
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import assist_curve
+
+# main.py settings
+TORQUE_WEIGHT_MIN_X10 = 40
+TORQUE_WEIGHT_MAX_X10 = 400
+MOTOR_MAX_CURRENT_LIMIT = 30.0
+ASSIST_LEVEL_FACTORS = [0, 0.5, 1.0, 2.0, 3.0, 5.0]
+
+def map_range(x, in_min, in_max, out_min, out_max):
+    # simpleio.map_range(), used by motor_control() before the lookup tables: the output is constrained to the output range
+    mapped = (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+    return max(min(mapped, out_max), out_min)
+
+def previous_torque_motor_current(assist_level, torque_weight_x10):
+    # torque weight mapped to the motor current, times the assist level factor, then limited by motor_control()
+    current = map_range(torque_weight_x10, TORQUE_WEIGHT_MIN_X10, TORQUE_WEIGHT_MAX_X10, 0, MOTOR_MAX_CURRENT_LIMIT)
+    return min(current * ASSIST_LEVEL_FACTORS[assist_level], MOTOR_MAX_CURRENT_LIMIT)
+
+def test_linear_curve_matches_the_previous_map():
+    curve = assist_curve.AssistCurve(TORQUE_WEIGHT_MIN_X10, TORQUE_WEIGHT_MAX_X10, MOTOR_MAX_CURRENT_LIMIT, ASSIST_LEVEL_FACTORS, torque_exponent = 1.0)
+    for assist_level in range(len(ASSIST_LEVEL_FACTORS)):
+        for torque_weight_x10 in range(-10, TORQUE_WEIGHT_MAX_X10 + 50):
+            current = curve.torque_motor_current_x100(assist_level, torque_weight_x10) / 100
+            assert abs(current - previous_torque_motor_current(assist_level, torque_weight_x10)) <= 0.01, (assist_level, torque_weight_x10)
+
+    for throttle_value in range(-5, 1100):
+        current = curve.throttle_motor_current_x100(throttle_value) / 100
+        assert abs(current - map_range(throttle_value, 0, 1000, 0, MOTOR_MAX_CURRENT_LIMIT)) <= 0.01
+
+def test_limited_to_the_max_current():
+    curve = assist_curve.AssistCurve(TORQUE_WEIGHT_MIN_X10, TORQUE_WEIGHT_MAX_X10, MOTOR_MAX_CURRENT_LIMIT, ASSIST_LEVEL_FACTORS, torque_exponent = 2.0)
+    limit_x100 = int(MOTOR_MAX_CURRENT_LIMIT * 100)
+    for assist_level in range(len(ASSIST_LEVEL_FACTORS)):
+        values = [curve.torque_motor_current_x100(assist_level, torque_weight_x10) for torque_weight_x10 in range(0, 1000)]
+        assert max(values) <= limit_x100
+        assert values == sorted(values)
+    assert curve.torque_motor_current_x100(5, TORQUE_WEIGHT_MAX_X10) == limit_x100 # factor 5.0
+    assert curve.torque_motor_current_x100(2, TORQUE_WEIGHT_MAX_X10) == limit_x100 # factor 1.0
+    assert curve.throttle_motor_current_x100(5000) == limit_x100
+
+def test_build_curve():
+    table = assist_curve.build_curve(10, 110, 20.0, exponent = 2.0, factor = 0.5, output_limit = 8.0)
+    assert len(table) == 111
+    assert table[10] == 0 and table[0] == 0
+    assert table[60] == 250 # 20 * 0.5 * 0.5 ** 2: less output on low inputs
+    assert table[110] == 800 # limited to output_limit
+    assert table[100] == 800
+
+if __name__ == '__main__':
+    test_linear_curve_matches_the_previous_map()
+    test_limited_to_the_max_current()
+    test_build_curve()
+    print("all tests passed")
@@ -0,0 +1,86 @@
+#############################
+# Test of the CAN bus shared by the torque sensor and VESC, to run on a computer with the fake canio module on this folder.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_can_router.py (or python test_can_router.py)
+#############################
+
+import os
+import sys
+import struct
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import canio
+import torque_sensor
+import vesc_can
+
+class AppData(object):
+    motor_speed_erpm = 0
+    motor_current = 0.0
+    vesc_temperature_x10 = 0
+    battery_current = 0.0
+    battery_voltage = 0.0
+
+def status_message(controller_id, packet_id, data):
+    return canio.Message((packet_id << 8) | controller_id, data, extended = True)
+
+def torque_message(torque_raw, cadence, progressive_byte):
+    return canio.Message(torque_sensor.TORQUE_SENSOR_CAN_ID, bytes([torque_raw & 0xff, torque_raw >> 8, cadence, progressive_byte, 0, 0, 0, 0]), extended = True)
+
+def new_devices(controller_id):
+    can_bus = canio.CAN()
+    sensor = torque_sensor.TorqueSensor(None, None, can_bus = can_bus)
+    data = AppData()
+    vesc = vesc_can.VescCan(sensor.can_router, controller_id, data)
+    return can_bus, sensor, vesc, data
+
+def test_single_listener():
+    can_bus, sensor, vesc, data = new_devices(0)
+    assert len(can_bus.listeners) == 1
+    try:
+        can_bus.listen(matches = [canio.Match(0x901, extended = True)], timeout = 0)
+        assert False, "a second listener should fail, like on ESP32"
+    except ValueError:
+        pass
+
+def test_status_decode():
+    for controller_id in (0, 5):
+        can_bus, sensor, vesc, data = new_devices(controller_id)
+        can_bus.inject(status_message(controller_id, vesc_can.CAN_PACKET_STATUS, struct.pack('>lhh', 12345, -253, 500)))
+        assert vesc.process_data()
+        assert data.motor_speed_erpm == 12345
+        assert data.motor_current == -25.3
+
+        can_bus.inject(status_message(controller_id, vesc_can.CAN_PACKET_STATUS_4, struct.pack('>hhhh', 460, 300, 152, 0)))
+        can_bus.inject(status_message(controller_id, vesc_can.CAN_PACKET_STATUS_5, struct.pack('>lh', 1000, 512)))
+        assert vesc.process_data()
+        assert data.vesc_temperature_x10 == 350
+        assert data.battery_current == 15.2
+        assert data.battery_voltage == 51.2
+
+        # nothing new
+        assert not vesc.process_data()
+
+def test_routing_by_id():
+    # with controller ID 0, the torque sensor ID 0x1f83100 has the same lower 8 bits as the VESC messages
+    can_bus, sensor, vesc, data = new_devices(0)
+    can_bus.inject(torque_message(1300, 60, 1))
+    can_bus.inject(status_message(0, vesc_can.CAN_PACKET_STATUS, struct.pack('>lhh', 1000, 10, 0)))
+    can_bus.inject(status_message(0, vesc_can.CAN_PACKET_STATUS_2, bytes(8))) # not used
+    can_bus.inject(status_message(7, vesc_can.CAN_PACKET_STATUS, struct.pack('>lhh', 2000, 20, 0))) # other VESC
+    can_bus.inject(torque_message(1310, 0, 2))
+
+    # the torque sensor task receives all the messages, the VESC ones are kept for VESC
+    assert sensor.receive() == 2
+    assert sensor.frames == 2
+    assert sensor.value_raw == (1310, 0, 2)
+    assert data.motor_speed_erpm == 1000
+    assert sensor.can_router.received == 3 # the not used and other VESC messages are dropped
+    assert vesc.process_data()
+    assert not vesc.process_data()
+
+if __name__ == '__main__':
+    test_single_listener()
+    test_status_decode()
+    test_routing_by_id()
+    print("all tests passed")
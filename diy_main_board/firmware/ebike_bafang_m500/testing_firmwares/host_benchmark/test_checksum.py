@@ -0,0 +1,96 @@
+#############################
+# Test of the CRC-16 checksums, to run on a computer.
+# Checks the known check values of CRC-16/XMODEM (the CCITT variant used by VESC) and CRC-16/MODBUS,
+# the native and the lookup table paths against a bit by bit reference, and that the copies of checksum.py
+# on each board firmware folder are the same.
+#
+# Run from this folder: python -m pytest test_checksum.py (or python test_checksum.py)
+#############################
+
+import os
+import sys
+import random
+FIRMWARE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..') # ebike_bafang_m500 folder
+sys.path.insert(0, FIRMWARE_PATH)
+
+import checksum
+
+# each board firmware folder has its own copy, as each one is copied alone to the CIRCUITPY drive
+COPIES = (
+    os.path.join(FIRMWARE_PATH, 'checksum.py'),
+    os.path.join(FIRMWARE_PATH, '..', 'checksum.py'),
+    os.path.join(FIRMWARE_PATH, '..', '..', '..', 'diy_display', 'firmware', 'checksum.py'),
+)
+
+# check value is the CRC of b'123456789', from the CRC catalogue
+CHECK_DATA = b'123456789'
+CRC16_XMODEM_CHECK = 0x31C3
+CRC16_MODBUS_CHECK = 0x4B37
+
+def reference_crc16_xmodem(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return crc
+
+def reference_crc16_modbus(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc >> 1) ^ 0xA001) if crc & 1 else (crc >> 1)
+    return crc
+
+def random_frames():
+    generator = random.Random(1)
+    return [bytes(generator.getrandbits(8) for _ in range(lenght)) for lenght in (0, 1, 2, 5, 78, 255) for _ in range(20)]
+
+def test_check_values():
+    assert reference_crc16_xmodem(CHECK_DATA) == CRC16_XMODEM_CHECK
+    assert reference_crc16_modbus(CHECK_DATA) == CRC16_MODBUS_CHECK
+    assert checksum.crc16_ccitt(CHECK_DATA) == CRC16_XMODEM_CHECK
+    assert checksum._crc16_ccitt_table(CHECK_DATA) == CRC16_XMODEM_CHECK
+    assert checksum._crc16_ccitt_native(CHECK_DATA) == CRC16_XMODEM_CHECK
+    assert checksum.crc16_modbus(CHECK_DATA) == CRC16_MODBUS_CHECK
+
+def test_native_and_table_paths():
+    for data in random_frames():
+        expected = reference_crc16_xmodem(data)
+        assert checksum._crc16_ccitt_table(data) == expected
+        assert checksum._crc16_ccitt_native(data) == expected
+        assert checksum.crc16_modbus(data) == reference_crc16_modbus(data)
+
+def test_crc_into_buffer():
+    for data in random_frames():
+        expected = reference_crc16_xmodem(data)
+        buffer = bytearray(4)
+        checksum.crc16_ccitt_into(data, buffer, 1)
+        assert buffer == bytearray([0, expected >> 8, expected & 0xff, 0])
+
+def test_memoryview_slices():
+    # the drivers calculate the CRC of slices of their buffers, without copying
+    buffer = bytearray(b'\x02\x09' + CHECK_DATA + b'\x00\x00\x03')
+    payload = memoryview(buffer)[2: 2 + len(CHECK_DATA)]
+    assert checksum._crc16_ccitt_table(payload) == CRC16_XMODEM_CHECK
+    assert checksum._crc16_ccitt_native(payload) == CRC16_XMODEM_CHECK
+    checksum.crc16_ccitt_into(payload, buffer, len(buffer) - 3)
+    assert buffer[-3:] == bytearray([CRC16_XMODEM_CHECK >> 8, CRC16_XMODEM_CHECK & 0xff, 3])
+    assert checksum.crc16_modbus(payload) == CRC16_MODBUS_CHECK
+
+def test_copies_are_the_same():
+    with open(COPIES[0], 'rb') as file:
+        source = file.read()
+    for path in COPIES[1:]:
+        with open(path, 'rb') as file:
+            assert file.read() == source, path + " differs from " + COPIES[0]
+
+if __name__ == '__main__':
+    test_check_values()
+    test_native_and_table_paths()
+    test_crc_into_buffer()
+    test_memoryview_slices()
+    test_copies_are_the_same()
+    print("all tests passed")
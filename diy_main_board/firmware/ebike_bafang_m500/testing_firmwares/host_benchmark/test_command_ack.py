@@ -0,0 +1,106 @@
+#############################
+# Test of the display commands acknowledge, between the main board Display and the display EBikeBoard,
+# to run on a computer with the fake busio module on this folder.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_command_ack.py (or python test_command_ack.py)
+#############################
+
+import os
+import sys
+import time
+import importlib.util
+FIRMWARE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..') # ebike_bafang_m500 folder
+sys.path.insert(0, FIRMWARE_PATH)
+
+import display
+from uart_link import TELEMETRY_SCHEMA, COMMAND_SCHEMA
+
+# the display firmware EBikeBoard, it uses the same uart_link.py as the main board
+spec = importlib.util.spec_from_file_location('ebike_board', os.path.join(FIRMWARE_PATH, '..', '..', '..', 'diy_display', 'firmware', 'ebike_board.py'))
+ebike_board = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ebike_board)
+
+class EBikeData(object):
+    def __init__(self):
+        for name in TELEMETRY_SCHEMA.names + COMMAND_SCHEMA.names:
+            setattr(self, name, 0)
+
+class Link(object):
+    def __init__(self):
+        # the baud rate stays at 19200, so the reboots are not seen by the link negotiation
+        self.board_data = EBikeData()
+        self.board = display.Display(None, None, self.board_data, max_baudrate = 19200)
+        self.boot_display()
+
+    def boot_display(self):
+        self.display_data = EBikeData()
+        self.display = ebike_board.EBikeBoard(None, None, self.display_data, max_baudrate = 19200)
+        self.board._uart.connect(self.display._uart)
+
+    def step(self):
+        self.board.process_data()
+        self.display.process_data()
+
+    def wait_acknowledge(self):
+        # the new display decoder waits for a keyframe, sent every 20 packages
+        for _ in range(20):
+            if not self.display._command_pending:
+                return True
+            self.board.send_data()
+            self.step()
+        return False
+
+    def send_command(self, assist_level):
+        self.display_data.assist_level = assist_level
+        self.display.send_command()
+        self.step()
+
+def test_command_is_acknowledged():
+    link = Link()
+    link.send_command(3)
+    assert link.board_data.assist_level == 3
+    assert link.board.command_latency.count == 1 # acknowledged right away
+    assert link.display.command_latency.count == 1
+    assert link.display_data.command_ack == 1
+
+    # the command sent again by send_data() is not a new one
+    link.display.send_data()
+    link.step()
+    assert link.board.command_latency.count == 1
+
+def test_display_reboot():
+    link = Link()
+    link.send_command(3)
+    assert link.board_data.command_ack == 1
+
+    # the rebooted display sends data before its first command, with sequence 0
+    link.boot_display()
+    link.display.send_data()
+    link.step()
+    assert link.board_data.command_ack == 0
+
+    # its first command, sequence 1 again, is a new command
+    link.send_command(4)
+    assert link.board_data.assist_level == 4
+    assert link.board.command_latency.count == 2
+    assert link.wait_acknowledge()
+    assert link.display_data.command_ack == 1
+
+def test_link_negotiated_again():
+    link = Link()
+    link.send_command(3)
+
+    # the rebooted display sends its first command right away, the link fall back resets the acknowledge
+    link.boot_display()
+    link.board.link._fall_back(time.monotonic_ns())
+    link.send_command(5)
+    assert link.board_data.assist_level == 5
+    assert link.board.command_latency.count == 2
+    assert link.wait_acknowledge()
+
+if __name__ == '__main__':
+    test_command_is_acknowledged()
+    test_display_reboot()
+    test_link_negotiated_again()
+    print("all tests passed")
@@ -0,0 +1,69 @@
+#############################
+# Test of the motor control strategies, to run on a computer.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_control_strategy.py
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import pytest
+import fixed_point
+import control_strategy
+
+class FakeSetpoint(object):
+    """VescSetpointPublisher like object, keeps the sent commands"""
+
+    def __init__(self):
+        self.sent = []
+
+    def set_motor_current_milliamps(self, value):
+        self.sent.append(('mA', value))
+
+    def set_motor_speed_erpm(self, value):
+        self.sent.append(('erpm', value))
+
+@pytest.fixture
+def ticks(fake_ticks):
+    return fake_ticks(fixed_point)
+
+def run(ticks, strategy, target, brakes_are_active = False, motor_speed_erpm = 0, steps = 100):
+    for _ in range(steps):
+        ticks.advance(20)
+        value = strategy.update(target, brakes_are_active, motor_speed_erpm)
+    return value
+
+def test_base_strategy_never_drives_the_motor(ticks):
+    setpoint = FakeSetpoint()
+    strategy = control_strategy.ControlStrategy(setpoint, 100, 5000, 100000, 100000)
+    assert strategy.max_target(123) == 5000
+    assert strategy.limit(9000) == 5000
+    assert strategy.limit(-10) == 0
+    run(ticks, strategy, 3000)
+    run(ticks, strategy, 3000, brakes_are_active = True, steps = 1)
+    assert set(setpoint.sent) == {('mA', 0)}
+
+def test_current_control(ticks):
+    setpoint = FakeSetpoint()
+    strategy = control_strategy.CurrentControl(setpoint, 2.0, 20.0, 0.0001, 0.0001)
+    assert strategy.max_target(0) == 20000
+    assert run(ticks, strategy, 50000) == 20000 # limited to the max current
+    assert setpoint.sent[-1] == ('mA', 20000)
+    assert run(ticks, strategy, 1500) == 0 # lower than the min current
+    assert run(ticks, strategy, 8000, brakes_are_active = True, steps = 1) == 0
+    assert setpoint.sent[-1] == ('mA', 0)
+
+def test_speed_control(ticks):
+    setpoint = FakeSetpoint()
+    strategy = control_strategy.SpeedControl(setpoint, 1000, 750, 0.00001, 0.00001, max_erpm_filter_shift = 1)
+    for _ in range(20):
+        max_erpm = strategy.max_target(30000)
+    assert max_erpm > 29900
+    assert run(ticks, strategy, 40000) == max_erpm # limited to the filtered max ERPM
+    assert setpoint.sent[-1] == ('erpm', max_erpm)
+    run(ticks, strategy, 0, motor_speed_erpm = 500)
+    assert setpoint.sent[-1] == ('mA', 0) # released near zero speed
+    run(ticks, strategy, 5000, brakes_are_active = True, steps = 1)
+    assert setpoint.sent[-1] == ('erpm', 0)
@@ -0,0 +1,84 @@
+#############################
+# Test of the fixed_point integer math against the float math it replaced, to run on a computer.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_fixed_point.py (or python test_fixed_point.py)
+#############################
+
+import os
+import sys
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import fixed_point
+import throttle
+
+def float_map_range(x, in_min, in_max, out_min, out_max):
+    """simpleio.map_range(), the float version used before"""
+    mapped = (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+    if out_min <= out_max:
+        return max(min(mapped, out_max), out_min)
+    return min(max(mapped, out_max), out_min)
+
+def test_map_range():
+    generator = random.Random(1)
+    ranges = ((32767, 65535, 0, 1000), (0, 400, 2000, 20000), (40, 400, 0, 1000), (100, 900, 0, 65535))
+    for in_min, in_max, out_min, out_max in ranges:
+        for _ in range(2000):
+            value = generator.randint(in_min - 100, in_max + 100)
+            expected = float_map_range(value, in_min, in_max, out_min, out_max)
+            result = fixed_point.map_range(value, in_min, in_max, out_min, out_max)
+            assert isinstance(result, int)
+            # the integer division rounds down, so at most 1 unit lower
+            assert expected - 1 < result <= expected
+
+def test_throttle():
+    sensor = throttle.Throttle(None, min = 17000, max = 50000)
+    for adc_value in range(0, 65536, 7):
+        sensor._adc_throttle.value = adc_value
+        expected = float_map_range(adc_value, 17000, 50000, 0, 1000)
+        assert expected - 1 < sensor.value <= expected
+
+def test_clamp_and_step_towards():
+    assert fixed_point.clamp(-5, 0, 10) == 0
+    assert fixed_point.clamp(15, 0, 10) == 10
+    assert fixed_point.clamp(7, 0, 10) == 7
+    assert fixed_point.step_towards(0, 10, 3) == 3
+    assert fixed_point.step_towards(9, 10, 3) == 10
+    assert fixed_point.step_towards(10, 0, 4) == 6
+    assert fixed_point.step_towards(2, 0, 4) == 0
+
+def test_ramp(fake_ticks):
+    for up_per_second, down_per_second, target in ((20000, 25000, 15000), (20, 25, 3000), (1500.5, 900, 4000)):
+        ticks = fake_ticks(fixed_point)
+        ramp = fixed_point.Ramp(up_per_second, down_per_second)
+        float_value = 0.0
+        for step in range(800):
+            elapsed_ms = 10 + step % 7 # not constant, like the real loop
+            ticks.advance(elapsed_ms)
+            rate = up_per_second if target > float_value else down_per_second
+            float_value = fixed_point.step_towards(float_value, target, rate * elapsed_ms / 1000)
+            value = ramp.update(target)
+            assert isinstance(value, int)
+            # the rate is in Q8 per ms, so it may be up to 1/256 per ms slower, plus the fraction kept for the next update
+            assert abs(value - float_value) <= ticks.now_ms / 256 + 1
+            if step == 400:
+                target = 0
+        assert value == 0 and float_value == 0
+
+def test_low_pass():
+    generator = random.Random(2)
+    for shift in (1, 3, 5):
+        low_pass = fixed_point.LowPass(shift)
+        float_value = 0.0
+        for _ in range(2000):
+            value = generator.randint(0, 30000)
+            float_value += (value - float_value) / (1 << shift)
+            result = low_pass.update(value)
+            assert isinstance(result, int)
+            # the accumulator keeps the fraction bits, so the output is the float value rounded down
+            assert abs(result - float_value) <= 1
+
+if __name__ == '__main__':
+    import pytest
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,170 @@
+#############################
+# Test of the UART link baud rate negotiation, to run on a computer (Linux or macOS).
+# The main board and display ends are connected by a pseudo terminal (pty) loopback, the bytes are corrupted when
+# both ends are not on the same baud rate, like on a real UART. The time is simulated, 10ms per step.
+#
+# Run from this folder: python -m pytest test_link_negotiator.py (or python test_link_negotiator.py)
+#############################
+
+import os
+import sys
+import tty
+import fcntl
+import array
+import termios
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import uart_link
+from uart_link import FrameScanner, LinkNegotiator, LINK_BAUDRATES, PACKAGE_CAPS, TELEMETRY_SCHEMA
+
+STEP_NS = 10000000 # 10ms
+START_NS = 5000000000 # both ends start the link after the boot, a few seconds after time 0
+
+class FakeTime(object):
+    """Simulated time.monotonic_ns() for the uart_link module"""
+
+    def __init__(self):
+        self.now_ns = START_NS
+
+    def monotonic_ns(self):
+        return self.now_ns
+
+class TelemetryData(object):
+    def __init__(self):
+        for name in TELEMETRY_SCHEMA.names:
+            setattr(self, name, 0)
+
+class PtyUart(object):
+    """busio.UART like object on one side of a pty"""
+
+    def __init__(self, fd):
+        self._fd = fd
+        self.peer = None
+        self.baudrate = LINK_BAUDRATES[0]
+        self.drop_caps = 0 # number of next capabilities packages to drop
+        self.bad_baudrate = None # corrupt the packages sent on this baud rate
+        self._writes = 0
+        tty.setraw(fd)
+        os.set_blocking(fd, False)
+
+    @property
+    def in_waiting(self):
+        count = array.array('i', [0])
+        fcntl.ioctl(self._fd, termios.FIONREAD, count)
+        return count[0]
+
+    def read(self, nbytes):
+        return os.read(self._fd, nbytes)
+
+    def write(self, data):
+        data = bytearray(data)
+        self._writes += 1
+        if self.drop_caps and len(data) > 5 and data[5] == PACKAGE_CAPS:
+            self.drop_caps -= 1
+            return len(data)
+        if self.baudrate != self.peer.baudrate:
+            # different baud rates: the other end receives garbage
+            data = bytearray((b ^ 0x5a) for b in data[::2])
+        elif self.baudrate == self.bad_baudrate and self._writes % 2:
+            data[-1] ^= 0xff
+        # wait for the bytes to be readable on the other side, so each test step is deterministic
+        expected = self.peer.in_waiting + len(data)
+        os.write(self._fd, data)
+        while self.peer.in_waiting < expected:
+            pass
+        return len(data)
+
+class LinkEnd(object):
+    def __init__(self, uart, initiator):
+        self.uart = uart
+        self.scanner = FrameScanner()
+        self.negotiator = LinkNegotiator(uart, self.scanner, initiator, retry_period = 5.0, max_retry_period = 60.0, stable_period = 10.0)
+        self._buffer = bytearray(255)
+        self._tx_buffer = bytearray(64)
+        self._data = TelemetryData()
+
+    def step(self):
+        # receive, like Display / EBikeBoard process_data()
+        self.scanner.read_from(self.uart)
+        while True:
+            lenght = self.scanner.next_frame(self._buffer)
+            if lenght == 0:
+                break
+            self.negotiator.process_package(self._buffer, lenght)
+        self.negotiator.update()
+
+        # keep sending data, like Display / EBikeBoard send_data()
+        if self.negotiator._switch_index is None:
+            lenght = TELEMETRY_SCHEMA.pack_into(self._tx_buffer, self._data)
+            self.uart.write(self._tx_buffer[:lenght])
+
+class Link(object):
+    def __init__(self, fake_time):
+        self._time = fake_time
+        master, slave = os.openpty()
+        self._fds = (master, slave)
+        self.board_uart = PtyUart(master)
+        self.display_uart = PtyUart(slave)
+        self.board_uart.peer = self.display_uart
+        self.display_uart.peer = self.board_uart
+        self.board = LinkEnd(self.board_uart, initiator = True)
+        self.display = LinkEnd(self.display_uart, initiator = False)
+
+    def run(self, seconds):
+        for _ in range(int(seconds * 1000000000) // STEP_NS):
+            self._time.now_ns += STEP_NS
+            self.board.step()
+            self.display.step()
+
+    def reboot_display(self):
+        self.display_uart.baudrate = LINK_BAUDRATES[0]
+        self.display = LinkEnd(self.display_uart, initiator = False)
+
+    def close(self):
+        for fd in self._fds:
+            os.close(fd)
+
+@pytest.fixture
+def link(monkeypatch):
+    fake_time = FakeTime()
+    monkeypatch.setattr(uart_link, 'time', fake_time)
+    link = Link(fake_time)
+    yield link
+    link.close()
+
+def test_negotiates_max_baudrate(link):
+    link.run(3)
+    assert link.board_uart.baudrate == LINK_BAUDRATES[-1]
+    assert link.display_uart.baudrate == LINK_BAUDRATES[-1]
+
+def test_display_reboot_does_not_blacklist(link):
+    link.run(3)
+    for _ in range(3):
+        link.reboot_display()
+        link.run(20)
+        assert link.board_uart.baudrate == LINK_BAUDRATES[-1]
+        assert link.display_uart.baudrate == LINK_BAUDRATES[-1]
+    assert link.board.negotiator.fallbacks == 3
+
+def test_lost_answer_is_tried_again(link):
+    link.display_uart.drop_caps = 1 # the display switches, the main board does not get the answer
+    link.run(3)
+    # the display timed out on the max baud rate and holds it, the next lower one is used meanwhile
+    assert link.display.negotiator.fallbacks == 1
+    assert link.board_uart.baudrate == LINK_BAUDRATES[-2]
+    link.run(10)
+    assert link.board_uart.baudrate == LINK_BAUDRATES[-1]
+    assert link.display_uart.baudrate == LINK_BAUDRATES[-1]
+
+def test_bad_baudrate_is_held(link):
+    link.board_uart.bad_baudrate = LINK_BAUDRATES[-1]
+    link.display_uart.bad_baudrate = LINK_BAUDRATES[-1]
+    link.run(30)
+    # the next lower baud rate is used while the bad one is on hold
+    assert link.board_uart.baudrate == LINK_BAUDRATES[-2]
+    assert link.display_uart.baudrate == LINK_BAUDRATES[-2]
+    assert link.board.negotiator.fallbacks + link.display.negotiator.fallbacks >= 1
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,58 @@
+#############################
+# Test of the human pedal power, to run on a computer.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_pedal_power.py (or python test_pedal_power.py)
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+from pedal_power import HumanPedalPower
+
+def add_samples(pedal_power, start_ms, duration_ms, torque_weight_x10, cadence):
+    """Add a sample every 10ms, like the torque sensor messages
+    return: time of the next sample
+    """
+    for time_ms in range(start_ms, start_ms + duration_ms, 10):
+        pedal_power.add(time_ms, torque_weight_x10, cadence)
+    return start_ms + duration_ms
+
+def test_hand_computed_power():
+    # 30 kg on the 170 mm crank at 80 RPM:
+    # 30 * 9.81 = 294.3 N, * 0.17 m = 50.03 Nm, * 80 RPM * 2 * pi / 60 = 419.1 W
+    pedal_power = HumanPedalPower(170)
+    assert pedal_power.value == 0
+    add_samples(pedal_power, 0, 2000, 300, 80)
+    assert pedal_power.value == 419
+
+    # 12.5 kg on a 175 mm crank at 60 RPM: 122.6 N * 0.175 m = 21.46 Nm * 6.283 rad/s = 134.8 W
+    pedal_power = HumanPedalPower(175)
+    add_samples(pedal_power, 0, 2000, 125, 60)
+    assert pedal_power.value in (134, 135)
+
+def test_window_average():
+    pedal_power = HumanPedalPower(170, window_ms = 1000, bin_ms = 100)
+    time_ms = add_samples(pedal_power, 0, 2000, 300, 80)
+
+    # half of the window at half of the torque: 3/4 of the power
+    time_ms = add_samples(pedal_power, time_ms, 500, 150, 80)
+    assert abs(pedal_power.value - 419 * 3 // 4) <= 1
+
+    # the old samples got out of the window
+    time_ms = add_samples(pedal_power, time_ms, 1000, 150, 80)
+    assert abs(pedal_power.value - 419 // 2) <= 1
+
+    # negative torque, from a zero calibration error, counts as 0
+    time_ms = add_samples(pedal_power, time_ms, 1000, -20, 80)
+    assert pedal_power.value == 0
+
+    # no samples for longer than the window: only the new ones
+    add_samples(pedal_power, time_ms + 5000, 1000, 300, 80)
+    assert pedal_power.value == 419
+
+if __name__ == '__main__':
+    test_hand_computed_power()
+    test_window_average()
+    print("all tests passed")
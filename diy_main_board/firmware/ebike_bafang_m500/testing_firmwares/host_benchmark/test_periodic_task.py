@@ -0,0 +1,91 @@
+#############################
+# Test of the fixed rate periodic task deadlines, to run on a computer.
+# The time is simulated: asyncio.sleep() moves the fake ticks_ms() and each run takes the time the test sets.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_periodic_task.py
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import pytest
+import periodic_task
+from conftest import TICKS_PERIOD
+
+class StopRunning(Exception):
+    pass
+
+class FakeAsyncio(object):
+    """asyncio like module, sleep() moves the fake time right away"""
+
+    def __init__(self, ticks):
+        self._ticks = ticks
+        self.sleeps_ms = []
+
+    async def sleep(self, seconds):
+        self.sleeps_ms.append(round(seconds * 1000))
+        self._ticks.advance(round(seconds * 1000))
+
+def run_task(fake_ticks, monkeypatch, run_times_ms, now_ms = 1000, period_ms = 20, max_catch_up = 1):
+    """Run a PeriodicTask until each run took its time from run_times_ms
+    return: the task, the start time of each run, relative to the task start, and the fake asyncio
+    """
+    ticks = fake_ticks(periodic_task, now_ms = now_ms)
+    fake_asyncio = FakeAsyncio(ticks)
+    monkeypatch.setattr(periodic_task, 'asyncio', fake_asyncio)
+    starts = []
+
+    def function():
+        if len(starts) == len(run_times_ms):
+            raise StopRunning()
+        starts.append((ticks.now_ms - now_ms) % TICKS_PERIOD)
+        ticks.advance(run_times_ms[len(starts) - 1])
+
+    task = periodic_task.PeriodicTask('test', function, period_ms, max_catch_up = max_catch_up)
+    with pytest.raises(StopRunning):
+        task.run().send(None)
+    return task, starts, fake_asyncio
+
+def test_runs_on_deadlines(fake_ticks, monkeypatch):
+    task, starts, fake_asyncio = run_task(fake_ticks, monkeypatch, [3, 7, 1, 12, 5])
+    # the run time does not add to the period
+    assert starts == [20, 40, 60, 80, 100]
+    assert fake_asyncio.sleeps_ms == [20, 17, 13, 19, 8, 15]
+    assert (task.runs, task.overruns, task.skipped) == (5, 0, 0)
+    assert (task.min_period_ms, task.max_period_ms, task.max_jitter_ms) == (20, 20, 0)
+    assert (task.run_time_ms, task.max_run_time_ms) == (5, 12)
+
+def test_late_run_catches_up(fake_ticks, monkeypatch):
+    # the second run ends 10ms after the next deadline: the next run starts right away, on the same time grid
+    task, starts, fake_asyncio = run_task(fake_ticks, monkeypatch, [2, 30, 2, 2])
+    assert starts == [20, 40, 70, 80]
+    assert 0 in fake_asyncio.sleeps_ms # still lets the other tasks run
+    assert (task.overruns, task.skipped) == (1, 0)
+    assert task.max_jitter_ms == 10
+    assert (task.min_period_ms, task.max_period_ms) == (10, 30)
+
+def test_too_late_skips_periods(fake_ticks, monkeypatch):
+    # the second run ends 45ms after the next deadline: more than max_catch_up periods, so they are skipped
+    task, starts, fake_asyncio = run_task(fake_ticks, monkeypatch, [2, 65, 2, 2])
+    assert starts == [20, 40, 120, 140]
+    assert (task.overruns, task.skipped) == (1, 3)
+
+    # with a bigger max_catch_up, the late periods run right away
+    task, starts, fake_asyncio = run_task(fake_ticks, monkeypatch, [2, 65, 2, 2, 2, 2], max_catch_up = 3)
+    assert starts == [20, 40, 105, 107, 109, 120]
+    assert (task.overruns, task.skipped) == (3, 0) # each catch up run still ends after its deadline
+
+def test_ticks_wrap_around(fake_ticks, monkeypatch):
+    # ticks_ms() wraps around at 2^29, the deadlines must keep working
+    task, starts, fake_asyncio = run_task(fake_ticks, monkeypatch, [3, 30, 2, 2, 2], now_ms = TICKS_PERIOD - 50)
+    assert starts == [20, 40, 70, 80, 100]
+    assert (task.overruns, task.skipped) == (1, 0)
+    assert (task.min_period_ms, task.max_period_ms) == (10, 30)
+
+def test_reset_stats(fake_ticks, monkeypatch):
+    task, starts, fake_asyncio = run_task(fake_ticks, monkeypatch, [2, 65])
+    task.reset_stats()
+    assert (task.runs, task.overruns, task.skipped, task.max_jitter_ms, task.max_run_time_ms) == (0, 0, 0, 0, 0)
+    assert str(task) == "test: period 20ms (0..0), jitter 0ms (max 0), run 0ms (max 0), runs 0, overruns 0, skipped 0"
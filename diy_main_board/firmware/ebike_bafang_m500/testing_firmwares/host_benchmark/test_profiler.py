@@ -0,0 +1,90 @@
+#############################
+# Test of the execution time profiler, to run on a computer with the fake supervisor module on this folder.
+#
+# Run from this folder: python -m pytest test_profiler.py
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import pytest
+import profiler
+
+class FakeTime(object):
+    """Simulated time.monotonic_ns() for the profiler module"""
+
+    def __init__(self):
+        self.now_ns = 1000000000
+
+    def monotonic_ns(self):
+        return self.now_ns
+
+    def advance_us(self, us):
+        self.now_ns += us * 1000
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(profiler, 'time', fake)
+    monkeypatch.setattr(profiler, 'enabled', True)
+    return fake
+
+def test_empty_profile():
+    profile = profiler.Profile('empty')
+    assert profile.percentile(99) == 0
+    assert profile.avg_us == 0
+    assert str(profile) == "empty: min 0us, avg 0us, max 0us, p99 0us, count 0"
+
+def test_statistics():
+    profile = profiler.Profile('task', bucket_us = 200, buckets = 10)
+    for time_us in [150] * 98 + [700, 5000]:
+        profile.add(time_us)
+    assert profile.count == 100
+    assert profile.min_us == 150
+    assert profile.max_us == 5000
+    assert profile.avg_us == (98 * 150 + 700 + 5000) // 100
+    assert profile.percentile(50) == 200
+    assert profile.percentile(99) == 800
+    assert profile.percentile(100) == 5000 # on the extra bucket
+
+    profile.reset_stats()
+    assert profile.count == 0
+    assert profile.percentile(99) == 0
+
+def test_sub_millisecond_times(fake_time):
+    profile = profiler.Profile('measured')
+    profile.start()
+    fake_time.advance_us(340)
+    profile.stop()
+
+    def work(value):
+        fake_time.advance_us(85)
+        return value * 2
+    measured = profile.wrap(work)
+    assert measured(21) == 42
+    assert (profile.min_us, profile.max_us, profile.count) == (85, 340, 2)
+    assert profile.percentile(50) == 100
+    assert str(profile) == "measured: min 85us, avg 212us, max 340us, p99 400us, count 2"
+
+def test_disabled_does_not_measure(fake_time, monkeypatch):
+    monkeypatch.setattr(profiler, 'enabled', False)
+    profile = profiler.Profile('disabled')
+    measured = profile.wrap(lambda value: value + 1)
+    assert measured(1) == 2
+    profile.start()
+    fake_time.advance_us(100)
+
+    # enabled between start() and stop(): the time is not known
+    monkeypatch.setattr(profiler, 'enabled', True)
+    profile.stop()
+    assert profile.count == 0
+
+def test_total_stays_small():
+    # the total for the average is folded, so it stays a small int on CircuitPython (lower than 2^30)
+    profile = profiler.Profile('long run')
+    for _ in range(200000):
+        profile.add(2500)
+    assert profile._total_us < profiler._TOTAL_FOLD_US
+    assert profile.avg_us == 2500
+    assert profile.count == 200000
@@ -0,0 +1,142 @@
+#############################
+# Test of the torque sensor zero calibration, to run on a computer with the fake canio module on this folder.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_torque_calibration.py
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import canio
+import torque_calibration
+import torque_sensor
+from torque_calibration import TorqueCalibration
+
+def add_window(calibration, values):
+    """Add one window of samples, the values are repeated to fill it"""
+    for i in range(calibration._window_samples):
+        calibration.add_unloaded_sample(values[i % len(values)])
+
+def test_first_stable_window_sets_the_zero(fake_ticks):
+    fake_ticks(torque_calibration)
+    calibration = TorqueCalibration()
+    assert calibration.zero_raw == torque_calibration.DEFAULT_ZERO_RAW
+    add_window(calibration, (770, 772, 774))
+    assert calibration.zero_raw == (770 * 9 + 772 * 8 + 774 * 8) // 25
+    assert calibration.windows == 1
+
+def test_drift_is_tracked_slowly(fake_ticks):
+    fake_ticks(torque_calibration)
+    calibration = TorqueCalibration()
+    add_window(calibration, (750,))
+    add_window(calibration, (770,))
+    assert 750 <= calibration.zero_raw < 752
+    for _ in range(400):
+        add_window(calibration, (770,))
+    assert 768 <= calibration.zero_raw <= 770
+
+def test_unstable_window_is_rejected(fake_ticks):
+    # a foot resting lightly on a pedal: close to the zero, but the value moves
+    fake_ticks(torque_calibration)
+    calibration = TorqueCalibration()
+    for _ in range(10):
+        add_window(calibration, (760, 775, 790, 775))
+    assert calibration.zero_raw == torque_calibration.DEFAULT_ZERO_RAW
+    assert (calibration.windows, calibration.rejected) == (0, 10)
+
+def test_far_window_is_rejected(fake_ticks):
+    # weight on the pedals while stopped: stable, but far from the zero
+    fake_ticks(torque_calibration)
+    calibration = TorqueCalibration()
+    add_window(calibration, (750 + 41,))
+    add_window(calibration, (750 - 41,))
+    assert calibration.zero_raw == torque_calibration.DEFAULT_ZERO_RAW
+    assert calibration.rejected == 2
+
+    # a partial window is discarded when pedaling starts
+    for _ in range(20):
+        calibration.add_unloaded_sample(760)
+    calibration.discard_window()
+    add_window(calibration, (740,))
+    assert calibration.zero_raw == 740
+
+def test_zero_is_clamped(fake_ticks):
+    fake_ticks(torque_calibration)
+    calibration = TorqueCalibration(max_offset = 20, max_deviation = 40)
+    add_window(calibration, (790,))
+    assert calibration.zero_raw == 770
+    add_window(calibration, (700,))
+    assert calibration.zero_raw == 770 # far from the zero
+    add_window(calibration, (731,))
+    assert calibration.zero_raw == 769 # low pass filtered
+    for _ in range(400):
+        add_window(calibration, (calibration.zero_raw - 30,))
+    assert calibration.zero_raw == 730
+
+def test_nvm_record_round_trip(fake_ticks):
+    ticks = fake_ticks(torque_calibration)
+    nvm = bytearray(16)
+    calibration = TorqueCalibration(nvm, nvm_offset = 4)
+    assert calibration.zero_raw == torque_calibration.DEFAULT_ZERO_RAW # no valid record yet
+
+    # learning the zero only marks it to be saved, after the save period
+    add_window(calibration, (780,))
+    assert calibration.zero_raw == 780
+    assert not calibration.save_pending
+    ticks.advance(60000)
+    add_window(calibration, (780,))
+    assert calibration.save_pending
+    assert nvm == bytearray(16) # not written from the CAN receive path
+    calibration.save()
+    assert not calibration.save_pending and calibration.saves == 1
+    assert nvm[:4] == bytearray(4) and nvm[4 + torque_calibration.NVM_RECORD_LENGHT:] == bytearray(16 - 4 - torque_calibration.NVM_RECORD_LENGHT)
+
+    # the next startup begins from the saved zero
+    assert TorqueCalibration(nvm, nvm_offset = 4).zero_raw == 780
+
+    # a corrupted record, or a zero out of the max offset, is not used
+    corrupted = bytearray(nvm)
+    corrupted[4 + 2] ^= 1
+    assert TorqueCalibration(corrupted, nvm_offset = 4).zero_raw == torque_calibration.DEFAULT_ZERO_RAW
+    assert TorqueCalibration(nvm, nvm_offset = 4, default_zero_raw = 1000).zero_raw == 1000
+
+def test_torque_x10():
+    calibration = TorqueCalibration(default_zero_raw = 750, raw_per_weight_x10 = 6.1)
+    assert calibration.torque_x10(700) == 0
+    assert calibration.torque_x10(750) == 0
+    for torque_raw in (751, 811, 1000, 3190):
+        assert abs(calibration.torque_x10(torque_raw) - (torque_raw - 750) / 6.1) < 1
+
+def torque_message(torque_raw, cadence, progressive_byte):
+    return canio.Message(torque_sensor.TORQUE_SENSOR_CAN_ID, bytes([torque_raw & 0xff, torque_raw >> 8, cadence, progressive_byte, 0, 0, 0, 0]), extended = True)
+
+def test_torque_sensor_learns_only_after_the_cadence_timeout(fake_ticks):
+    ticks = fake_ticks(torque_calibration, torque_sensor, now_ms = 1000)
+    can_bus = canio.CAN()
+    sensor = torque_sensor.TorqueSensor(None, None, cadence_timeout = 1.0, can_bus = can_bus)
+    progressive_byte = 0
+
+    def receive(seconds, torque_raw, cadence):
+        nonlocal progressive_byte
+        for i in range(int(seconds * 100)):
+            ticks.advance(10)
+            can_bus.inject(torque_message(torque_raw, cadence if i % 5 == 0 else 0, progressive_byte))
+            progressive_byte = (progressive_byte + 1) & 0xff
+            sensor.receive()
+            sensor.value # the motor control reads the value on its own task
+
+    # at startup, the cadence timeout must pass before learning
+    receive(0.9, 770, 0)
+    assert sensor.calibration.windows == 0
+    receive(1.0, 770, 0)
+    assert sensor.calibration.zero_raw == 770
+
+    # pedaling, with cadence 0 between the pedal position updates
+    receive(2.0, 760, 60)
+    assert sensor.calibration.zero_raw == 770
+    receive(0.9, 760, 0)
+    assert sensor.calibration.zero_raw == 770
+    receive(5.0, 760, 0)
+    assert sensor.calibration.zero_raw < 770
@@ -0,0 +1,66 @@
+#############################
+# Test of the torque average over a crank revolution fraction, to run on a computer.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_torque_filter.py (or python test_torque_filter.py)
+#############################
+
+import os
+import sys
+import math
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+from torque_filter import CrankTorqueFilter
+from conftest import TICKS_PERIOD
+
+def test_window_from_cadence_across_the_bins_wrap():
+    # 201 bins of 10ms: after 3.5 seconds the bins wrapped around
+    crank_filter = CrankTorqueFilter(revolution_fraction = 2, bin_ms = 10, max_window_ms = 2000)
+    values = [700 + (i * 7) % 300 for i in range(350)]
+    for i, value in enumerate(values):
+        crank_filter.add(1000 + i * 10, value)
+
+    # 60 RPM: half a revolution is 500ms, the last 50 samples
+    assert crank_filter.value(60) == sum(values[-50:]) // 50
+    # 90 RPM: 333ms, 33 bins
+    assert crank_filter.value(90) == sum(values[-33:]) // 33
+    # 10 RPM: 3 seconds, limited to the max window of 200 bins
+    assert crank_filter.value(10) == sum(values[-200:]) // 200
+    # no cadence: the latest sample
+    assert crank_filter.value(0) == values[-1]
+
+def test_pedal_pulses_are_removed():
+    # the torque goes up and down twice per crank revolution, at 75 RPM, with a sample every 10ms
+    crank_filter = CrankTorqueFilter(revolution_fraction = 2)
+    averages = []
+    for i in range(500):
+        time_ms = i * 10
+        torque_raw = 1000 + int(300 * abs(math.sin(math.pi * time_ms / 400))) # half a revolution is 400ms
+        crank_filter.add(time_ms, torque_raw)
+        if i >= 40:
+            averages.append(crank_filter.value(75))
+    mean = 1000 + 300 * 2 / math.pi
+    assert max(averages) - min(averages) <= 2
+    assert abs(sum(averages) / len(averages) - mean) < 3
+
+def test_missing_samples_and_ticks_wrap():
+    crank_filter = CrankTorqueFilter(revolution_fraction = 1, bin_ms = 10, max_window_ms = 2000)
+    start_ms = TICKS_PERIOD - 1000
+    for i in range(200):
+        crank_filter.add((start_ms + i * 10) % TICKS_PERIOD, 500)
+
+    # no samples for 300ms, then a higher torque: the empty bins are not counted as samples
+    for i in range(230, 260):
+        crank_filter.add((start_ms + i * 10) % TICKS_PERIOD, 800)
+    # 60 RPM, full revolution: the last 100 bins, with 40 samples of 500, 30 empty bins and 30 samples of 800
+    assert crank_filter.value(60) == (40 * 500 + 30 * 800) // 70
+
+    # no samples for longer than the max window: only the new ones
+    crank_filter.add((start_ms + 600 * 10) % TICKS_PERIOD, 900)
+    assert crank_filter.value(60) == 900
+
+if __name__ == '__main__':
+    test_window_from_cadence_across_the_bins_wrap()
+    test_pedal_pulses_are_removed()
+    test_missing_samples_and_ticks_wrap()
+    print("all tests passed")
@@ -0,0 +1,72 @@
+#############################
+# Test of the torque sensor ring buffer of samples, to run on a computer with the fake canio module on this folder.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_torque_sensor.py
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import pytest
+import canio
+import torque_calibration
+import torque_sensor
+
+def torque_message(torque_raw, cadence, progressive_byte):
+    return canio.Message(torque_sensor.TORQUE_SENSOR_CAN_ID, bytes([torque_raw & 0xff, torque_raw >> 8, cadence, progressive_byte, 0, 0, 0, 0]), extended = True)
+
+@pytest.fixture
+def ticks(fake_ticks):
+    return fake_ticks(torque_calibration, torque_sensor, now_ms = 1000)
+
+@pytest.fixture
+def can_bus():
+    return canio.CAN()
+
+def test_average_window(ticks, can_bus):
+    sensor = torque_sensor.TorqueSensor(None, None, ring_size = 16, can_bus = can_bus)
+    assert sensor.average(100) == (0, 0, 0)
+
+    # a message every 10ms, the torque and cadence go up on each one
+    for i in range(20):
+        ticks.advance(10)
+        can_bus.inject(torque_message(800 + i, 40 + i, i))
+        sensor.receive()
+
+    # the last 50ms: the newest sample and the 5 before it
+    assert sensor.average(50) == (sum(range(814, 820)) // 6, sum(range(54, 60)) // 6, 6)
+    assert sensor.average(0) == (819, 59, 1)
+    # a window longer than the ring: only the ring_size newest samples
+    assert sensor.average(1000) == (sum(range(804, 820)) // 16, sum(range(44, 60)) // 16, 16)
+
+    # no new messages
+    ticks.advance(30)
+    assert sensor.average(50) == (sum(range(817, 820)) // 3, sum(range(57, 60)) // 3, 3)
+    ticks.advance(100)
+    assert sensor.average(50) == (0, 0, 0)
+
+def test_dropped_frames(ticks, can_bus):
+    sensor = torque_sensor.TorqueSensor(None, None, ring_size = 4, can_bus = can_bus)
+
+    def receive(progressive_bytes):
+        for progressive_byte in progressive_bytes:
+            ticks.advance(10)
+            can_bus.inject(torque_message(750, 0, progressive_byte))
+            sensor.receive()
+
+    # the first message has no previous one to compare
+    receive((200, 201, 202))
+    assert (sensor.frames, sensor.dropped_frames) == (3, 0)
+
+    # 1 and 3 messages lost
+    receive((204, 205, 209))
+    assert (sensor.frames, sensor.dropped_frames) == (6, 4)
+
+    # the progressive byte wraps around after 255, also between the end and the begin of the ring
+    receive(tuple(range(210, 256)) + (0, 1, 2))
+    assert sensor.dropped_frames == 4
+    receive((254, 1))
+    assert sensor.dropped_frames == 4 + 251 + 2
+    assert sensor.latest[3] == 1
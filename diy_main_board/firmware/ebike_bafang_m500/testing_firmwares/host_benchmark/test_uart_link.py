@@ -0,0 +1,230 @@
+#############################
+# Test of the main board <-> display UART link packages, to run on a computer.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_uart_link.py (or python test_uart_link.py)
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+from uart_link import FrameScanner, MAX_PACKAGE_LENGHT, DeltaEncoder, DeltaDecoder, TELEMETRY_SCHEMA, COMMAND_SCHEMA, PACKAGE_KEYFRAME, PACKAGE_DELTA
+
+class Telemetry(object):
+    def __init__(self, **values):
+        for name in TELEMETRY_SCHEMA.names:
+            setattr(self, name, 0)
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def values(self):
+        return {name: getattr(self, name) for name in TELEMETRY_SCHEMA.names}
+
+def telemetry_package(sequence = 0, **values):
+    buffer = bytearray(64)
+    lenght = TELEMETRY_SCHEMA.pack_into(buffer, Telemetry(**values), sequence)
+    return bytes(buffer[:lenght])
+
+def scan(scanner, data, chunk_size = None):
+    """Feed data to the scanner, in chunks, and return the packages found"""
+    buffer = bytearray(255)
+    packages = []
+    if chunk_size is None:
+        chunk_size = len(data)
+    for position in range(0, len(data), chunk_size):
+        scanner.feed(data[position: position + chunk_size])
+        while True:
+            lenght = scanner.next_frame(buffer)
+            if lenght == 0:
+                break
+            packages.append(bytes(buffer[:lenght]))
+    return packages
+
+def test_scanner_partial_packages():
+    packages = [telemetry_package(i, speed = i) for i in range(10)]
+    for chunk_size in (1, 3, 7, 64):
+        found = scan(FrameScanner(), b''.join(packages), chunk_size)
+        assert found == [package[:-2] for package in packages]
+
+def test_scanner_one_error_per_resync():
+    scanner = FrameScanner()
+    good = telemetry_package(1)
+    bad_crc = bytearray(telemetry_package(2))
+    bad_crc[-1] ^= 0xff
+    # noise with false start bytes (bad len and a len that ends inside the next package), and bytes without start bytes
+    noise = b'\x00\x01\x02\x01\xaa\x00\x01\x02\x14\x55\x00\x01'
+
+    # the false start with the long len waits for the next bytes, then the next package is found
+    assert len(scan(scanner, good + noise + good * 3)) == 4
+    assert scanner.errors == 1
+
+    assert len(scan(scanner, bytes(bad_crc) + good)) == 1
+    assert scanner.errors == 2
+
+    assert len(scan(scanner, b'\xaa' * 100 + good, chunk_size = 7)) == 1
+    assert scanner.errors == 3
+
+    # noise before the first package, from the other end starting up, is not an error
+    scanner = FrameScanner()
+    assert len(scan(scanner, noise + good * 3)) == 3
+    assert scanner.errors == 0
+    assert scanner.frames == 3
+
+def test_scanner_start_bytes_on_the_data():
+    # motor_current 0, motor_power 0x0201 and human_pedal_power 200: the data bytes have 0, 1, 2 followed by 200
+    package = telemetry_package(1, motor_current = 0, motor_power = 0x0201, human_pedal_power = 200)
+    assert b'\x00\x01\x02\xc8' in package[4:]
+    good = telemetry_package(2)
+    assert scan(FrameScanner(), package + good) == [package[:-2], good[:-2]]
+
+    # the first bytes were lost: the false start bytes have a len bigger than any package, so the scanner resyncs
+    # right away instead of waiting for 200 more bytes
+    assert 200 > MAX_PACKAGE_LENGHT
+    scanner = FrameScanner()
+    assert scan(scanner, good + package[5:] + good) == [good[:-2], good[:-2]]
+    assert scanner.errors == 1
+
+    # without the max lenght, the next package is only found after the false len
+    scanner = FrameScanner(max_lenght = 255)
+    assert scan(scanner, good + package[5:] + good) == [good[:-2]]
+
+def send(encoder, data):
+    buffer = bytearray(64)
+    lenght = encoder.pack_into(buffer, data)
+    return bytes(buffer[:lenght])
+
+def receive(decoder, package, data):
+    found = scan(FrameScanner(), package)
+    assert len(found) == 1
+    return decoder.unpack_from(found[0], len(found[0]), data)
+
+def changed_telemetry(step):
+    # a few fields change on each step, the others keep the value
+    return Telemetry(
+        battery_voltage = 48,
+        motor_current = step % 20,
+        motor_power = 100 * step,
+        cadence = 60 + step % 3,
+        speed = 25,
+        command_ack = step & 0xFF)
+
+def test_keyframe_round_trip():
+    values = dict(battery_voltage = 52, motor_current = 12, motor_power = 650, human_pedal_power = 180,
+        vesc_temperature_x10 = 45, motor_temperature_sensor_x10 = 60, vesc_fault_code = 3, cadence = 75, speed = 28,
+        command_ack = 200)
+    package = telemetry_package(7, **values)
+    found = scan(FrameScanner(), package)[0]
+    data = Telemetry()
+    assert TELEMETRY_SCHEMA.package_type(found, len(found)) == PACKAGE_KEYFRAME
+    assert TELEMETRY_SCHEMA.unpack_from(found, len(found), data)
+    assert data.values() == values
+
+    # command schema, from the display
+    class Command(object):
+        assist_level = 17
+    buffer = bytearray(64)
+    lenght = COMMAND_SCHEMA.pack_into(buffer, Command(), 9)
+    found = scan(FrameScanner(), bytes(buffer[:lenght]))[0]
+    command = Command()
+    command.assist_level = 0
+    assert COMMAND_SCHEMA.unpack_from(found, len(found), command)
+    assert command.assist_level == 17
+
+def test_delta_round_trip():
+    encoder = DeltaEncoder(TELEMETRY_SCHEMA, keyframe_period = 5)
+    decoder = DeltaDecoder(TELEMETRY_SCHEMA)
+    data = Telemetry()
+    for step in range(30):
+        sent = changed_telemetry(step)
+        package = send(encoder, sent)
+        if step % 5:
+            # deltas are smaller than the keyframes
+            assert len(package) < TELEMETRY_SCHEMA.lenght + 2
+        assert receive(decoder, package, data)
+        assert data.values() == sent.values()
+
+    assert encoder.keyframes == 6
+    assert encoder.deltas == 24
+    assert decoder.deltas == 24
+
+def test_field_clamping():
+    # values out of the field range are limited to its min and max, and floats are sent as int
+    package = telemetry_package(1, battery_voltage = 300, motor_current = -5, motor_power = 12000, cadence = 72.9, speed = 150)
+    found = scan(FrameScanner(), package)[0]
+    data = Telemetry()
+    assert TELEMETRY_SCHEMA.unpack_from(found, len(found), data)
+    assert data.battery_voltage == 127
+    assert data.motor_current == 0
+    assert data.motor_power == 5000
+    assert data.cadence == 72
+    assert data.speed == 99
+
+    # the same on delta packages
+    encoder = DeltaEncoder(TELEMETRY_SCHEMA, keyframe_period = 5)
+    decoder = DeltaDecoder(TELEMETRY_SCHEMA)
+    data = Telemetry()
+    assert receive(decoder, send(encoder, Telemetry()), data)
+    package = send(encoder, Telemetry(motor_power = 9999, vesc_fault_code = 300))
+    assert receive(decoder, package, data)
+    assert data.motor_power == 5000
+    assert data.vesc_fault_code == 255
+
+def test_resync_after_lost_delta():
+    encoder = DeltaEncoder(TELEMETRY_SCHEMA, keyframe_period = 5)
+    decoder = DeltaDecoder(TELEMETRY_SCHEMA)
+    data = Telemetry()
+    for step in range(20):
+        sent = changed_telemetry(step)
+        package = send(encoder, sent)
+        if step in (2, 3):
+            # lost deltas: the next delta has all the changes since the keyframe
+            continue
+        assert receive(decoder, package, data)
+        assert data.values() == sent.values()
+    assert decoder.missed == 0
+
+def test_resync_after_lost_keyframe():
+    encoder = DeltaEncoder(TELEMETRY_SCHEMA, keyframe_period = 5)
+    decoder = DeltaDecoder(TELEMETRY_SCHEMA)
+    data = Telemetry()
+    stream = bytearray()
+    last_sent = None
+    for step in range(15):
+        sent = changed_telemetry(step)
+        package = send(encoder, sent)
+        if step == 5:
+            # lost keyframe: its deltas are ignored until the next keyframe
+            continue
+        if step == 7:
+            # and a corrupted delta
+            package = package[:-1] + bytes([package[-1] ^ 0xff])
+        stream += package
+        last_sent = sent
+
+    scanner = FrameScanner()
+    buffer = bytearray(255)
+    scanner.feed(bytes(stream))
+    types = []
+    while True:
+        lenght = scanner.next_frame(buffer)
+        if lenght == 0:
+            break
+        types.append(TELEMETRY_SCHEMA.package_type(buffer, lenght))
+        decoder.unpack_from(buffer, lenght, data)
+
+    assert types.count(PACKAGE_KEYFRAME) == 2
+    assert decoder.missed == 3 # steps 6, 8 and 9, the corrupted step 7 is dropped by the scanner
+    assert scanner.errors == 1
+    assert data.values() == last_sent.values()
+
+if __name__ == '__main__':
+    test_scanner_partial_packages()
+    test_scanner_one_error_per_resync()
+    test_scanner_start_bytes_on_the_data()
+    test_keyframe_round_trip()
+    test_delta_round_trip()
+    test_field_clamping()
+    test_resync_after_lost_delta()
+    test_resync_after_lost_keyframe()
+    print("all tests passed")
@@ -0,0 +1,159 @@
+#############################
+# Test of the VESC UART packets parser and the telemetry decoding, to run on a computer with the fake busio module on this folder.
+#
+# Run from this folder: python -m pytest test_vesc_parser.py (or python test_vesc_parser.py)
+#############################
+
+import os
+import sys
+import struct
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import checksum
+import vesc
+from vesc import VescPacketParser
+
+class AppData(object):
+    vesc_temperature_x10 = 0
+    motor_current = 0.0
+    battery_current = 0.0
+    motor_speed_erpm = 0
+    battery_voltage = 0.0
+    vesc_fault_code = 0
+
+def packet(payload):
+    """VESC packet: short with start byte 2 and 1 len byte, or long with start byte 3 and 2 len bytes"""
+    if len(payload) < 256:
+        header = bytes([2, len(payload)])
+    else:
+        header = bytes([3, len(payload) >> 8, len(payload) & 0xff])
+    crc = checksum.crc16_ccitt(payload)
+    return header + bytes(payload) + bytes([crc >> 8, crc & 0xff, 3])
+
+def packets(parser):
+    found = []
+    while True:
+        payload = parser.packet()
+        if payload is None:
+            return found
+        found.append(bytes(payload))
+
+def test_packets_split_on_feeds():
+    payloads = [bytes([vesc.COMM_GET_VALUES]) + bytes(range(i, i + 20)) for i in range(5)]
+    stream = b''.join(packet(payload) for payload in payloads)
+    for chunk_size in (1, 2, 5, 13, 37):
+        parser = VescPacketParser(buffer_size = 64) # the buffer is compacted while receiving
+        found = []
+        for position in range(0, len(stream), chunk_size):
+            parser.feed(stream[position: position + chunk_size])
+            found += packets(parser)
+        assert found == payloads
+        assert (parser.packets, parser.errors) == (5, 0)
+
+def test_bad_packets_resync_inside_the_buffer():
+    good = bytes([vesc.COMM_GET_VALUES, 1, 2, 3])
+    bad_crc = bytearray(packet(bytes([vesc.COMM_GET_VALUES, 9, 9, 9])))
+    bad_crc[-2] ^= 0xff
+    bad_end = bytearray(packet(bytes([vesc.COMM_GET_VALUES, 8, 8, 8])))
+    bad_end[-1] = 0
+
+    # the good packets right after the bad ones, on the same feed, are found
+    parser = VescPacketParser(max_payload_len = 255)
+    parser.feed(bytes(bad_crc) + packet(good) + bytes(bad_end) + packet(good))
+    assert packets(parser) == [good, good]
+    assert parser.errors >= 2
+
+    # a false start byte on the payload of a bad packet, with a len that ends inside the good packet
+    parser = VescPacketParser()
+    parser.feed(bytes([2, 7, 0x55, 0x55, 0x55]) + packet(good))
+    assert packets(parser) == [good]
+
+    # the end byte of the bad packet is also a long packet start byte, with the good packet start as len: 0x0204.
+    # The Vesc parser only expects short packets, so it does not wait for 516 bytes
+    parser = VescPacketParser(max_payload_len = 255)
+    parser.feed(bytes(bad_crc) + packet(good))
+    assert packets(parser) == [good]
+    parser = VescPacketParser()
+    parser.feed(bytes(bad_crc) + packet(good))
+    assert packets(parser) == []
+
+def test_long_packet():
+    payload = bytes([vesc.COMM_GET_VALUES]) + bytes(i & 0xff for i in range(299))
+    data = packet(payload)
+    assert data[0] == 3 and (data[1] << 8) | data[2] == 300
+    parser = VescPacketParser()
+    for position in range(0, len(data), 64):
+        assert packets(parser) == []
+        parser.feed(data[position: position + 64])
+    assert packets(parser) == [payload]
+
+    # bigger than the buffer: not a valid start byte
+    parser = VescPacketParser(buffer_size = 128)
+    parser.feed(data[:100])
+    assert packets(parser) == []
+    assert parser.errors >= 1
+
+TELEMETRY_FIELDS = (vesc.VALUE_ERPM, vesc.VALUE_TEMPERATURE_MOSFET, vesc.VALUE_BATTERY_VOLTAGE, vesc.VALUE_MOTOR_CURRENT)
+
+def selective_response(mask, temperature_mosfet = 365, motor_current = 1234, erpm = -4500, battery_voltage = 523):
+    # the fields by the order of the bit position
+    return struct.pack('>BLhllh', vesc.COMM_GET_VALUES_SELECTIVE, mask, temperature_mosfet, motor_current, erpm, battery_voltage)
+
+def test_selective_request():
+    motor = vesc.Vesc(None, None, AppData(), telemetry_fields = TELEMETRY_FIELDS)
+    motor.refresh_data()
+    frame = motor._uart.last_written
+    mask = (1 << vesc.VALUE_TEMPERATURE_MOSFET) | (1 << vesc.VALUE_MOTOR_CURRENT) | (1 << vesc.VALUE_ERPM) | (1 << vesc.VALUE_BATTERY_VOLTAGE)
+    assert bytes(frame) == packet(struct.pack('>BL', vesc.COMM_GET_VALUES_SELECTIVE, mask))
+
+def test_selective_response_decoded():
+    data = AppData()
+    motor = vesc.Vesc(None, None, data, telemetry_fields = TELEMETRY_FIELDS)
+    mask = motor._telemetry_mask
+    motor._uart.inject(packet(selective_response(mask)))
+    assert motor.process_data()
+    assert data.vesc_temperature_x10 == 365 - 110
+    assert abs(data.motor_current - 12.34) < 0.001
+    assert data.motor_speed_erpm == -4500
+    assert abs(data.battery_voltage - 52.3) < 0.001
+    assert data.vesc_fault_code == 0 # not asked
+    assert not motor.process_data() # no new packets
+
+def test_selective_response_mask_mismatch_is_rejected():
+    data = AppData()
+    motor = vesc.Vesc(None, None, data, telemetry_fields = TELEMETRY_FIELDS)
+    other_mask = motor._telemetry_mask | (1 << vesc.VALUE_FAULT_CODE)
+    motor._uart.inject(packet(selective_response(other_mask) + bytes([4])))
+    assert not motor.process_data()
+    assert (data.vesc_temperature_x10, data.motor_speed_erpm, data.battery_voltage) == (0, 0, 0.0)
+
+    # a full COMM_GET_VALUES response is not for this request either
+    motor._uart.inject(packet(bytes([vesc.COMM_GET_VALUES]) + bytes(struct.calcsize('>' + vesc._VALUES_FORMAT))))
+    assert not motor.process_data()
+
+    # a response that is too short
+    motor._uart.inject(packet(selective_response(motor._telemetry_mask)[:-1]))
+    assert not motor.process_data()
+    assert data.motor_speed_erpm == 0
+
+def test_full_response_decoded():
+    data = AppData()
+    motor = vesc.Vesc(None, None, data)
+    values = [0] * len(vesc._VALUES_FORMAT)
+    values[vesc.VALUE_TEMPERATURE_MOSFET] = 400
+    values[vesc.VALUE_BATTERY_CURRENT] = -250
+    values[vesc.VALUE_ERPM] = 12000
+    values[vesc.VALUE_FAULT_CODE] = 3
+    motor._uart.inject(packet(struct.pack('>B' + vesc._VALUES_FORMAT, vesc.COMM_GET_VALUES, *values)))
+    assert motor.process_data()
+    assert (data.vesc_temperature_x10, data.battery_current, data.motor_speed_erpm, data.vesc_fault_code) == (290, -2.5, 12000, 3)
+
+if __name__ == '__main__':
+    test_packets_split_on_feeds()
+    test_bad_packets_resync_inside_the_buffer()
+    test_long_packet()
+    test_selective_request()
+    test_selective_response_decoded()
+    test_selective_response_mask_mismatch_is_rejected()
+    test_full_response_decoded()
+    print("all tests passed")
@@ -0,0 +1,225 @@
+#############################
+# Test of the VESC session and setpoint publisher, to run on a computer.
+# The VESC transport is simulated and keeps what was sent, the time is simulated: time.monotonic_ns() of the
+# vesc_session module only moves when the test advances it.
+#
+# Run from this folder: python -m pytest test_vesc_session.py
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import pytest
+import vesc_session
+from vesc_session import VescSession, VescSetpointPublisher
+
+class FakeTime(object):
+    """Simulated time.monotonic_ns() for the vesc_session module"""
+
+    def __init__(self):
+        self.now_ns = 5000000000 # the session starts after the boot
+
+    def monotonic_ns(self):
+        return self.now_ns
+
+    def advance_ms(self, ms):
+        self.now_ns += ms * 1000000
+
+class FakeVesc(object):
+    """Vesc like transport, keeps the sent commands. process_data() returns True when a response was set"""
+
+    def __init__(self):
+        self.sent = []
+        self.response = False
+
+    def set_motor_current_amps(self, value):
+        self.sent.append(('A', value))
+
+    def set_motor_current_milliamps(self, value):
+        self.sent.append(('mA', value))
+
+    def set_motor_current_brake_amps(self, value):
+        self.sent.append(('brake A', value))
+
+    def set_motor_speed_erpm(self, value):
+        self.sent.append(('erpm', value))
+
+    def brake(self):
+        self.sent.append(('brake', None))
+
+    def send_heart_beat(self):
+        self.sent.append(('heart beat', None))
+
+    def refresh_data(self):
+        self.sent.append(('refresh', None))
+
+    def process_data(self):
+        response = self.response
+        self.response = False
+        return response
+
+    def count(self, command):
+        return sum(1 for sent in self.sent if sent[0] == command)
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(vesc_session, 'time', fake)
+    return fake
+
+def test_heart_beat_only_when_idle(fake_time):
+    vesc = FakeVesc()
+    session = VescSession(vesc)
+    session.heart_beat() # nothing was sent yet
+    assert vesc.count('heart beat') == 1
+
+    # called every 100ms: sent again only after 0.5 seconds
+    for _ in range(4):
+        fake_time.advance_ms(100)
+        session.heart_beat()
+    assert vesc.count('heart beat') == 1
+    fake_time.advance_ms(100)
+    session.heart_beat()
+    assert vesc.count('heart beat') == 2
+    assert session.heart_beats == 2
+
+def test_commands_count_as_heart_beat(fake_time):
+    vesc = FakeVesc()
+    session = VescSession(vesc)
+    session.heart_beat()
+
+    # a command every 200ms: no heart beat is needed
+    for command in (lambda: session.set_motor_current_milliamps(1500), lambda: session.set_motor_speed_erpm(3000),
+                    lambda: session.set_motor_current_amps(2), lambda: session.set_motor_current_brake_amps(1),
+                    session.brake) * 3:
+        fake_time.advance_ms(200)
+        command()
+        session.heart_beat()
+    assert vesc.count('heart beat') == 1
+    assert session.commands == 15
+    assert ('mA', 1500) in vesc.sent and ('erpm', 3000) in vesc.sent and ('brake', None) in vesc.sent
+
+    # the commands stop
+    fake_time.advance_ms(499)
+    session.heart_beat()
+    assert vesc.count('heart beat') == 1
+    fake_time.advance_ms(1)
+    session.heart_beat()
+    assert vesc.count('heart beat') == 2
+
+def test_one_telemetry_request_waiting(fake_time):
+    vesc = FakeVesc()
+    session = VescSession(vesc)
+
+    # no response yet: a single request is waiting, even after the telemetry period
+    for _ in range(12):
+        session.telemetry()
+        fake_time.advance_ms(10)
+    assert vesc.count('refresh') == 1
+    assert session.telemetry_timeouts == 0
+
+    # the response arrives after 120ms: matched to the request and, as the period passed, a new request is sent
+    vesc.response = True
+    assert session.telemetry()
+    assert session.telemetry_responses == 1
+    assert (session.latency_ms, session.latency_max_ms) == (120, 120)
+    assert vesc.count('refresh') == 2
+
+    fake_time.advance_ms(30)
+    vesc.response = True
+    assert session.telemetry()
+    assert (session.latency_ms, session.latency_max_ms) == (30, 120)
+    assert session.telemetry_responses == 2
+    assert vesc.count('refresh') == 2 # waits for the period
+    fake_time.advance_ms(70)
+    session.telemetry()
+    assert vesc.count('refresh') == 3
+
+def test_telemetry_timeout(fake_time):
+    vesc = FakeVesc()
+    session = VescSession(vesc)
+    session.telemetry()
+    assert vesc.count('refresh') == 1
+
+    # not more than 0.25 seconds: still waiting
+    fake_time.advance_ms(250)
+    session.telemetry()
+    assert vesc.count('refresh') == 1
+    assert session.telemetry_timeouts == 0
+
+    # after the timeout, the request is given up and asked again right away
+    fake_time.advance_ms(10)
+    session.telemetry()
+    assert session.telemetry_timeouts == 1
+    assert vesc.count('refresh') == 2
+    assert session.telemetry_responses == 0
+
+    # a response for the new request
+    fake_time.advance_ms(15)
+    vesc.response = True
+    session.telemetry()
+    assert session.telemetry_responses == 1
+    assert session.latency_ms == 15
+
+def test_publisher_deadband(fake_time):
+    vesc = FakeVesc()
+    publisher = VescSetpointPublisher(vesc, current_deadband = 0.1, erpm_deadband = 20)
+    for value in (5000, 5050, 5099, 4950, 5100, 5150):
+        publisher.set_motor_current_milliamps(value)
+    assert vesc.sent == [('mA', 5000), ('mA', 5100)] # changes compared with the last value sent
+    for value in (3000, 3019, 2981, 3020):
+        publisher.set_motor_speed_erpm(value)
+    assert vesc.sent[2:] == [('erpm', 3000), ('erpm', 3020)]
+    for value in (2.0, 2.05, 1.95, 2.1):
+        publisher.set_motor_current_amps(value)
+    assert vesc.sent[4:] == [('A', 2.0), ('A', 2.1)]
+    assert (publisher.sent, publisher.suppressed) == (6, 8)
+
+def test_publisher_zero_and_command_change_always_sent(fake_time):
+    vesc = FakeVesc()
+    publisher = VescSetpointPublisher(vesc)
+    publisher.set_motor_current_milliamps(60)
+    publisher.set_motor_current_milliamps(0) # inside the deadband, but the motor must stop
+    publisher.set_motor_current_milliamps(0)
+    assert vesc.sent == [('mA', 60), ('mA', 0)]
+
+    # same value on another command
+    publisher.set_motor_speed_erpm(0)
+    publisher.set_motor_current_milliamps(0)
+    publisher.set_motor_current_amps(0)
+    assert vesc.sent[2:] == [('erpm', 0), ('mA', 0), ('A', 0)]
+
+def test_publisher_resend_period(fake_time):
+    vesc = FakeVesc()
+    publisher = VescSetpointPublisher(vesc, resend_period = 0.1)
+    publisher.set_motor_current_milliamps(4000)
+    for _ in range(9):
+        fake_time.advance_ms(10)
+        publisher.set_motor_current_milliamps(4000)
+    assert vesc.count('mA') == 1
+    fake_time.advance_ms(10)
+    publisher.set_motor_current_milliamps(4000)
+    assert vesc.count('mA') == 2
+
+    # also for 0, so it keeps working as VESC heart beat
+    publisher.set_motor_current_milliamps(0)
+    fake_time.advance_ms(50)
+    publisher.set_motor_current_milliamps(0)
+    fake_time.advance_ms(50)
+    publisher.set_motor_current_milliamps(0)
+    assert vesc.sent[-2:] == [('mA', 0), ('mA', 0)]
+    assert vesc.count('mA') == 4
+
+def test_publisher_through_session(fake_time):
+    # the setpoints sent by the publisher are commands of the session, so they count as heart beat
+    vesc = FakeVesc()
+    session = VescSession(vesc)
+    publisher = VescSetpointPublisher(session)
+    session.heart_beat()
+    for _ in range(20):
+        fake_time.advance_ms(50)
+        publisher.set_motor_current_milliamps(3000)
+        session.heart_beat()
+    assert vesc.count('heart beat') == 1
+    assert session.commands == publisher.sent == 10
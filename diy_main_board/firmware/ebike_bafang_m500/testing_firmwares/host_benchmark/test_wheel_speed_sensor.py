@@ -0,0 +1,130 @@
+#############################
+# Test of the wheel speed sensor driver, to run on a computer with the fake countio module on this folder.
+# A simulated wheel at a known speed generates the pulses, 1ms at a time, and the speed is read every 50ms,
+# like the display send data task.
+# Needs the adafruit_ticks library: pip install adafruit-circuitpython-ticks
+#
+# Run from this folder: python -m pytest test_wheel_speed_sensor.py
+#############################
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')) # ebike_bafang_m500 folder
+
+import pytest
+import countio
+import wheel_speed_sensor
+
+WHEEL_CIRCUMFERENCE_MM = 2325
+READ_PERIOD_MS = 50
+
+class Wheel(object):
+    """Simulated wheel with the magnets passing by the sensor"""
+
+    def __init__(self, ticks, magnets):
+        self.ticks = ticks
+        self.counter = countio.Counter()
+        self.sensor = wheel_speed_sensor.WheelSpeedSensor(None, WHEEL_CIRCUMFERENCE_MM, magnets = magnets, counter = self.counter)
+        self.speed_factor = (WHEEL_CIRCUMFERENCE_MM * 36) // magnets # km/h x10 for 1 pulse per ms
+        self._pulse_mm = WHEEL_CIRCUMFERENCE_MM / magnets
+        self._position_mm = 0.0
+        self.distance_mm = 0.0
+        self.last_pulse_ms = None # time of the last pulse
+        self.reads = [] # time, speed read in km/h x10 and time of the last read that saw a new pulse, of each read
+        self._read_count = 0
+        self._pulse_read_ms = None
+
+    def run(self, speed_kmh, duration_ms):
+        """Run the wheel at speed_kmh for duration_ms
+        return: list of the speeds read, in km/h x10
+        """
+        mm_per_ms = speed_kmh / 3.6
+        speeds_x10 = []
+        for _ in range(duration_ms // READ_PERIOD_MS):
+            for _ in range(READ_PERIOD_MS):
+                self.ticks.advance(1)
+                self._position_mm += mm_per_ms
+                self.distance_mm += mm_per_ms
+                if self._position_mm >= self._pulse_mm:
+                    self._position_mm -= self._pulse_mm
+                    self.counter.pulse()
+                    self.last_pulse_ms = self.ticks.now_ms
+            speed_x10 = self.sensor.speed_x10
+            if self.counter.count != self._read_count:
+                self._read_count = self.counter.count
+                self._pulse_read_ms = self.ticks.now_ms
+            self.reads.append((self.ticks.now_ms, speed_x10, self._pulse_read_ms))
+            speeds_x10.append(speed_x10)
+        return speeds_x10
+
+def settle_reads(speed_kmh, magnets):
+    """Number of reads until all the speeds read are from measures at the new speed: up to 1 pulse to start
+    the measure or to end the measure started before, and 2 measures of at least 1 second"""
+    pulse_interval_ms = WHEEL_CIRCUMFERENCE_MM / magnets / (speed_kmh / 3.6)
+    return int(pulse_interval_ms + 2 * (1000 + pulse_interval_ms)) // READ_PERIOD_MS + 1
+
+def tolerance_x10(speed_kmh):
+    # the time between 2 reads that saw a pulse is at least 1 second, with an error up to the read period: 5%,
+    # plus the integer division
+    return speed_kmh * 10 * READ_PERIOD_MS / 1000 + 1
+
+@pytest.fixture
+def ticks(fake_ticks):
+    return fake_ticks(wheel_speed_sensor, now_ms = 1000)
+
+@pytest.mark.parametrize('magnets', (1, 4))
+def test_constant_speeds(ticks, magnets):
+    wheel = Wheel(ticks, magnets)
+    assert wheel.run(0, 2000) == [0] * 40
+    for speed_kmh in (5, 15, 25, 45, 12):
+        speeds_x10 = wheel.run(speed_kmh, 8000)
+        for speed_x10 in speeds_x10[settle_reads(speed_kmh, magnets):]:
+            assert abs(speed_x10 - speed_kmh * 10) <= tolerance_x10(speed_kmh), (speed_kmh, speeds_x10)
+
+@pytest.mark.parametrize('magnets', (1, 4))
+def test_stop_timeout(ticks, magnets):
+    wheel = Wheel(ticks, magnets)
+    wheel.run(20, 5000)
+    speeds_x10 = wheel.run(0, 5000)
+    stop_ms = wheel.last_pulse_ms
+    for i, speed_x10 in enumerate(speeds_x10):
+        since_pulse_ms = ticks.now_ms - (len(speeds_x10) - 1 - i) * READ_PERIOD_MS - stop_ms
+        if since_pulse_ms <= 3000 - READ_PERIOD_MS:
+            assert speed_x10 > 0 # no pulses for less than stop_timeout
+        elif since_pulse_ms > 3000 + READ_PERIOD_MS:
+            assert speed_x10 == 0
+
+    # starts again from stopped
+    speeds_x10 = wheel.run(10, 5000)
+    assert abs(speeds_x10[-1] - 100) <= tolerance_x10(10)
+
+@pytest.mark.parametrize('magnets', (1, 4))
+def test_slow_down_cap(ticks, magnets):
+    wheel = Wheel(ticks, magnets)
+    before_x10 = wheel.run(30, 5000)[-1]
+    reads_before = len(wheel.reads)
+    speeds_x10 = wheel.run(3, 8000)
+
+    # without new pulses, the speed is at most 1 pulse on the time since the last read that saw a pulse.
+    # A measure that ends after the slow down can still be higher than the cap before it, it includes the faster pulses
+    capped = 0
+    for now_ms, speed_x10, pulse_read_ms in wheel.reads[reads_before:]:
+        assert speed_x10 <= before_x10
+        if now_ms != pulse_read_ms:
+            assert speed_x10 <= wheel.speed_factor // (now_ms - pulse_read_ms)
+            if speed_x10 < 300 // 2:
+                capped += 1
+    assert capped > 0 # lowered before the measures at the new speed end
+    for speed_x10 in speeds_x10[settle_reads(3, magnets):]:
+        assert abs(speed_x10 - 30) <= tolerance_x10(3)
+
+@pytest.mark.parametrize('magnets', (1, 4))
+def test_distance(ticks, magnets):
+    wheel = Wheel(ticks, magnets)
+    for speed_kmh in (25, 40, 0, 15):
+        wheel.run(speed_kmh, 20000)
+    assert wheel.sensor.pulses == wheel.counter.count
+    # the distance is counted in whole pulses
+    pulse_m = WHEEL_CIRCUMFERENCE_MM / magnets / 1000
+    assert wheel.distance_mm / 1000 - pulse_m - 1 <= wheel.sensor.distance_m <= wheel.distance_mm / 1000
+    assert wheel.sensor.distance_m == wheel.sensor.pulses * WHEEL_CIRCUMFERENCE_MM // magnets // 1000
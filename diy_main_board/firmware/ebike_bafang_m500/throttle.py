@@ -1,5 +1,5 @@
 import analogio
-import simpleio
+import fixed_point
 
 class Throttle(object):
     """Throttle"""
@@ -10,8 +10,8 @@ class Throttle(object):
         :param max min: the max ADC value, usually 65535. Defaults to 65535.
         """
         self._adc_throttle = analogio.AnalogIn(adc_pin)
-        self._min = min
-        self._max = max
+        self._min = int(min)
+        self._max = int(max)
 
     @property
     def adc_value(self):
@@ -25,6 +25,5 @@ class Throttle(object):
         """Read the throttle
         return: throttle [0 - 1000]
         """
-        # map throttle to 0 --> 1000
-        throttle = simpleio.map_range(self._adc_throttle.value, self._min, self._max, 0, 1000)
-        return throttle
\ No newline at end of file
+        # map throttle to 0 --> 1000, with integer math
+        return fixed_point.map_range(self._adc_throttle.value, self._min, self._max, 0, 1000)
@@ -0,0 +1,172 @@
+import struct
+from adafruit_ticks import ticks_ms, ticks_diff
+
+# torque sensor raw value with no weight on the pedals, and raw value per each 0.1 kgs
+DEFAULT_ZERO_RAW = 750
+RAW_PER_WEIGHT_X10 = 6.1
+
+# the scale is in Q16 format
+_SCALE_Q = 16
+
+# NVM record: magic, version, zero raw value, checksum
+_NVM_MAGIC = 0x7a
+_NVM_VERSION = 1
+_NVM_FORMAT = '<BBHB'
+NVM_RECORD_LENGHT = struct.calcsize(_NVM_FORMAT)
+
+class TorqueCalibration(object):
+    """Torque sensor zero offset calibration.
+    The zero is learned from the torque samples while not pedaling (no cadence for the cadence timeout), in windows of
+    consecutive samples: only a stable window, with a small difference between its min and max samples, is used, as a
+    foot resting on a pedal while stopped moves the torque value. At startup the first stable window sets the zero, and
+    then the window averages are low pass filtered, to follow the sensor drift. Windows with samples far from the zero
+    are not used, and the zero is limited to max_offset from the default.
+    The zero is saved on the NVM, so the next startup begins from the last value. Writing the flash memory is slow, so
+    learning the zero only marks it to be saved: save() should be called from a low priority task, while the motor is
+    stopped."""
+
+    def __init__(self,
+            nvm = None,
+            nvm_offset = 0,
+            default_zero_raw = DEFAULT_ZERO_RAW,
+            raw_per_weight_x10 = RAW_PER_WEIGHT_X10,
+            max_offset = 150,
+            max_deviation = 40,
+            window_samples = 25,
+            max_variation = 10,
+            filter_shift = 6,
+            save_period = 60.0,
+            save_min_change = 2):
+        """Torque calibration
+        :param bytearray nvm: NVM to save the zero, like microcontroller.nvm, or None to not save it
+        :param int nvm_offset: offset on the NVM for the zero record
+        :param int default_zero_raw: torque sensor raw value with no weight on the pedals, used when there is no valid zero saved
+        :param float raw_per_weight_x10: torque sensor raw value for each 0.1 kgs
+        :param int max_offset: max difference of the zero to the default_zero_raw
+        :param int max_deviation: windows with samples that differ more than this from the zero are not used to learn the zero
+        :param int window_samples: number of consecutive samples on each window, the torque sensor sends about 100 samples per second
+        :param int max_variation: windows with a bigger difference between the min and max samples are not used to learn the zero
+        :param int filter_shift: low pass filter strength to track the drift, the time constant is about 2^shift windows
+        :param float save_period: min time in seconds between saves to NVM, as the flash memory wears out on each write
+        :param int save_min_change: the zero is saved to NVM only if it changed at least this
+        """
+        self._nvm = nvm
+        self._nvm_offset = nvm_offset
+        self._default_zero_raw = default_zero_raw
+        self._zero_min = default_zero_raw - max_offset
+        self._zero_max = default_zero_raw + max_offset
+        self._max_deviation = max_deviation
+        self._window_samples = window_samples
+        self._max_variation = max_variation
+        self._filter_shift = filter_shift
+        self._save_period_ms = int(save_period * 1000)
+        self._save_min_change = save_min_change
+        self._scale_q16 = int((1 << _SCALE_Q) / raw_per_weight_x10 + 0.5)
+
+        self.zero_raw = self._load()
+        self._saved_zero_raw = self.zero_raw
+        self._last_save_time = ticks_ms()
+        self._learned = False # the first stable window sets the zero
+        self._accumulated = self.zero_raw << self._filter_shift
+        self.save_pending = False # the zero changed enough to be saved on the NVM
+
+        # current window of samples
+        self._window_count = 0
+        self._window_sum = 0
+        self._window_min = 0
+        self._window_max = 0
+
+        # statistics
+        self.windows = 0 # windows used to learn the zero
+        self.rejected = 0 # windows not used, not stable or far from the zero
+        self.saves = 0
+
+    def _load(self):
+        """Zero from the NVM, or the default if there is no valid record"""
+        if self._nvm is None:
+            return self._default_zero_raw
+
+        record = self._nvm[self._nvm_offset:self._nvm_offset + NVM_RECORD_LENGHT]
+        magic, version, zero_raw, checksum = struct.unpack(_NVM_FORMAT, record)
+        if magic != _NVM_MAGIC or version != _NVM_VERSION or checksum != ((zero_raw + (zero_raw >> 8)) & 0xff) \
+                or zero_raw < self._zero_min or zero_raw > self._zero_max:
+            return self._default_zero_raw
+
+        return zero_raw
+
+    def save(self):
+        """Save the zero to NVM, if it changed. Writes the flash memory, so should not be called from the fast tasks"""
+        self.save_pending = False
+        if self._nvm is None or self.zero_raw == self._saved_zero_raw:
+            return
+
+        zero_raw = self.zero_raw
+        record = struct.pack(_NVM_FORMAT, _NVM_MAGIC, _NVM_VERSION, zero_raw, (zero_raw + (zero_raw >> 8)) & 0xff)
+        self._nvm[self._nvm_offset:self._nvm_offset + NVM_RECORD_LENGHT] = record
+        self._saved_zero_raw = zero_raw
+        self._last_save_time = ticks_ms()
+        self.saves += 1
+
+    def discard_window(self):
+        """Discard the samples of the current window, like when pedaling starts"""
+        self._window_count = 0
+
+    def add_unloaded_sample(self, torque_raw):
+        """Add a torque sample taken while not pedaling, to learn the zero when a window of samples is complete
+        :param int torque_raw: torque sensor raw value
+        """
+        if self._window_count == 0:
+            self._window_sum = 0
+            self._window_min = torque_raw
+            self._window_max = torque_raw
+        elif torque_raw < self._window_min:
+            self._window_min = torque_raw
+        elif torque_raw > self._window_max:
+            self._window_max = torque_raw
+        self._window_sum += torque_raw
+        self._window_count += 1
+        if self._window_count < self._window_samples:
+            return
+
+        self._window_count = 0
+        if self._window_max - self._window_min > self._max_variation or \
+                self._window_max > self.zero_raw + self._max_deviation or \
+                self._window_min < self.zero_raw - self._max_deviation:
+            self.rejected += 1
+            return
+
+        self.windows += 1
+        average = self._window_sum // self._window_samples
+        if not self._learned:
+            # at startup, the first stable window sets the zero
+            self._learned = True
+            self._accumulated = average << self._filter_shift
+        else:
+            # then track the drift slowly
+            self._accumulated += average - (self._accumulated >> self._filter_shift)
+        self._set_zero(self._accumulated >> self._filter_shift)
+
+    def _set_zero(self, zero_raw):
+        if zero_raw < self._zero_min:
+            zero_raw = self._zero_min
+            self._accumulated = zero_raw << self._filter_shift
+        elif zero_raw > self._zero_max:
+            zero_raw = self._zero_max
+            self._accumulated = zero_raw << self._filter_shift
+        self.zero_raw = zero_raw
+
+        # do not wear out the flash memory: save only after bigger changes and not too often
+        change = zero_raw - self._saved_zero_raw
+        if (change >= self._save_min_change or change <= -self._save_min_change) and \
+                ticks_diff(ticks_ms(), self._last_save_time) >= self._save_period_ms:
+            self.save_pending = True
+
+    def torque_x10(self, torque_raw):
+        """Convert the torque sensor raw value to weight in kgs x10, with integer math
+        :param int torque_raw: torque sensor raw value
+        return: torque weight x10, 0 if lower than the zero
+        """
+        value = torque_raw - self.zero_raw
+        if value <= 0:
+            return 0
+        return (value * self._scale_q16) >> _SCALE_Q
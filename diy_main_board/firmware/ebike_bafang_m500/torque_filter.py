@@ -0,0 +1,80 @@
+import array
+from adafruit_ticks import ticks_diff
+
+# the running sums wrap around on 30 bits, so they do not allocate memory on the heap,
+# the differences are still right while the sum of a window is lower than this
+_SUM_MASK = (1 << 30) - 1
+
+class CrankTorqueFilter(object):
+    """Average of the torque over a crank revolution (or a fraction of it), from the cadence.
+    The torque sensor value goes up and down with the pedal position, twice per crank revolution, so averaging over
+    exactly half or one revolution removes the pulses without adding more delay than needed.
+    The samples are added to time bins that keep the running sums of the torque and the number of samples, so the
+    sum over any window is the difference of 2 running sums, no matter how many samples are in the window."""
+
+    def __init__(self, revolution_fraction = 2, bin_ms = 10, max_window_ms = 2000):
+        """Crank torque filter
+        :param int revolution_fraction: average over 1 / revolution_fraction of a crank revolution: 1 is a full revolution, 2 half a revolution
+        :param int bin_ms: time bin size in milliseconds
+        :param int max_window_ms: max average window in milliseconds, for low cadence
+        """
+        self._revolution_fraction = revolution_fraction
+        self._bin_ms = bin_ms
+        self._bins = max_window_ms // bin_ms + 1
+        self._sums = array.array('L', [0] * self._bins) # running sum of the torque, at the end of each bin
+        self._counts = array.array('L', [0] * self._bins) # running number of samples, at the end of each bin
+        self._index = 0 # current bin
+        self._bin_start = None # ticks_ms when the current bin started
+        self._sum = 0
+        self._count = 0
+        self._latest = None
+
+    def add(self, time_ms, torque_raw):
+        """Add a torque sample
+        :param int time_ms: ticks_ms when the sample was received
+        :param int torque_raw: torque sensor raw value
+        """
+        if self._bin_start is None:
+            self._bin_start = time_ms
+
+        # move to the bin of this sample, the skipped bins keep the same running sums
+        elapsed_bins = ticks_diff(time_ms, self._bin_start) // self._bin_ms
+        if elapsed_bins > 0:
+            self._bin_start += elapsed_bins * self._bin_ms
+            if elapsed_bins > self._bins:
+                elapsed_bins = self._bins
+            index = self._index
+            for _ in range(elapsed_bins):
+                index += 1
+                if index == self._bins:
+                    index = 0
+                self._sums[index] = self._sum
+                self._counts[index] = self._count
+            self._index = index
+
+        self._sum = (self._sum + torque_raw) & _SUM_MASK
+        self._count = (self._count + 1) & _SUM_MASK
+        self._sums[self._index] = self._sum
+        self._counts[self._index] = self._count
+        self._latest = torque_raw
+
+    def value(self, cadence):
+        """Average torque over the crank revolution fraction
+        :param int cadence: cadence in RPM, with 0 the latest sample is returned
+        return: average torque raw value, or None if there are no samples
+        """
+        if cadence <= 0:
+            return self._latest
+
+        # window in bins, for the time of the revolution fraction
+        window_bins = 60000 // (cadence * self._revolution_fraction * self._bin_ms)
+        if window_bins < 1:
+            window_bins = 1
+        elif window_bins >= self._bins:
+            window_bins = self._bins - 1
+
+        start = self._index - window_bins # index < 0 is from the end of the array
+        count = (self._count - self._counts[start]) & _SUM_MASK
+        if count == 0:
+            return self._latest
+        return ((self._sum - self._sums[start]) & _SUM_MASK) // count
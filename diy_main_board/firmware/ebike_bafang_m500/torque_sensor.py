@@ -1,119 +1,174 @@
 import canio
-import time
-import struct
+import array
+from adafruit_ticks import ticks_ms, ticks_diff
+import torque_calibration
+import torque_filter
+import can_router
+
+# Bafang M500 torque sensor CAN ID
+TORQUE_SENSOR_CAN_ID = 0x1f83100
 
 class TorqueSensor(object):
+    """Bafang M500 torque sensor, on the CAN bus.
+    The messages are received by a CanRouter, that keeps the only listener of the CAN bus and can be shared with other
+    devices like the VESC. receive() should run on its own task, to move the messages from the CAN FIFO to a ring
+    buffer of timestamped samples, so the FIFO does not overflow and the cadence timeout works from the time each
+    message arrived. The readers only look at the ring buffer.
+    The samples received while not pedaling are used to calibrate the torque sensor zero, and value is the torque
+    averaged over a crank revolution fraction, to remove the torque pulses from the pedal position."""
 
-    def __init__(self, can_tx_pin, can_rx_pin, cadence_timeout = 1.0):
+    def __init__(self, can_tx_pin, can_rx_pin, cadence_timeout = 1.0, frame_timeout = 0.25, ring_size = 64, calibration = None, crank_filter = None, can_bus = None):
         """Torque sensor
         :param ~microcontroller.Pin can_tx_pin: the pin to use for the can_tx_pin.
         :param ~microcontroller.Pin can_rx_pin: the pin to use for the can_rx_pin.
         :param float cadence_timeout: timeout in seconds, to reset cadence value if no new value higher than 0 is read
+        :param float frame_timeout: timeout in seconds, the torque value is not valid if no message is received for longer than this
+        :param int ring_size: number of samples kept, the torque sensor sends about 100 messages per second
+        :param ~TorqueCalibration calibration: torque sensor zero calibration. If None, the default zero is used and learned again on each startup
+        :param ~CrankTorqueFilter crank_filter: torque average over a crank revolution fraction. If None, half a revolution is used
+        :param ~canio.CAN can_bus: CAN bus to use, for testing. If None, a new one is created on the pins
         """
 
-        self._can_bus = canio.CAN(can_tx_pin, can_rx_pin, baudrate = 250000)
-        self._cadence_timeout = cadence_timeout
-        self._cadence_previous_time = 0
+        if can_bus is None:
+            can_bus = canio.CAN(can_tx_pin, can_rx_pin, baudrate = 250000)
+        self._can_router = can_router.CanRouter(can_bus)
+        if calibration is None:
+            calibration = torque_calibration.TorqueCalibration()
+        self.calibration = calibration
+        if crank_filter is None:
+            crank_filter = torque_filter.CrankTorqueFilter()
+        self._crank_filter = crank_filter
+        self._cadence_timeout_ms = int(cadence_timeout * 1000)
+        self._frame_timeout_ms = int(frame_timeout * 1000)
+
+        # ring buffer of samples, index self._head is the next to be written
+        self._ring_size = ring_size
+        self._times = array.array('L', [0] * ring_size) # ticks_ms when the message was received
+        self._torques_raw = array.array('H', [0] * ring_size)
+        self._cadences = array.array('B', [0] * ring_size)
+        self._progressive_bytes = array.array('B', [0] * ring_size)
+        self._head = 0
+
         self._cadence_previous = 0
-        self._cadence = 0
-        self._torque_weight = 0
+        self._cadence_previous_time = ticks_ms()
+        self._pedaling = True # the cadence timeout also applies at startup, before the zero is learned
+        self.frames = 0 # frames received
+        self.dropped_frames = 0 # frames lost, from the gaps on the progressive byte
+
+        self._can_router.add_route(TORQUE_SENSOR_CAN_ID, self._process_message)
+
+    @property
+    def can_router(self):
+        """CAN router of the torque sensor bus, to share it with other devices like the VESC"""
+        return self._can_router
+
+    def _process_message(self, message):
+        now = ticks_ms()
+        head = self._head
+        data = message.data
+
+        # the progressive byte increases on each message, a bigger step means messages were lost
+        progressive_byte = data[3]
+        if self.frames > 0:
+            gap = (progressive_byte - self._progressive_bytes[head - 1]) & 0xff # on index 0, head - 1 is the last item of the ring
+            if gap > 1:
+                self.dropped_frames += gap - 1
+
+        torque_raw = (data[1] << 8) | data[0]
+        cadence = data[2]
+        if cadence > 0:
+            # we got a new cadence value
+            self._cadence_previous = cadence
+            self._cadence_previous_time = now
+            self._pedaling = True
+            self.calibration.discard_window()
+        elif self._pedaling:
+            # pedaling stops only after the cadence timeout
+            self._pedaling = ticks_diff(now, self._cadence_previous_time) <= self._cadence_timeout_ms
+        else:
+            # not pedaling, learn the torque sensor zero
+            self.calibration.add_unloaded_sample(torque_raw)
+
+        self._crank_filter.add(now, torque_raw)
+        self._times[head] = now
+        self._torques_raw[head] = torque_raw
+        self._cadences[head] = cadence
+        self._progressive_bytes[head] = progressive_byte
+        head += 1
+        if head == self._ring_size:
+            head = 0
+        self._head = head
+        self.frames += 1
+
+    def receive(self):
+        """Move the waiting messages to the ring buffer, should be called periodically from a task.
+        The messages for other devices on the CAN bus, like the VESC, are routed to them
+        return: number of torque sensor messages received
+        """
+        frames = self.frames
+        self._can_router.receive()
+        return self.frames - frames
+
+    def _latest_is_valid(self, now):
+        return self.frames > 0 and ticks_diff(now, self._times[self._head - 1]) <= self._frame_timeout_ms
+
+    @property
+    def latest(self):
+        """Latest sample
+        return: time in ticks_ms, torque raw, cadence and progressive_byte, or None if there are no samples
+        """
+        if self.frames == 0:
+            return None
+        i = self._head - 1
+        return self._times[i], self._torques_raw[i], self._cadences[i], self._progressive_bytes[i]
+
+    def average(self, window_ms):
+        """Average of the samples received on the last window_ms
+        :param int window_ms: time window in milliseconds, up to the ring_size samples are used
+        return: average torque raw, average cadence and number of samples
+        """
+        now = ticks_ms()
+        count = 0
+        sum_torque_raw = 0
+        sum_cadence = 0
+        i = self._head
+        for _ in range(min(self.frames, self._ring_size)):
+            i -= 1 # goes back from the newest, index -1 is the last item of the ring
+            if ticks_diff(now, self._times[i]) > window_ms:
+                break
+            sum_torque_raw += self._torques_raw[i]
+            sum_cadence += self._cadences[i]
+            count += 1
+
+        if count == 0:
+            return 0, 0, 0
+        return sum_torque_raw // count, sum_cadence // count, count
 
     @property
     def value_raw(self):
-        """Torque sensor raw values
+        """Torque sensor raw values, from the latest sample
         return: torque, cadence and progressive_byte
         """
-        with self._can_bus.listen(timeout=1.0) as listener:
-            if listener.in_waiting():
-                msg = listener.receive()
-
-                # unpack values from the byte array
-                torque = struct.unpack_from('<H', msg.data, 0) # 2 bytes: torque value
-                cadence = struct.unpack_from('<B', msg.data, 2) # 1 byte: cadence value
-                progressive_byte = msg.data[3] # last byte should be a value that increases on each package
-
-                return torque[0], cadence[0], progressive_byte
-            else:
-                return None, None, None
-            
+        if not self._latest_is_valid(ticks_ms()):
+            return None, None, None
+
+        i = self._head - 1
+        return self._torques_raw[i], self._cadences[i], self._progressive_bytes[i]
+
     @property
     def value(self):
-        """Torque sensor weight value and cadence
-        return: torque weight and cadence
+        """Torque sensor weight value, averaged over the crank revolution fraction, and cadence.
+        The sensor sends cadence 0 between pedal position updates, so the previous cadence value is kept up to cadence_timeout.
+        return: torque weight x10 and cadence, or None and cadence if there are no recent messages
         """
-        with self._can_bus.listen(timeout=1.0) as listener:
-            
-            msg = bytearray()
-            cadence = 0
-            torque = None
-            torque_x10 = 0
-            now = time.monotonic()
-            counter = 0
-
-            while True:
-                if listener.in_waiting():
-                    msg = listener.receive()
-                    
-                    cadence = msg.data[2]
-                    if cadence > 0:
-                        # we got a new cadence value
-                        self._cadence_previous_time = now
-                        self._cadence_previous = cadence
-
-                        torque_x10 = (msg.data[1] * 256) + msg.data[0]
-                        torque_x10 = int((torque_x10 - 750) / 6.1) # convert to kgs
-
-                        # ignore previous messages, just clean them
-                        while listener.in_waiting():
-                            listener.receive()
-
-                        return torque_x10, cadence
-                    
-                    else:
-                        # cadence is 0
-                      
-                        counter += 1
-                        # check if previous 5 messages are always 0, if so, stop here
-                        if counter > 5:
-                            # check for cadence timeout
-                            timeout = True if now > (self._cadence_previous_time + self._cadence_timeout) else False
-                            if timeout:
-                                self._cadence_previous = 0
-                                self._cadence_previous_time = now
-                            else:
-                                # keep cadence with previous value
-                                cadence = self._cadence_previous
-
-                            torque_x10 = (msg.data[1] * 256) + msg.data[0]
-                            torque_x10 = int((torque_x10 - 750) / 6.1) # convert to kgs
-                            
-                            # ignore previous messages, just clean them
-                            while listener.in_waiting():
-                                listener.receive()
-
-                            return torque_x10, cadence
-                          
-                else:
-                # check for cadence timeout
-                    timeout = True if now > (self._cadence_previous_time + self._cadence_timeout) else False
-                    if cadence == 0:
-                        # we got cadence = 0
-                        if timeout:
-                            self._cadence_previous = 0
-                            self._cadence_previous_time = now
-                        else:
-                            # keep cadence with previous value
-                            cadence = self._cadence_previous
-
-                        torque_x10 = (msg.data[1] * 256) + msg.data[0]
-                        torque_x10 = int((torque_x10 - 750) / 6.1) # convert to kgs
-
-                    else:
-                        # we got no new values from torque sensor
-                        if timeout:
-                            self._cadence_previous = 0
-                            self._cadence_previous_time = now
-                        else:
-                            cadence = self._cadence_previous
-
-                    return torque_x10, cadence
+        now = ticks_ms()
+
+        # check for cadence timeout, from the time the last cadence value was received
+        if self._cadence_previous > 0 and ticks_diff(now, self._cadence_previous_time) > self._cadence_timeout_ms:
+            self._cadence_previous = 0
+        cadence = self._cadence_previous
+
+        if not self._latest_is_valid(now):
+            return None, cadence
+
+        return self.calibration.torque_x10(self._crank_filter.value(cadence)), cadence
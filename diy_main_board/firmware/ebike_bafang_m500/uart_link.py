@@ -0,0 +1,675 @@
+"""Main board <-> display UART link.
+Package: start bytes 0, 1, 2 + len byte + data bytes + CRC 2 bytes,
+where len byte is the number of bytes before the CRC and the CRC is CRC-16 (MODBUS), little endian.
+The data bytes start with the link version, package type and keyframe sequence bytes, followed by the fields of the package schema."""
+
+import array
+import struct
+import time
+from checksum import crc16_modbus
+
+# increase when the fields of any schema change, so main board and display with different versions ignore each other packages
+LINK_VERSION = 4
+
+# package types
+PACKAGE_KEYFRAME = 0 # all the fields
+PACKAGE_DELTA = 1 # only the fields that changed since the keyframe
+PACKAGE_CAPS = 2 # baud rate negotiation
+_DATA_HEADER_LEN = 3 # version + package type + keyframe sequence
+
+# UART baud rates that can be negotiated, the link always starts at the first one
+LINK_BAUDRATES = (19200, 57600, 115200, 230400, 460800)
+
+_START_BYTES = b'\x00\x01\x02'
+_HEADER_LEN = 4 # start bytes + len byte
+_CRC_LEN = 2
+
+class FrameScanner(object):
+    """Finds the packages on the received bytes.
+    The start bytes are searched with bytes.find() and each package is copied with a single slice,
+    instead of processing byte by byte. Partial packages are kept between calls.
+    The start bytes can also be on the data bytes of a package, so a len byte bigger than the largest package is
+    from false start bytes and the scanner resyncs right away, instead of waiting up to 255 bytes for the CRC.
+    errors counts the times the sync was lost (bytes skipped, bad len or bad CRC after a valid package), so the
+    false start bytes found while resyncing, on noise or on a different baud rate, count as a single error."""
+
+    def __init__(self, max_lenght = None):
+        """Frame scanner
+        :param int max_lenght: max value of the len byte, if None the largest package of the link: MAX_PACKAGE_LENGHT
+        """
+        self._max_lenght = MAX_PACKAGE_LENGHT if max_lenght is None else max_lenght
+        self._data = b'' # received bytes not yet processed
+        self._data_mv = memoryview(self._data)
+        self._position = 0
+        self._synced = False # True after a valid package, until bytes are skipped
+
+        # statistics
+        self.frames = 0
+        self.errors = 0
+
+    def read_from(self, uart):
+        """Read all the bytes available on the UART, without blocking
+        :param ~busio.UART uart: UART to read from
+        """
+        in_waiting = uart.in_waiting
+        if in_waiting:
+            self.feed(uart.read(in_waiting))
+
+    def feed(self, data):
+        """Feed received bytes
+        :param bytes data: received bytes
+        """
+        if not data:
+            return
+
+        if self._position < len(self._data):
+            # there is a partial package, join with the new bytes
+            data = self._data[self._position:] + data
+
+        self._data = data
+        self._data_mv = memoryview(data)
+        self._position = 0
+
+    def _lose_sync(self):
+        if self._synced:
+            self._synced = False
+            self.errors += 1
+
+    def next_frame(self, buffer):
+        """Copy the next complete package, with a valid CRC, to buffer
+        :param bytearray buffer: buffer to copy the package to, without the CRC. Must have at least max_lenght bytes
+        return: package lenght (without CRC), 0 if there is no complete package
+        """
+        data = self._data
+        end = len(data)
+        position = self._position
+        if end - position < _HEADER_LEN + _CRC_LEN:
+            return 0
+
+        while True:
+            index = data.find(_START_BYTES, position)
+            if index < 0:
+                # keep the last bytes, as they may be the begin of the start bytes
+                keep = max(position, end - (len(_START_BYTES) - 1))
+                if keep > position:
+                    self._lose_sync()
+                self._position = keep
+                return 0
+
+            if index > position:
+                # bytes before the start bytes
+                self._lose_sync()
+
+            if index + _HEADER_LEN > end:
+                # wait for the len byte
+                self._position = index
+                return 0
+
+            lenght = data[index + 3]
+            if lenght < _HEADER_LEN or lenght > self._max_lenght:
+                self._lose_sync()
+                position = index + 1
+                continue
+
+            frame_end = index + lenght
+            if frame_end + _CRC_LEN > end:
+                # wait for the rest of the package
+                self._position = index
+                return 0
+
+            frame = self._data_mv[index: frame_end]
+            if (data[frame_end] | (data[frame_end + 1] << 8)) != crc16_modbus(frame):
+                # resync on the next start bytes
+                self._lose_sync()
+                position = index + 1
+                continue
+
+            buffer[0: frame_end - index] = frame
+            self._position = frame_end + _CRC_LEN
+            self._synced = True
+            self.frames += 1
+            return frame_end - index
+
+class PacketQueue(object):
+    """Preallocated ring of received packages.
+    Packages keep being received into free slots while the previous ones wait to be processed.
+    When the queue is full, the oldest package is dropped."""
+
+    def __init__(self, slots = 4, slot_size = 255):
+        """Packages queue
+        :param int slots: max number of packages waiting to be processed
+        :param int slot_size: max package size
+        """
+        # one more slot than the queue size, so there is always a free slot to receive into
+        self._slots = [bytearray(slot_size) for _ in range(slots + 1)]
+        self._lenghts = array.array('B', [0] * (slots + 1))
+        self._size = slots
+        self._head = 0 # slot to receive the next package
+        self._tail = 0 # oldest package
+        self._count = 0
+        self.lenght = 0 # lenght of the last package returned by pop() or newest()
+
+        # statistics
+        self.received = 0
+        self.overruns = 0 # packages dropped because the queue was full
+        self.dropped = 0 # packages skipped by newest()
+
+    @property
+    def pending(self):
+        """Number of packages waiting to be processed"""
+        return self._count
+
+    def receive(self, scanner):
+        """Move all the complete packages found by the scanner to the queue
+        :param ~FrameScanner scanner: frame scanner with the received bytes
+        """
+        slots = len(self._slots)
+        while True:
+            lenght = scanner.next_frame(self._slots[self._head])
+            if lenght == 0:
+                return
+
+            self._lenghts[self._head] = lenght
+            self._head = (self._head + 1) % slots
+            self.received += 1
+
+            if self._count == self._size:
+                # queue full, drop the oldest
+                self._tail = (self._tail + 1) % slots
+                self.overruns += 1
+            else:
+                self._count += 1
+
+    def pop(self):
+        """Get the oldest package
+        return: package buffer, valid until next receive(). None if there are no packages
+        """
+        if self._count == 0:
+            return None
+
+        slot = self._tail
+        self._tail = (self._tail + 1) % len(self._slots)
+        self._count -= 1
+        self.lenght = self._lenghts[slot]
+        return self._slots[slot]
+
+    def newest(self):
+        """Get the newest package and drop all the older ones
+        return: package buffer, valid until next receive(). None if there are no packages
+        """
+        if self._count == 0:
+            return None
+
+        self.dropped += self._count - 1
+        self._count = 0
+        self._tail = self._head
+        slot = (self._head - 1) % len(self._slots)
+        self.lenght = self._lenghts[slot]
+        return self._slots[slot]
+
+def _finish_package(buffer, lenght, package_type, sequence):
+    # start bytes, len byte, data header and CRC
+    buffer[0: _HEADER_LEN - 1] = _START_BYTES
+    buffer[_HEADER_LEN - 1] = lenght
+    buffer[_HEADER_LEN] = LINK_VERSION
+    buffer[_HEADER_LEN + 1] = package_type
+    buffer[_HEADER_LEN + 2] = sequence
+
+    crc = crc16_modbus(memoryview(buffer)[0: lenght])
+    buffer[lenght] = crc & 0xFF
+    buffer[lenght + 1] = crc >> 8
+    return lenght + _CRC_LEN
+
+def package_sequence(buffer):
+    """Sequence byte of a received package: keyframe sequence on telemetry packages, command sequence on command packages"""
+    return buffer[_HEADER_LEN + 2]
+
+class LatencyHistogram(object):
+    """Latency histogram with fixed buckets, without allocating memory when adding values"""
+
+    def __init__(self, bounds_ms = (5, 10, 20, 50, 100, 200, 500)):
+        """Latency histogram
+        :param tuple bounds_ms: upper bound in milliseconds of each bucket, an extra bucket counts the higher latencies
+        """
+        self.bounds_ms = bounds_ms
+        self.counts = array.array('L', [0] * (len(bounds_ms) + 1))
+        self.count = 0
+        self.last_ms = 0
+        self.max_ms = 0
+
+    def add(self, latency_ns):
+        """Add a latency value
+        :param int latency_ns: latency in nanoseconds, as difference of time.monotonic_ns() values
+        """
+        latency_ms = latency_ns // 1000000
+        bucket = 0
+        while bucket < len(self.bounds_ms) and latency_ms > self.bounds_ms[bucket]:
+            bucket += 1
+
+        self.counts[bucket] += 1
+        self.count += 1
+        self.last_ms = latency_ms
+        if latency_ms > self.max_ms:
+            self.max_ms = latency_ms
+
+    def __str__(self):
+        buckets = ['<=' + str(self.bounds_ms[i]) + 'ms: ' + str(self.counts[i]) for i in range(len(self.bounds_ms))]
+        buckets.append('>' + str(self.bounds_ms[-1]) + 'ms: ' + str(self.counts[-1]))
+        return ', '.join(buckets) + ' | max ' + str(self.max_ms) + 'ms'
+
+class LinkSchema(object):
+    """Fixed layout of the package data bytes: version byte + package type byte + keyframe sequence byte + fields, little endian.
+    A keyframe package has all the fields, packed with a single struct.pack_into() and unpacked with a single struct.unpack_from(),
+    so main board and display share the same field list instead of hand written byte offsets.
+    A delta package has only the fields that changed, each one as field index byte + field value."""
+
+    def __init__(self, fields):
+        """Package schema
+        :param tuple fields: (attribute name, struct type, min value, max value) of each field, in package order
+        """
+        self.names = tuple(field[0] for field in fields)
+        self._min = tuple(field[2] for field in fields)
+        self._max = tuple(field[3] for field in fields)
+        self._types = tuple('<' + field[1] for field in fields)
+        self._sizes = tuple(struct.calcsize(field[1]) for field in fields)
+        self._format = '<' + ''.join(field[1] for field in fields)
+        self.values = [0] * len(fields) # field values of the last package packed or unpacked
+
+        self.data_len = _DATA_HEADER_LEN + struct.calcsize(self._format)
+        self.lenght = _HEADER_LEN + self.data_len # value of the len byte of a keyframe package
+
+        # statistics
+        self.version_errors = 0
+
+    def _read_values(self, data):
+        values = self.values
+        for i in range(len(values)):
+            values[i] = int(max(self._min[i], min(self._max[i], getattr(data, self.names[i]))))
+
+    def pack_into(self, buffer, data, sequence = 0):
+        """Build a full keyframe package: start bytes, len byte, version, package type, sequence, all fields and CRC
+        :param bytearray buffer: buffer for the package, with at least lenght + 2 bytes
+        :param object data: object with the schema attributes, values are limited to the field min and max
+        :param int sequence: keyframe sequence, 0 to 255
+        return: package lenght, including the CRC
+        """
+        self._read_values(data)
+        struct.pack_into(self._format, buffer, _HEADER_LEN + _DATA_HEADER_LEN, *self.values)
+        return _finish_package(buffer, self.lenght, PACKAGE_KEYFRAME, sequence)
+
+    def pack_delta_into(self, buffer, data, reference, sequence):
+        """Build a delta package, with only the fields that are different from the reference values
+        :param bytearray buffer: buffer for the package, with at least lenght + number of fields + 2 bytes
+        :param object data: object with the schema attributes, values are limited to the field min and max
+        :param list reference: field values of the keyframe
+        :param int sequence: sequence of the keyframe
+        return: package lenght, including the CRC
+        """
+        self._read_values(data)
+        values = self.values
+        position = _HEADER_LEN + _DATA_HEADER_LEN
+        for i in range(len(values)):
+            if values[i] != reference[i]:
+                buffer[position] = i
+                struct.pack_into(self._types[i], buffer, position + 1, values[i])
+                position += 1 + self._sizes[i]
+
+        return _finish_package(buffer, position, PACKAGE_DELTA, sequence)
+
+    def package_type(self, buffer, lenght):
+        """Check a received package
+        :param bytearray buffer: received package, as returned by FrameScanner or PacketQueue
+        :param int lenght: package lenght, without the CRC
+        return: PACKAGE_KEYFRAME or PACKAGE_DELTA, None if the package has another link version or an invalid lenght
+        """
+        if lenght < _HEADER_LEN + _DATA_HEADER_LEN or buffer[_HEADER_LEN] != LINK_VERSION:
+            self.version_errors += 1
+            return None
+
+        package_type = buffer[_HEADER_LEN + 1]
+        if (package_type == PACKAGE_KEYFRAME and lenght != self.lenght) or package_type > PACKAGE_DELTA:
+            self.version_errors += 1
+            return None
+
+        return package_type
+
+    def unpack_from(self, buffer, lenght, data):
+        """Update data from a received keyframe package
+        :param bytearray buffer: received package, as returned by FrameScanner or PacketQueue
+        :param int lenght: package lenght, without the CRC
+        :param object data: object with the schema attributes to be updated
+        return: True if the package is a keyframe with this schema version and lenght
+        """
+        if self.package_type(buffer, lenght) != PACKAGE_KEYFRAME:
+            return False
+
+        values = struct.unpack_from(self._format, buffer, _HEADER_LEN + _DATA_HEADER_LEN)
+        for i in range(len(self.names)):
+            self.values[i] = values[i]
+            setattr(data, self.names[i], values[i])
+
+        return True
+
+    def unpack_delta_from(self, buffer, lenght, data):
+        """Update data with the fields of a received delta package
+        :param bytearray buffer: received package, as returned by FrameScanner or PacketQueue
+        :param int lenght: package lenght, without the CRC
+        :param object data: object with the schema attributes to be updated
+        return: True if all the fields were valid
+        """
+        position = _HEADER_LEN + _DATA_HEADER_LEN
+        while position < lenght:
+            i = buffer[position]
+            if i >= len(self.names) or position + 1 + self._sizes[i] > lenght:
+                self.version_errors += 1
+                return False
+
+            setattr(data, self.names[i], struct.unpack_from(self._types[i], buffer, position + 1)[0])
+            position += 1 + self._sizes[i]
+
+        return True
+
+class DeltaEncoder(object):
+    """Sends a keyframe with all the fields every keyframe_period packages and in between, delta packages
+    with only the fields that changed since the keyframe. As each delta has all the changes since the keyframe,
+    a lost delta package is recovered by the next one."""
+
+    def __init__(self, schema, keyframe_period = 10):
+        """Delta encoder
+        :param ~LinkSchema schema: package schema
+        :param int keyframe_period: send a keyframe every this number of packages
+        """
+        self._schema = schema
+        self._keyframe_period = keyframe_period
+        self._reference = [0] * len(schema.names) # field values of the last keyframe
+        self._sequence = 0
+        self._deltas_left = 0
+
+        # statistics
+        self.keyframes = 0
+        self.deltas = 0
+
+    def pack_into(self, buffer, data):
+        """Build the next package, keyframe or delta
+        :param bytearray buffer: buffer for the package, with at least schema lenght + number of fields + 2 bytes
+        :param object data: object with the schema attributes
+        return: package lenght, including the CRC
+        """
+        schema = self._schema
+        if self._deltas_left > 0:
+            lenght = schema.pack_delta_into(buffer, data, self._reference, self._sequence)
+            # send a keyframe instead if the delta is not smaller
+            if lenght < schema.lenght + _CRC_LEN:
+                self._deltas_left -= 1
+                self.deltas += 1
+                return lenght
+
+        self._sequence = (self._sequence + 1) & 0xFF
+        lenght = schema.pack_into(buffer, data, self._sequence)
+        reference = self._reference
+        for i in range(len(reference)):
+            reference[i] = schema.values[i]
+
+        self._deltas_left = self._keyframe_period - 1
+        self.keyframes += 1
+        return lenght
+
+class DeltaDecoder(object):
+    """Rebuilds the full data from keyframe and delta packages.
+    Delta packages are ignored until the keyframe they refer to is received."""
+
+    def __init__(self, schema):
+        """Delta decoder
+        :param ~LinkSchema schema: package schema
+        """
+        self._schema = schema
+        self._reference = [0] * len(schema.names) # field values of the last keyframe
+        self._sequence = -1 # no keyframe received yet
+
+        # statistics
+        self.keyframes = 0
+        self.deltas = 0
+        self.missed = 0 # delta packages without their keyframe
+
+    def reset(self):
+        """Ignore the delta packages until the next keyframe, like when the other end rebooted and its keyframe sequence started again"""
+        self._sequence = -1
+
+    def unpack_from(self, buffer, lenght, data):
+        """Update data from a received package, keyframe or delta
+        :param bytearray buffer: received package, as returned by FrameScanner or PacketQueue
+        :param int lenght: package lenght, without the CRC
+        :param object data: object with the schema attributes to be updated
+        return: True if data was updated
+        """
+        schema = self._schema
+        package_type = schema.package_type(buffer, lenght)
+
+        if package_type == PACKAGE_KEYFRAME:
+            schema.unpack_from(buffer, lenght, data)
+            reference = self._reference
+            for i in range(len(reference)):
+                reference[i] = schema.values[i]
+
+            self._sequence = buffer[_HEADER_LEN + 2]
+            self.keyframes += 1
+            return True
+
+        elif package_type == PACKAGE_DELTA:
+            if buffer[_HEADER_LEN + 2] != self._sequence:
+                self.missed += 1
+                return False
+
+            # start from the keyframe values, as fields that went back to the keyframe value are not on the delta
+            reference = self._reference
+            for i in range(len(reference)):
+                setattr(data, schema.names[i], reference[i])
+
+            if schema.unpack_delta_from(buffer, lenght, data):
+                self.deltas += 1
+                return True
+
+        return False
+
+_CAPS_LEN = _HEADER_LEN + _DATA_HEADER_LEN + 2 # + supported baud rates mask + selected baud rate
+_NO_BAUDRATE = 0xFF
+_SWITCH_DELAY_NS = 50000000 # wait for the answer to be sent, before switching the baud rate
+_QUALITY_WINDOW = 50 # received packages and errors, to calculate the error rate
+
+class LinkNegotiator(object):
+    """Negotiates a higher UART baud rate for the link.
+    Both ends start at LINK_BAUDRATES[0]. The initiator sends capabilities packages with the baud rates it supports,
+    the other end answers with the highest common baud rate and both switch to it.
+    If no valid package is received for link_timeout, or the error rate gets higher than max_error_rate, each end
+    goes back to LINK_BAUDRATES[0] (the other end will stop receiving and do the same) and that baud rate is put on hold.
+    A timeout can be only a reboot of the other end or a lost answer, so the baud rate is tried again after retry_period,
+    doubled on each new timeout up to max_retry_period, and back to retry_period after being stable for stable_period.
+    A too high error rate means the baud rate does not work on this wiring, so it is only tried again after max_retry_period.
+    When a baud rate on hold can be tried again, the initiator sends offers on the current baud rate, to go up to it."""
+
+    def __init__(self, uart, scanner, initiator, max_baudrate = 460800, link_timeout = 1.0, max_error_rate = 0.2, offer_period = 1.0,
+            retry_period = 5.0, max_retry_period = 300.0, stable_period = 30.0):
+        """Link negotiator
+        :param ~busio.UART uart: link UART, must start at LINK_BAUDRATES[0]
+        :param ~FrameScanner scanner: frame scanner of the link, used for the link quality
+        :param bool initiator: True on one end only, the one that sends the capabilities offers
+        :param int max_baudrate: max baud rate supported
+        :param float link_timeout: time in seconds without valid packages, to fall back to LINK_BAUDRATES[0]
+        :param float max_error_rate: max ratio of errors / (packages + errors), to fall back to LINK_BAUDRATES[0]
+        :param float offer_period: time in seconds between capabilities offers
+        :param float retry_period: time in seconds before trying again a baud rate that timed out
+        :param float max_retry_period: max time in seconds before trying again a baud rate, also used after a too high error rate
+        :param float stable_period: time in seconds on a baud rate without fall back, to reset its retry period
+        """
+        self._uart = uart
+        self._scanner = scanner
+        self._initiator = initiator
+        self._link_timeout_ns = int(link_timeout * 1000000000)
+        self._max_error_rate = max_error_rate
+        self._offer_period_ns = int(offer_period * 1000000000)
+        self._retry_period_ns = int(retry_period * 1000000000)
+        self._max_retry_period_ns = int(max_retry_period * 1000000000)
+        self._stable_period_ns = int(stable_period * 1000000000)
+
+        self._supported = 0 # bit mask of LINK_BAUDRATES indexes
+        for i in range(len(LINK_BAUDRATES)):
+            if LINK_BAUDRATES[i] <= max_baudrate:
+                self._supported |= 1 << i
+        self._hold = 0 # bit mask of the baud rates that did fall back, not used until their retry time
+        self._retry_time = [0] * len(LINK_BAUDRATES)
+        self._retry_periods_ns = [self._retry_period_ns] * len(LINK_BAUDRATES) # next retry period of each baud rate
+
+        self._index = 0
+        self._switch_index = None
+        self._switch_time = 0
+        self._baudrate_time = 0 # time the current baud rate was set
+        self._offer_time = 0
+        self._rx_time = time.monotonic_ns()
+        self._rx_frames = scanner.frames
+        self._window_frames = scanner.frames
+        self._window_errors = scanner.errors
+        self._tx_array = bytearray(_CAPS_LEN + _CRC_LEN)
+
+        # statistics
+        self.baudrate = LINK_BAUDRATES[0]
+        self.error_rate = 0.0 # on the last quality window
+        self.switches = 0
+        self.fallbacks = 0
+
+    def _usable(self):
+        return self._supported & ~self._hold
+
+    def _send_caps(self, selected):
+        self._tx_array[_HEADER_LEN + _DATA_HEADER_LEN] = self._usable()
+        self._tx_array[_HEADER_LEN + _DATA_HEADER_LEN + 1] = selected
+        _finish_package(self._tx_array, _CAPS_LEN, PACKAGE_CAPS, 0)
+        self._uart.write(self._tx_array)
+
+    def _set_baudrate(self, index, now):
+        self._uart.baudrate = LINK_BAUDRATES[index]
+        self._index = index
+        self.baudrate = LINK_BAUDRATES[index]
+        self._rx_time = now
+        self._baudrate_time = now
+        self._window_frames = self._scanner.frames
+        self._window_errors = self._scanner.errors
+
+    def _fall_back(self, now, errors = False):
+        index = self._index
+        self._hold |= 1 << index
+        if errors:
+            self._retry_time[index] = now + self._max_retry_period_ns
+        else:
+            # wait longer on each new timeout
+            self._retry_time[index] = now + self._retry_periods_ns[index]
+            self._retry_periods_ns[index] = min(self._retry_periods_ns[index] * 2, self._max_retry_period_ns)
+
+        self._switch_index = None
+        self._set_baudrate(0, now)
+        self._offer_time = now
+        self.fallbacks += 1
+
+    def process_package(self, buffer, lenght):
+        """Process a received capabilities package
+        :param bytearray buffer: received package, as returned by FrameScanner or PacketQueue
+        :param int lenght: package lenght, without the CRC
+        return: True if it was a capabilities package, False if it is a package for the schemas
+        """
+        if lenght != _CAPS_LEN or buffer[_HEADER_LEN] != LINK_VERSION or buffer[_HEADER_LEN + 1] != PACKAGE_CAPS:
+            return False
+
+        if self._switch_index is not None:
+            return True
+
+        common = buffer[_HEADER_LEN + _DATA_HEADER_LEN] & self._usable()
+        if self._initiator:
+            # answer to our offer: switch right away
+            selected = buffer[_HEADER_LEN + _DATA_HEADER_LEN + 1]
+            if selected != _NO_BAUDRATE and selected != self._index and (common >> selected) & 1:
+                self._switch_index = selected
+                self._switch_time = time.monotonic_ns()
+
+        else:
+            # offer: answer with the highest common baud rate and switch after the answer is sent
+            selected = _NO_BAUDRATE
+            for i in range(len(LINK_BAUDRATES) - 1, 0, -1):
+                if (common >> i) & 1:
+                    selected = i
+                    break
+
+            self._send_caps(selected)
+            if selected != _NO_BAUDRATE and selected != self._index:
+                self._switch_index = selected
+                self._switch_time = time.monotonic_ns() + _SWITCH_DELAY_NS
+
+        return True
+
+    def update(self):
+        """Switch the baud rate, check the link quality and send the offers.
+        Should be called periodically, after receiving, like every 10ms"""
+        now = time.monotonic_ns()
+
+        if self._switch_index is not None:
+            if now >= self._switch_time:
+                self._set_baudrate(self._switch_index, now)
+                self._switch_index = None
+                self.switches += 1
+            return
+
+        scanner = self._scanner
+        if scanner.frames != self._rx_frames:
+            self._rx_frames = scanner.frames
+            self._rx_time = now
+
+        # link quality
+        frames = scanner.frames - self._window_frames
+        errors = scanner.errors - self._window_errors
+        if frames + errors >= _QUALITY_WINDOW:
+            self.error_rate = errors / (frames + errors)
+            self._window_frames = scanner.frames
+            self._window_errors = scanner.errors
+            if self._index != 0 and self.error_rate > self._max_error_rate:
+                self._fall_back(now, errors = True)
+                return
+
+        if self._index != 0:
+            if (now - self._rx_time) > self._link_timeout_ns:
+                self._fall_back(now)
+                return
+
+            # stable on this baud rate, next timeout is tried again soon
+            if (now - self._baudrate_time) >= self._stable_period_ns:
+                self._retry_periods_ns[self._index] = self._retry_period_ns
+
+        # baud rates that can be tried again
+        if self._hold:
+            for i in range(1, len(LINK_BAUDRATES)):
+                if (self._hold >> i) & 1 and now >= self._retry_time[i]:
+                    self._hold &= ~(1 << i)
+
+        # offer while there is a usable baud rate higher than the current one
+        if self._initiator and (self._usable() >> (self._index + 1)) and (now - self._offer_time) >= self._offer_period_ns:
+            self._send_caps(_NO_BAUDRATE)
+            self._offer_time = now
+
+# main board -> display: motor and sensors data
+TELEMETRY_SCHEMA = LinkSchema((
+    ('battery_voltage', 'H', 0, 127),
+    ('motor_current', 'B', 0, 127),
+    ('motor_power', 'H', 0, 5000),
+    ('human_pedal_power', 'H', 0, 2000),
+    ('vesc_temperature_x10', 'H', 0, 254),
+    ('motor_temperature_sensor_x10', 'H', 0, 254),
+    ('vesc_fault_code', 'B', 0, 255),
+    ('cadence', 'B', 0, 99),
+    ('speed', 'B', 0, 99),
+    ('command_ack', 'B', 0, 255), # sequence of the last command received from the display
+))
+
+# display -> main board: user inputs, the package sequence byte is the command sequence
+COMMAND_SCHEMA = LinkSchema((
+    ('assist_level', 'B', 0, 255),
+))
+
+# largest len byte of the link packages, delta packages are only sent when smaller than the keyframe
+MAX_PACKAGE_LENGHT = max(TELEMETRY_SCHEMA.lenght, COMMAND_SCHEMA.lenght, _CAPS_LEN)
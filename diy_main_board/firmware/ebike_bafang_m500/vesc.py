@@ -1,14 +1,205 @@
 import busio
 import struct
+from checksum import crc16_ccitt, crc16_ccitt_into
+
+# VESC communication commands
+COMM_GET_VALUES = 4
+COMM_SET_CURRENT = 6
+COMM_SET_CURRENT_BRAKE = 7
+COMM_SET_RPM = 8
+COMM_ALIVE = 30
+COMM_GET_VALUES_SELECTIVE = 50
+
+# COMM_GET_VALUES fields, the value is the bit position on the COMM_GET_VALUES_SELECTIVE mask
+VALUE_TEMPERATURE_MOSFET = 0
+VALUE_TEMPERATURE_MOTOR = 1
+VALUE_MOTOR_CURRENT = 2
+VALUE_BATTERY_CURRENT = 3
+VALUE_ID_CURRENT = 4
+VALUE_IQ_CURRENT = 5
+VALUE_DUTY_CYCLE = 6
+VALUE_ERPM = 7
+VALUE_BATTERY_VOLTAGE = 8
+VALUE_AMP_HOURS = 9
+VALUE_AMP_HOURS_CHARGED = 10
+VALUE_WATT_HOURS = 11
+VALUE_WATT_HOURS_CHARGED = 12
+VALUE_TACHOMETER = 13
+VALUE_TACHOMETER_ABS = 14
+VALUE_FAULT_CODE = 15
+
+# struct format of each COMM_GET_VALUES field, by field order
+_VALUES_FORMAT = 'hhllllhlhllllllB'
+
+# how each field is stored on the app data: field: (app data attribute, divider, offset)
+_VALUES_APP_DATA = {
+    VALUE_TEMPERATURE_MOSFET: ('vesc_temperature_x10', 1, -110), # found experimentaly that this value has a positive offset of 11 degrees - 2023.01.27
+    VALUE_MOTOR_CURRENT: ('motor_current', 100.0, 0),
+    VALUE_BATTERY_CURRENT: ('battery_current', 100.0, 0),
+    VALUE_ERPM: ('motor_speed_erpm', 1, 0),
+    VALUE_BATTERY_VOLTAGE: ('battery_voltage', 10.0, 0),
+    VALUE_FAULT_CODE: ('vesc_fault_code', 1, 0),
+}
+
+class VescCommandFrame(object):
+    """Preallocated frame for one VESC command.
+    The command data, CRC and end byte are written in place, so sending the command does not allocate memory."""
+
+    def __init__(self, command, data_len):
+        """VESC command frame
+        :param int command: VESC COMM_ command
+        :param int data_len: number of data bytes after the command byte
+        """
+        # start byte + len + command + data + CRC 16 bits + end byte
+        self.frame = bytearray(1 + 1 + 1 + data_len + 2 + 1)
+        self.frame[0] = 2 # start byte
+        self.frame[1] = 1 + data_len # payload lenght
+        self.frame[2] = command
+        self.frame[-1] = 3 # end byte
+
+        # keep a memoryview of the payload, to calculate the CRC without copying
+        self._payload = memoryview(self.frame)[2: 3 + data_len]
+        self.update_crc()
+
+    def update_crc(self):
+        """Calculate the payload CRC and write it just before the end byte"""
+        crc16_ccitt_into(self._payload, self.frame, len(self.frame) - 3)
+
+    def set_value(self, value):
+        """Write a 32 bits signed value as the command data and update the CRC
+        :param int value: command value
+        """
+        struct.pack_into('>l', self.frame, 3, value)
+        self.update_crc()
+
+class VescPacketParser(object):
+    """Incremental VESC packet parser.
+    Bytes can be feed in any chunk size, as they arrive. Complete packets, with valid CRC and end byte,
+    are returned by packet(). On a bad packet, only the start byte is dropped so the parser resyncs
+    on the next start byte that may be already inside the buffer.
+    The end byte 3 of a bad packet is also a long packet start byte, so a len bigger than max_payload_len is taken as
+    a false start byte, instead of waiting for hundreds of bytes that would drop the next good packets."""
+
+    def __init__(self, buffer_size = 1024, max_payload_len = None):
+        """VESC packet parser
+        :param int buffer_size: size of the receive buffer, must fit at least one full packet
+        :param int max_payload_len: max payload lenght of the packets to receive. If None, the packets that fit on the buffer
+        """
+        if max_payload_len is None:
+            max_payload_len = buffer_size
+        self._max_payload_len = max_payload_len
+        self._buffer = bytearray(buffer_size)
+        self._buffer_mv = memoryview(self._buffer)
+        self._start = 0 # first not yet processed byte
+        self._end = 0 # last received byte + 1
+        self.packets = 0
+        self.errors = 0
+
+    def _compact(self):
+        # move the not yet processed bytes to the begin of the buffer, to make space for new ones
+        if self._start > 0:
+            lenght = self._end - self._start
+            if lenght > 0:
+                self._buffer[0: lenght] = self._buffer_mv[self._start: self._end]
+            self._start = 0
+            self._end = lenght
+
+    def read_from(self, uart):
+        """Read all the bytes waiting on the UART, without blocking
+        :param ~busio.UART uart: UART to read from
+        """
+        in_waiting = uart.in_waiting
+        if in_waiting:
+            if self._end + in_waiting > len(self._buffer):
+                self._compact()
+
+            space = len(self._buffer) - self._end
+            if space == 0:
+                # buffer full of garbage, drop it
+                self.errors += 1
+                self._start = 0
+                self._end = 0
+                space = len(self._buffer)
+
+            lenght = uart.readinto(self._buffer_mv[self._end: self._end + min(in_waiting, space)])
+            if lenght:
+                self._end += lenght
+
+    def feed(self, data):
+        """Feed received bytes
+        :param bytes data: received bytes
+        """
+        lenght = len(data)
+        if self._end + lenght > len(self._buffer):
+            self._compact()
+            if self._end + lenght > len(self._buffer):
+                # buffer full of garbage, drop it
+                self.errors += 1
+                self._start = 0
+                self._end = 0
+                data = data[-len(self._buffer):]
+                lenght = len(data)
+
+        self._buffer[self._end: self._end + lenght] = data
+        self._end += lenght
+
+    def packet(self):
+        """Get the payload of the next complete packet
+        return: memoryview of the payload, valid only until next call to any parser method. None if no complete packet
+        """
+        while True:
+            # find the start byte: 2 for short packets and 3 for long packets
+            while self._start < self._end and self._buffer[self._start] != 2 and self._buffer[self._start] != 3:
+                self._start += 1
+
+            available = self._end - self._start
+            if available < 2:
+                return None
+
+            if self._buffer[self._start] == 2:
+                header_len = 2
+                payload_len = self._buffer[self._start + 1]
+            else:
+                if available < 3:
+                    return None
+                header_len = 3
+                payload_len = (self._buffer[self._start + 1] << 8) | self._buffer[self._start + 2]
+
+            # start byte + len + payload + CRC 16 bits + end byte
+            package_len = header_len + payload_len + 3
+            if payload_len == 0 or payload_len > self._max_payload_len or package_len > len(self._buffer):
+                # not a valid start byte, try the next one
+                self.errors += 1
+                self._start += 1
+                continue
+
+            if available < package_len:
+                # wait for the rest of the package
+                return None
+
+            payload_start = self._start + header_len
+            payload_end = payload_start + payload_len
+            crc = (self._buffer[payload_end] << 8) | self._buffer[payload_end + 1]
+            if self._buffer[payload_end + 2] != 3 or crc != crc16_ccitt(self._buffer_mv[payload_start: payload_end]):
+                # bad package, resync on next start byte
+                self.errors += 1
+                self._start += 1
+                continue
+
+            self._start += package_len
+            self.packets += 1
+            return self._buffer_mv[payload_start: payload_end]
 
 class Vesc(object):
     """VESC"""
 
-    def __init__(self, uart_tx_pin, uart_rx_pin, ebike_app_data):
+    def __init__(self, uart_tx_pin, uart_rx_pin, ebike_app_data, telemetry_fields = None):
         """VESC
         :param ~microcontroller.Pin uart_tx_pin: UART TX pin that connects to VESC
         :param ~microcontroller.Pin uart_tx_pin: UART RX pin that connects to VESC
         :param ~EBikeAppData ebike_app_data: Ebike app data object
+        :param tuple telemetry_fields: VALUE_ fields the firmware uses. VESC will be asked only for these fields
+        with COMM_GET_VALUES_SELECTIVE, making the response much smaller. If None, all the fields are asked with COMM_GET_VALUES
         """
         self._ebike_app_data = ebike_app_data
 
@@ -21,166 +212,118 @@ class Vesc(object):
             # NOTE: on CircuitPyhton 8.1.0-beta.2, a value of 512 will make the board to reboot if wifi wireless workflow is not connected
             receiver_buffer_size = 1024) # VESC PACKET_MAX_PL_LEN = 512
 
-    # code taken from:
-    # https://gist.github.com/oysstu/68072c44c02879a2abf94ef350d1c7c6
-    def _crc16(self, data):
-        '''
-        CRC-16 (CCITT) implemented with a precomputed lookup table
-        '''
-        table = [ 
-            0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50A5, 0x60C6, 0x70E7, 0x8108, 0x9129, 0xA14A, 0xB16B, 0xC18C, 0xD1AD, 0xE1CE, 0xF1EF,
-            0x1231, 0x0210, 0x3273, 0x2252, 0x52B5, 0x4294, 0x72F7, 0x62D6, 0x9339, 0x8318, 0xB37B, 0xA35A, 0xD3BD, 0xC39C, 0xF3FF, 0xE3DE,
-            0x2462, 0x3443, 0x0420, 0x1401, 0x64E6, 0x74C7, 0x44A4, 0x5485, 0xA56A, 0xB54B, 0x8528, 0x9509, 0xE5EE, 0xF5CF, 0xC5AC, 0xD58D,
-            0x3653, 0x2672, 0x1611, 0x0630, 0x76D7, 0x66F6, 0x5695, 0x46B4, 0xB75B, 0xA77A, 0x9719, 0x8738, 0xF7DF, 0xE7FE, 0xD79D, 0xC7BC,
-            0x48C4, 0x58E5, 0x6886, 0x78A7, 0x0840, 0x1861, 0x2802, 0x3823, 0xC9CC, 0xD9ED, 0xE98E, 0xF9AF, 0x8948, 0x9969, 0xA90A, 0xB92B,
-            0x5AF5, 0x4AD4, 0x7AB7, 0x6A96, 0x1A71, 0x0A50, 0x3A33, 0x2A12, 0xDBFD, 0xCBDC, 0xFBBF, 0xEB9E, 0x9B79, 0x8B58, 0xBB3B, 0xAB1A,
-            0x6CA6, 0x7C87, 0x4CE4, 0x5CC5, 0x2C22, 0x3C03, 0x0C60, 0x1C41, 0xEDAE, 0xFD8F, 0xCDEC, 0xDDCD, 0xAD2A, 0xBD0B, 0x8D68, 0x9D49,
-            0x7E97, 0x6EB6, 0x5ED5, 0x4EF4, 0x3E13, 0x2E32, 0x1E51, 0x0E70, 0xFF9F, 0xEFBE, 0xDFDD, 0xCFFC, 0xBF1B, 0xAF3A, 0x9F59, 0x8F78,
-            0x9188, 0x81A9, 0xB1CA, 0xA1EB, 0xD10C, 0xC12D, 0xF14E, 0xE16F, 0x1080, 0x00A1, 0x30C2, 0x20E3, 0x5004, 0x4025, 0x7046, 0x6067,
-            0x83B9, 0x9398, 0xA3FB, 0xB3DA, 0xC33D, 0xD31C, 0xE37F, 0xF35E, 0x02B1, 0x1290, 0x22F3, 0x32D2, 0x4235, 0x5214, 0x6277, 0x7256,
-            0xB5EA, 0xA5CB, 0x95A8, 0x8589, 0xF56E, 0xE54F, 0xD52C, 0xC50D, 0x34E2, 0x24C3, 0x14A0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405,
-            0xA7DB, 0xB7FA, 0x8799, 0x97B8, 0xE75F, 0xF77E, 0xC71D, 0xD73C, 0x26D3, 0x36F2, 0x0691, 0x16B0, 0x6657, 0x7676, 0x4615, 0x5634,
-            0xD94C, 0xC96D, 0xF90E, 0xE92F, 0x99C8, 0x89E9, 0xB98A, 0xA9AB, 0x5844, 0x4865, 0x7806, 0x6827, 0x18C0, 0x08E1, 0x3882, 0x28A3,
-            0xCB7D, 0xDB5C, 0xEB3F, 0xFB1E, 0x8BF9, 0x9BD8, 0xABBB, 0xBB9A, 0x4A75, 0x5A54, 0x6A37, 0x7A16, 0x0AF1, 0x1AD0, 0x2AB3, 0x3A92,
-            0xFD2E, 0xED0F, 0xDD6C, 0xCD4D, 0xBDAA, 0xAD8B, 0x9DE8, 0x8DC9, 0x7C26, 0x6C07, 0x5C64, 0x4C45, 0x3CA2, 0x2C83, 0x1CE0, 0x0CC1,
-            0xEF1F, 0xFF3E, 0xCF5D, 0xDF7C, 0xAF9B, 0xBFBA, 0x8FD9, 0x9FF8, 0x6E17, 0x7E36, 0x4E55, 0x5E74, 0x2E93, 0x3EB2, 0x0ED1, 0x1EF0
-        ]
-        
-        crc = 0
-        for byte in data:
-            crc = (crc << 8) ^ table[(crc >> 8) ^ byte]
-            crc &= 0xFFFF                                   # important, crc must stay 16bits all the way through
-
-        return crc
-    
-    def _uart_maybe_reset_input_buffer(self):
-        if self._uart.in_waiting:
-            self._uart.reset_input_buffer()
-
-    def _pack_and_send(self, buf, response_len):
-
-        #start byte + len + data + CRC 16 bits + end byte
-        lenght = len(buf)
-        package_len = 1 + 1 + lenght + 2 + 1
-        crc = self._crc16(buf)
-
-        data_array = bytearray(package_len)
-        data_array[0] = 2 # start byte
-        data_array[1] = lenght
-        data_array[2: 2 + lenght] = buf # copy data
-        data_array[package_len - 3] = (crc & 0xff00) >> 8
-        data_array[package_len - 2] = crc & 0x00ff
-        data_array[package_len - 1] = 3
-        
-        # send packet to UART
-        self._uart.write(data_array)
-
-        # try to read response only if we expect it
-        if response_len > 0:
-            data = self._uart.read(response_len)  # read up to response_len bytes
-
-            if (data is None):
-                self._uart_maybe_reset_input_buffer()
-                return 
-            
-            # the data must have the lenght we are expecting, otherwise discard
-            if (len(data) != response_len):
-                print("VESC: response length is not the expected, recieved length: " + str(len(data)) + " expected: " + str(response_len))
-                self._uart_maybe_reset_input_buffer()
-                return None
+        # preallocated frames for each command, so sending a command does not allocate memory
+        self._frame_get_values = VescCommandFrame(COMM_GET_VALUES, 0)
+        self._frame_alive = VescCommandFrame(COMM_ALIVE, 0)
+        self._frame_set_current = VescCommandFrame(COMM_SET_CURRENT, 4)
+        self._frame_set_current_brake = VescCommandFrame(COMM_SET_CURRENT_BRAKE, 4)
+        self._frame_set_rpm = VescCommandFrame(COMM_SET_RPM, 4)
+        self._frame_brake = VescCommandFrame(COMM_SET_CURRENT_BRAKE, 4) # value 0, constant
 
-            # check for expected packet lenght ID = 2
-            if data[0] != 2:
-                print("VESC: response packet 0 is not the expected, received: " + str(data[0]) + " expected: 2")
-                self._uart_maybe_reset_input_buffer()
-                return None
-            
-            # check for expected packet lenght = 73
-            if data[1] != 73:
-                print("VESC: response packet lenght is not the expected, received: " + str(data[1]) + " expected: 73")
-                self._uart_maybe_reset_input_buffer()
-                return None
-            
-            # check for expected COMM_GET_VALUES = 4
-            if data[2] != 4:
-                print("VESC: response packet COMM_GET_VALUES is not the expected, received: " + str(data[2]) + " expected: 4")
-                self._uart_maybe_reset_input_buffer()
-                return None
-            
-            # check for CRC
-            crc_calculated = self._crc16(data[2:-3])
-            crc = (data[-3] * 256) + data[-2]
-            if crc != crc_calculated:
-                self._uart_maybe_reset_input_buffer()
-                return None
-            
-            self._uart_maybe_reset_input_buffer()
-            return data
+        # prepare the telemetry request and the struct format to decode the response
+        if telemetry_fields is None:
+            telemetry_fields = range(len(_VALUES_FORMAT))
+            self._frame_telemetry = self._frame_get_values
+            self._telemetry_mask = None
         else:
-            return None
-            
+            mask = 0
+            for field in telemetry_fields:
+                if field not in _VALUES_APP_DATA:
+                    raise ValueError("VESC telemetry field not supported: " + str(field))
+                mask |= 1 << field
+
+            self._frame_telemetry = VescCommandFrame(COMM_GET_VALUES_SELECTIVE, 4)
+            self._frame_telemetry.set_value(mask)
+            self._telemetry_mask = mask
+
+        # the response has the fields by the order of the bit position
+        self._telemetry_fields = tuple(sorted(telemetry_fields))
+        self._telemetry_format = '>' + ''.join([_VALUES_FORMAT[field] for field in self._telemetry_fields])
+        self._telemetry_len = struct.calcsize(self._telemetry_format)
+
+        # the telemetry responses are less than 256 bytes, sent as short packets, so no long packet is expected
+        self._parser = VescPacketParser(max_payload_len = 255)
+
+    def _process_values(self, payload, offset):
+        if len(payload) < offset + self._telemetry_len:
+            return False
+
+        # store the motor controller data
+        values = struct.unpack_from(self._telemetry_format, payload, offset)
+        for index, field in enumerate(self._telemetry_fields):
+            ebike_app_data = _VALUES_APP_DATA.get(field)
+            if ebike_app_data is not None:
+                attribute, divider, value_offset = ebike_app_data
+                value = values[index]
+                if divider != 1:
+                    value = value / divider
+                setattr(self._ebike_app_data, attribute, value + value_offset)
+
+        return True
+
+    def process_data(self):
+        """Read and process the VESC responses, without blocking.
+        Should be called periodically, like every 10ms
+        return: True if new motor data was received
+        """
+        self._parser.read_from(self._uart)
+
+        new_data = False
+        while True:
+            payload = self._parser.packet()
+            if payload is None:
+                break
+
+            command = payload[0]
+            if command == COMM_GET_VALUES and self._frame_telemetry is self._frame_get_values:
+                new_data = self._process_values(payload, 1) or new_data
+
+            elif command == COMM_GET_VALUES_SELECTIVE and self._frame_telemetry is not self._frame_get_values:
+                # the response starts with the 32 bits mask of the fields it has
+                if len(payload) >= 5 and struct.unpack_from('>L', payload, 1)[0] == self._telemetry_mask:
+                    new_data = self._process_values(payload, 5) or new_data
+
+        return new_data
+
     def refresh_data(self):
-        """Read VESC motor data and update vesc_motor_data"""
+        """Ask VESC for motor data. Returns right away, the response is processed later by process_data()"""
         # COMM_GET_VALUES = 4; 79 bytes response
-        command = bytearray([4])
-        response = self._pack_and_send(command, 78)
-        #print(response)
-
-        if response is not None:
-            # print(",".join(["{}".format(i) for i in response]))
-            # for index, data in enumerate(response):
-            #     print(str(index) + ": " + str(data))
-
-            # store the motor controller data
-            self._ebike_app_data.vesc_temperature_x10 = struct.unpack_from('>h', response, 3)[0] - 110 # # found experimentaly that this value has a positive offset of 11 degrees - 2023.01.27
-            self._ebike_app_data.motor_current = struct.unpack_from('>l', response, 7)[0] / 100.0
-            self._ebike_app_data.battery_current = struct.unpack_from('>l', response, 11)[0] / 100.0
-            self._ebike_app_data.motor_speed_erpm = struct.unpack_from('>l', response, 25)[0]
-            self._ebike_app_data.battery_voltage = struct.unpack_from('>h', response, 29)[0] / 10.0
-            self._ebike_app_data.vesc_fault_code = response[55]
+        # COMM_GET_VALUES_SELECTIVE = 50; 10 bytes response + the fields
+        self._uart.write(self._frame_telemetry.frame)
 
     def send_heart_beat(self):
         """Send the heart beat / alive command to VESC, must be sent at least every 0.9s or VESC will stop the motor"""
         # COMM_ALIVE = 30; no response
-        command = bytearray([30])
-        self._pack_and_send(command, 0)
+        self._uart.write(self._frame_alive.frame)
 
     def set_motor_current_amps(self, value):
         """Set battery Amps"""
-        value = value * 1000 # current in mA
-
         # COMM_SET_CURRENT = 6; no response
-        command = bytearray(5)
-        command[0] = 6
-        struct.pack_into('>l', command, 1, int(value))
-        self._pack_and_send(command, 0)
+        self._frame_set_current.set_value(int(value * 1000)) # current in mA
+        self._uart.write(self._frame_set_current.frame)
     
+    def set_motor_current_milliamps(self, value):
+        """Set battery mA, as integer, without float math"""
+        # COMM_SET_CURRENT = 6; no response
+        self._frame_set_current.set_value(value)
+        self._uart.write(self._frame_set_current.frame)
+
     def set_motor_current_brake_amps(self, value):
         """Set battery brake / regen Amps"""
-        value = value * 1000 # current in mA
-
         # COMM_SET_CURRENT_BRAKE = 7; no response
-        command = bytearray(5)
-        command[0] = 7
-        struct.pack_into('>l', command, 1, int(value))
-        self._pack_and_send(command, 0)
+        self._frame_set_current_brake.set_value(int(value * 1000)) # current in mA
+        self._uart.write(self._frame_set_current_brake.frame)
 
     def set_motor_speed_erpm(self, value):
         """Set motor speed in ERPM"""
         # COMM_SET_RPM = 8; no response
-        command = bytearray(5)
-        command[0] = 8
-        struct.pack_into('>l', command, 1, int(value))
-        self._pack_and_send(command, 0)
+        self._frame_set_rpm.set_value(int(value))
+        self._uart.write(self._frame_set_rpm.frame)
 
     def brake(self):
         """ Brake: will set the motor current to 0 amps, efectivly coasting"""
         # COMM_SET_CURRENT_BRAKE = 7; no response
-        command = bytearray(5)
-        command[0] = 7
-        struct.pack_into('>l', command, 1, 0)
-
         # send 3x to avoid possibility of VESC missing receiving this command
-        self._pack_and_send(command, 0)
-        self._pack_and_send(command, 0)
-        self._pack_and_send(command, 0)
+        self._uart.write(self._frame_brake.frame)
+        self._uart.write(self._frame_brake.frame)
+        self._uart.write(self._frame_brake.frame)
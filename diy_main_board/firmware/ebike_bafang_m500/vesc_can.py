@@ -0,0 +1,123 @@
+import canio
+import struct
+
+# VESC CAN packet ids
+CAN_PACKET_SET_CURRENT = 1
+CAN_PACKET_SET_CURRENT_BRAKE = 2
+CAN_PACKET_SET_RPM = 3
+CAN_PACKET_STATUS = 9 # ERPM, motor current, duty cycle
+CAN_PACKET_STATUS_2 = 14 # amp hours, amp hours charged
+CAN_PACKET_STATUS_3 = 15 # watt hours, watt hours charged
+CAN_PACKET_STATUS_4 = 16 # FET temperature, motor temperature, battery current, PID position
+CAN_PACKET_STATUS_5 = 27 # tachometer, battery voltage
+
+class VescCan(object):
+    """VESC over CAN.
+    Commands are sent as CAN extended frames and the motor data is updated from the status messages
+    that VESC broadcasts periodically, so there is no request / response round trip.
+    On VESC Tool, App Settings - General: set the CAN baudrate to the same of the CAN bus (250k for the
+    Bafang torque sensor) and the CAN Status Message Mode to CAN_STATUS_1_2_3_4_5, at 50 or 100Hz.
+    The CAN bus has a single listener, so the status messages are received by the CanRouter of the bus."""
+
+    def __init__(self, can_router, controller_id, ebike_app_data):
+        """VESC over CAN
+        :param ~CanRouter can_router: CAN router of the CAN bus that connects to VESC, like the torque sensor one
+        :param int controller_id: VESC controller ID, as configured on VESC Tool
+        :param ~EBikeAppData ebike_app_data: Ebike app data object
+        """
+        self._can_router = can_router
+        self._can_bus = can_router.can_bus
+        self._controller_id = controller_id
+        self._ebike_app_data = ebike_app_data
+        self._new_data = False
+
+        # only receive the status messages used, sent by this VESC: the lower 8 bits of the ID are the controller ID
+        for packet_id in (CAN_PACKET_STATUS, CAN_PACKET_STATUS_4, CAN_PACKET_STATUS_5):
+            can_router.add_route((packet_id << 8) | controller_id, self._process_message)
+
+        # preallocated messages for each command, so sending a command does not allocate memory
+        self._data = bytearray(4)
+        self._message_set_current = self._new_message(CAN_PACKET_SET_CURRENT)
+        self._message_set_current_brake = self._new_message(CAN_PACKET_SET_CURRENT_BRAKE)
+        self._message_set_rpm = self._new_message(CAN_PACKET_SET_RPM)
+        self._message_brake = self._new_message(CAN_PACKET_SET_CURRENT_BRAKE) # value 0, constant
+
+        # VESC has no alive command over CAN, the last command is sent again as heart beat
+        self._last_message = self._message_brake
+
+    def _new_message(self, packet_id):
+        return canio.Message(
+            id = (packet_id << 8) | self._controller_id,
+            data = bytes(4),
+            extended = True)
+
+    def _send_value(self, message, value):
+        struct.pack_into('>l', self._data, 0, value)
+        message.data = self._data
+        self._can_bus.send(message)
+        self._last_message = message
+
+    def _process_message(self, message):
+        packet_id = message.id >> 8
+        data = message.data
+
+        if packet_id == CAN_PACKET_STATUS:
+            erpm, motor_current_x10, _duty_cycle_x1000 = struct.unpack_from('>lhh', data, 0)
+            self._ebike_app_data.motor_speed_erpm = erpm
+            self._ebike_app_data.motor_current = motor_current_x10 / 10.0
+
+        elif packet_id == CAN_PACKET_STATUS_4:
+            temperature_fet_x10, _temperature_motor_x10, battery_current_x10, _pid_position = struct.unpack_from('>hhhh', data, 0)
+            self._ebike_app_data.vesc_temperature_x10 = temperature_fet_x10 - 110 # found experimentaly that this value has a positive offset of 11 degrees - 2023.01.27
+            self._ebike_app_data.battery_current = battery_current_x10 / 10.0
+
+        elif packet_id == CAN_PACKET_STATUS_5:
+            _tachometer, battery_voltage_x10 = struct.unpack_from('>lh', data, 0)
+            self._ebike_app_data.battery_voltage = battery_voltage_x10 / 10.0
+
+        else:
+            return
+
+        self._new_data = True
+
+    def process_data(self):
+        """Process the status messages broadcasted by VESC, without blocking. The messages of the other devices on the CAN bus are routed to them.
+        Should be called periodically, like every 10ms
+        return: True if new motor data was received
+        """
+        self._can_router.receive()
+        new_data = self._new_data
+        self._new_data = False
+        return new_data
+
+    def refresh_data(self):
+        """Nothing to do: VESC broadcasts the motor data periodically"""
+        pass
+
+    def send_heart_beat(self):
+        """Send again the last command, must be sent at least every 0.9s or VESC will stop the motor"""
+        self._can_bus.send(self._last_message)
+
+    def set_motor_current_amps(self, value):
+        """Set battery Amps"""
+        self._send_value(self._message_set_current, int(value * 1000)) # current in mA
+
+    def set_motor_current_milliamps(self, value):
+        """Set battery mA, as integer, without float math"""
+        self._send_value(self._message_set_current, value)
+
+    def set_motor_current_brake_amps(self, value):
+        """Set battery brake / regen Amps"""
+        self._send_value(self._message_set_current_brake, int(value * 1000)) # current in mA
+
+    def set_motor_speed_erpm(self, value):
+        """Set motor speed in ERPM"""
+        self._send_value(self._message_set_rpm, int(value))
+
+    def brake(self):
+        """ Brake: will set the motor current to 0 amps, efectivly coasting"""
+        # send 3x to avoid possibility of VESC missing receiving this command
+        self._can_bus.send(self._message_brake)
+        self._can_bus.send(self._message_brake)
+        self._can_bus.send(self._message_brake)
+        self._last_message = self._message_brake
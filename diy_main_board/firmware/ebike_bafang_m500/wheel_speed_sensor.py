@@ -1,16 +1,85 @@
+import countio
 import digitalio
+from adafruit_ticks import ticks_ms, ticks_diff
 
 class WheelSpeedSensor(object):
-    """Wheel speed sensor"""
-    def __init__(self, pin):
+    """Wheel speed sensor.
+    The sensor pulses are counted by the hardware pulse counter, so no pulse is lost at high speed and there is no need
+    for a task polling the pin. The speed is calculated when read, from the number of pulses and the time between
+    2 reads that saw a new pulse, over at least min_period_ms to lower the error of the read time.
+    So the speed should be read periodically, the error is up to the read period / min_period_ms."""
+
+    def __init__(self, pin, wheel_circumference_mm = 2325, magnets = 1, min_period_ms = 1000, stop_timeout = 3.0, counter = None):
         """Wheel speed sensor
         :param ~microcontroller.Pin pin: IO pin used to read wheel speed sensor
+        :param int wheel_circumference_mm: wheel circumference in mm
+        :param int magnets: number of magnets on the wheel, pulses per wheel revolution
+        :param int min_period_ms: min time in milliseconds between speed calculations
+        :param float stop_timeout: time in seconds without pulses, to set the speed to 0
+        :param ~countio.Counter counter: pulse counter to use, for testing. If None, a new one is created on the pin
         """
-        # configure IO input
-        self._wheel_speed = digitalio.DigitalInOut(pin)
-        self._wheel_speed.pull = digitalio.Pull.UP
-        self._wheel_speed.direction = digitalio.Direction.INPUT
+        if counter is None:
+            # the sensor pulls the pin low when the magnet passes
+            counter = countio.Counter(pin, edge = countio.Edge.FALL, pull = digitalio.Pull.UP)
+        self._counter = counter
+        self._start_count = counter.count
+        self._mm_per_pulse_x1000 = (wheel_circumference_mm * 1000) // magnets
+        # km/h x10 = mm per pulse * pulses / ms * 3.6 * 10
+        self._speed_factor = (wheel_circumference_mm * 36) // magnets
+        self._min_period_ms = min_period_ms
+        self._stop_timeout_ms = int(stop_timeout * 1000)
+
+        self._last_count = self._start_count # count at the start of the current measure
+        self._last_time = ticks_ms()
+        self._read_count = self._start_count # count on the previous read
+        self._pulse_time = self._last_time # time of the last read that saw a new pulse
+        self._stopped = True
+        self._speed_x10 = 0
+
+    @property
+    def speed_x10(self):
+        """Wheel speed in km/h x10"""
+        now = ticks_ms()
+        count = self._counter.count
+        new_pulse = count != self._read_count
+        self._read_count = count
+        pulses = count - self._last_count
+        elapsed_ms = ticks_diff(now, self._last_time)
+
+        if new_pulse:
+            self._pulse_time = now
+            if self._stopped:
+                # first pulse after stopped, the time of the previous pulse is not known, so start measuring from here
+                self._stopped = False
+                self._last_count = count
+                self._last_time = now
+
+            elif elapsed_ms >= self._min_period_ms:
+                # a pulse was just counted, so the measure ends near a pulse, like it started
+                self._speed_x10 = (pulses * self._speed_factor) // elapsed_ms
+                self._last_count = count
+                self._last_time = now
+
+        elif not self._stopped:
+            since_pulse_ms = ticks_diff(now, self._pulse_time)
+            if since_pulse_ms > self._stop_timeout_ms:
+                self._stopped = True
+                self._speed_x10 = 0
+
+            elif since_pulse_ms > 0:
+                # slowing down: the speed is at most 1 pulse on the time since the last one
+                max_speed_x10 = self._speed_factor // since_pulse_ms
+                if self._speed_x10 > max_speed_x10:
+                    self._speed_x10 = max_speed_x10
+
+        return self._speed_x10
+
+    @property
+    def pulses(self):
+        """Pulses counted since startup, for the odometer"""
+        return self._counter.count - self._start_count
 
     @property
-    def value(self):
-        return not self._wheel_speed.value
+    def distance_m(self):
+        """Distance in meters since startup"""
+        return (self.pulses * self._mm_per_pulse_x1000) // 1000000
@@ -0,0 +1,106 @@
+from adafruit_ticks import ticks_ms, ticks_diff
+
+# Integer math for the motor control path: currents in mA, speeds in ERPM.
+# On CircuitPython each float result is a new object on the heap, while integers that fit in 31 bits are not,
+# so the control loop does not allocate memory on each step.
+
+# ramp rates are in Q8 format: units per ms * 256
+_RAMP_Q = 8
+
+def clamp(value, min_value, max_value):
+    """Limit value to min_value and max_value"""
+    if value < min_value:
+        return min_value
+    elif value > max_value:
+        return max_value
+    return value
+
+def map_range(value, in_min, in_max, out_min, out_max):
+    """Integer map_range(): map value from the input range to the output range, limited to the output range"""
+    if value <= in_min:
+        return out_min
+    elif value >= in_max:
+        return out_max
+    return out_min + ((value - in_min) * (out_max - out_min)) // (in_max - in_min)
+
+def step_towards(value, target_value, step):
+    """Move value towards the target_value, by increasing / decreasing by step"""
+    if value < target_value:
+        value += step
+        if value > target_value:
+            value = target_value
+
+    elif value > target_value:
+        value -= step
+        if value < target_value:
+            value = target_value
+
+    return value
+
+class Ramp(object):
+    """Ramps a value towards a target, with different up and down rates per second.
+    The step is calculated from the elapsed time in ms, with the fraction of the step kept for the next update,
+    so slow rates are not lost to rounding."""
+
+    def __init__(self, up_per_second, down_per_second, value = 0):
+        """Ramp
+        :param float up_per_second: ramp up rate, in units per second (like mA per second or ERPM per second)
+        :param float down_per_second: ramp down rate, in units per second
+        :param int value: initial value
+        """
+        self.set_rates(up_per_second, down_per_second)
+        self.value = value
+        self._remainder = 0
+        self._last_time = ticks_ms()
+
+    def set_rates(self, up_per_second, down_per_second):
+        """Set the ramp up and down rates, in units per second"""
+        self._up_rate_q8 = int(up_per_second * (1 << _RAMP_Q) / 1000)
+        self._down_rate_q8 = int(down_per_second * (1 << _RAMP_Q) / 1000)
+
+    def update(self, target_value):
+        """Move the value towards the target_value, by the elapsed time since last update
+        :param int target_value: target value
+        return: the new value
+        """
+        now = ticks_ms()
+        elapsed_ms = ticks_diff(now, self._last_time)
+        self._last_time = now
+
+        rate_q8 = self._up_rate_q8 if target_value > self.value else self._down_rate_q8
+        step_q8 = elapsed_ms * rate_q8 + self._remainder
+        self._remainder = step_q8 & ((1 << _RAMP_Q) - 1)
+        self.value = step_towards(self.value, target_value, step_q8 >> _RAMP_Q)
+        if self.value == target_value:
+            self._remainder = 0
+
+        return self.value
+
+    def reset(self, value = 0):
+        """Set the value right away, like when the brakes are active"""
+        self.value = value
+        self._remainder = 0
+
+class LowPass(object):
+    """Integer low pass filter: value = value + (input - value) / 2^shift"""
+
+    def __init__(self, shift, value = 0):
+        """Low pass filter
+        :param int shift: filter strength, the time constant is about 2^shift updates
+        :param int value: initial value
+        """
+        self._shift = shift
+        self._accumulated = value << shift
+
+    def update(self, value):
+        """Add a new input value
+        :param int value: input value
+        return: the filtered value
+        """
+        self._accumulated += value - (self._accumulated >> self._shift)
+        return self._accumulated >> self._shift
+
+    @property
+    def value(self):
+        """Filtered value"""
+        return self._accumulated >> self._shift
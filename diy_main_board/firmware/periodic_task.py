@@ -0,0 +1,85 @@
+import asyncio
+from adafruit_ticks import ticks_ms, ticks_add, ticks_diff
+
+class PeriodicTask(object):
+    """Runs a function at a fixed rate, on absolute deadlines.
+    The next deadline is the previous one plus the period, so the time the function takes to run and the
+    time other tasks hold the CPU do not add up and the rate does not drift, like with asyncio.sleep(period).
+    When the function is late, it runs right away to catch up, up to max_catch_up periods;
+    when it is later than that, the missed periods are skipped and the next deadline stays on the same time grid."""
+
+    def __init__(self, name, function, period_ms, max_catch_up = 1):
+        """Periodic task
+        :param str name: name to print on the statistics
+        :param function function: function to run, without arguments
+        :param int period_ms: period in milliseconds
+        :param int max_catch_up: max number of late periods to run right away, the others are skipped
+        """
+        self.name = name
+        self._function = function
+        self.period_ms = period_ms
+        self._max_catch_up = max_catch_up
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the statistics"""
+        self.runs = 0
+        self.overruns = 0 # runs that ended after the next deadline
+        self.skipped = 0 # periods skipped because the task was late more than max_catch_up periods
+        self.last_period_ms = 0 # time between the last 2 runs
+        self.min_period_ms = 0
+        self.max_period_ms = 0
+        self.jitter_ms = 0 # how late the last run started
+        self.max_jitter_ms = 0
+        self.run_time_ms = 0 # how long the last run took
+        self.max_run_time_ms = 0
+        self._last_start = None
+
+    async def run(self):
+        """Run the function forever, to be used as an asyncio task"""
+        period = self.period_ms
+        deadline = ticks_add(ticks_ms(), period)
+
+        while True:
+            wait = ticks_diff(deadline, ticks_ms())
+            if wait > 0:
+                await asyncio.sleep(wait / 1000)
+            else:
+                # late, but still let the other tasks run
+                await asyncio.sleep(0)
+
+            start = ticks_ms()
+            self._function()
+            end = ticks_ms()
+
+            # statistics
+            self.runs += 1
+            self.jitter_ms = ticks_diff(start, deadline)
+            if self.jitter_ms > self.max_jitter_ms:
+                self.max_jitter_ms = self.jitter_ms
+            self.run_time_ms = ticks_diff(end, start)
+            if self.run_time_ms > self.max_run_time_ms:
+                self.max_run_time_ms = self.run_time_ms
+            if self._last_start is not None:
+                self.last_period_ms = ticks_diff(start, self._last_start)
+                if self.last_period_ms > self.max_period_ms:
+                    self.max_period_ms = self.last_period_ms
+                if self.min_period_ms == 0 or self.last_period_ms < self.min_period_ms:
+                    self.min_period_ms = self.last_period_ms
+            self._last_start = start
+
+            # next deadline, on the same time grid
+            deadline = ticks_add(deadline, period)
+            late = ticks_diff(end, deadline)
+            if late >= 0:
+                self.overruns += 1
+                missed = late // period + 1 # deadlines already passed
+                if missed > self._max_catch_up:
+                    deadline = ticks_add(deadline, missed * period)
+                    self.skipped += missed
+
+    def __str__(self):
+        return "{}: period {}ms ({}..{}), jitter {}ms (max {}), run {}ms (max {}), runs {}, overruns {}, skipped {}".format(
+            self.name, self.period_ms, self.min_period_ms, self.max_period_ms,
+            self.jitter_ms, self.max_jitter_ms, self.run_time_ms, self.max_run_time_ms,
+            self.runs, self.overruns, self.skipped)
@@ -0,0 +1,142 @@
+import array
+import asyncio
+import sys
+import time
+import supervisor
+
+# the total time is halved, with the count used for the average, when it gets to this value,
+# so it stays a small int that does not use the heap
+_TOTAL_FOLD_US = 1 << 24
+
+# the profiles measure only while enabled: the time in microseconds is from time.monotonic_ns(), that on CircuitPython
+# is a long int on the heap, so while the profiles are not used the task bodies do not allocate memory.
+# Send 'p' on the serial console to enable / disable them
+enabled = False
+
+# all the profiles created, to print their statistics
+profiles = []
+
+class Profile(object):
+    """Execution time profile of a task body, with min / avg / max and an histogram for the percentiles.
+    The time is measured in microseconds, as most task bodies take less than 1ms, and only while the profiles are
+    enabled. The histogram is a preallocated array with fixed size buckets and all the statistics are small ints,
+    also the total time used for the average."""
+
+    def __init__(self, name, bucket_us = 100, buckets = 100):
+        """Profile
+        :param str name: name to print on the statistics
+        :param int bucket_us: size of each histogram bucket in microseconds
+        :param int buckets: number of histogram buckets, times higher than bucket_us * buckets go to an extra bucket
+        """
+        self.name = name
+        self._bucket_us = bucket_us
+        self._histogram = array.array('L', [0] * (buckets + 1))
+        self._start = 0
+        self.reset_stats()
+        profiles.append(self)
+
+    def reset_stats(self):
+        """Reset the statistics"""
+        for i in range(len(self._histogram)):
+            self._histogram[i] = 0
+        self.count = 0
+        self.min_us = 0
+        self.max_us = 0
+        self._total_us = 0
+        self._total_count = 0 # count of the times on _total_us
+
+    def add(self, time_us):
+        """Add an execution time
+        :param int time_us: execution time in microseconds
+        """
+        bucket = time_us // self._bucket_us
+        if bucket >= len(self._histogram):
+            bucket = len(self._histogram) - 1
+        self._histogram[bucket] += 1
+
+        if self.count == 0 or time_us < self.min_us:
+            self.min_us = time_us
+        if time_us > self.max_us:
+            self.max_us = time_us
+        self.count += 1
+
+        self._total_us += time_us
+        self._total_count += 1
+        if self._total_us >= _TOTAL_FOLD_US:
+            self._total_us >>= 1
+            self._total_count >>= 1
+
+    @property
+    def avg_us(self):
+        """Average execution time in microseconds"""
+        if self._total_count == 0:
+            return 0
+        return self._total_us // self._total_count
+
+    def start(self):
+        """Start measuring, to be used around code that can not be wrapped, like an await"""
+        if enabled:
+            self._start = time.monotonic_ns()
+
+    def stop(self):
+        """Stop measuring and add the execution time since start()"""
+        if enabled and self._start:
+            self.add((time.monotonic_ns() - self._start) // 1000)
+            self._start = 0
+
+    def wrap(self, function):
+        """Wrap a function, so each call is measured
+        :param function function: function to measure
+        return: function that calls function and measures its execution time
+        """
+        def measured(*args):
+            if not enabled:
+                return function(*args)
+            start = time.monotonic_ns()
+            result = function(*args)
+            self.add((time.monotonic_ns() - start) // 1000)
+            return result
+
+        return measured
+
+    def percentile(self, percent):
+        """Execution time percentile, with the resolution of the histogram buckets
+        :param int percent: percentile, like 99
+        return: upper bound in microseconds of the bucket that has the percentile, 0 if there are no times
+        """
+        if self.count == 0:
+            return 0
+
+        target = (self.count * percent + 99) // 100
+        accumulated = 0
+        for i in range(len(self._histogram) - 1):
+            accumulated += self._histogram[i]
+            if accumulated >= target:
+                return (i + 1) * self._bucket_us
+
+        return self.max_us
+
+    def __str__(self):
+        return "{}: min {}us, avg {}us, max {}us, p99 {}us, count {}".format(
+            self.name, self.min_us, self.avg_us, self.max_us, self.percentile(99), self.count)
+
+async def task_serial_stats(objects = profiles):
+    """Print the statistics when 's' is received on the serial console, reset them on 'r' and enable / disable
+    the profiles on 'p'
+    :param list objects: objects with statistics, like Profile or PeriodicTask
+    """
+    global enabled
+    while True:
+        if supervisor.runtime.serial_bytes_available:
+            command = sys.stdin.read(1)
+            if command == 'p':
+                enabled = not enabled
+                print("profiles enabled" if enabled else "profiles disabled")
+            elif command == 's':
+                for stats in objects:
+                    print(stats)
+            elif command == 'r':
+                for stats in objects:
+                    stats.reset_stats()
+
+        await asyncio.sleep(0.2)
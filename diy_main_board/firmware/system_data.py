@@ -11,7 +11,6 @@ class SystemData(object):
         self.motor_power = 0
         self.motor_speed_erpm = 0
         self.motor_temperature_sensor_x10 = 0
-        self.previous_motor_target = True
         self.brakes_are_active = True
         self.torque_weight_x10 = 0
         self.cadence = 0
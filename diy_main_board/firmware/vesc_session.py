@@ -0,0 +1,165 @@
+import time
+
+class VescSession(object):
+    """VESC session.
+    Keeps the VESC heart beat, the motor commands and the telemetry independent:
+    - commands are sent right away and also count as heart beat, as any command resets the VESC timeout;
+    - the heart beat is sent only if no command was sent for heart_beat_period;
+    - the telemetry keeps at most one request waiting for the response, and the response is matched whenever it arrives.
+    Works with both Vesc (UART) and VescCan transports."""
+
+    def __init__(self, vesc, heart_beat_period = 0.5, telemetry_period = 0.1, telemetry_timeout = 0.25):
+        """VESC session
+        :param ~Vesc vesc: VESC transport, Vesc or VescCan
+        :param float heart_beat_period: max time in seconds without sending anything to VESC. VESC will stop the motor after 1 second
+        :param float telemetry_period: time in seconds between telemetry requests
+        :param float telemetry_timeout: time in seconds to wait for a telemetry response, before giving up and ask again
+        """
+        self._vesc = vesc
+        self._heart_beat_period_ns = int(heart_beat_period * 1000000000)
+        self._telemetry_period_ns = int(telemetry_period * 1000000000)
+        self._telemetry_timeout_ns = int(telemetry_timeout * 1000000000)
+
+        self._last_command_time = 0
+        self._telemetry_request_time = 0
+        self._telemetry_pending = False
+
+        # statistics
+        self.heart_beats = 0
+        self.commands = 0
+        self.telemetry_requests = 0
+        self.telemetry_responses = 0
+        self.telemetry_timeouts = 0
+        self.latency_ms = 0 # latency of the last telemetry response
+        self.latency_max_ms = 0
+
+    def _command_sent(self):
+        self._last_command_time = time.monotonic_ns()
+        self.commands += 1
+
+    # command lane: commands are sent right away
+    def set_motor_current_amps(self, value):
+        """Set battery Amps"""
+        self._vesc.set_motor_current_amps(value)
+        self._command_sent()
+
+    def set_motor_current_milliamps(self, value):
+        """Set battery mA"""
+        self._vesc.set_motor_current_milliamps(value)
+        self._command_sent()
+
+    def set_motor_current_brake_amps(self, value):
+        """Set battery brake / regen Amps"""
+        self._vesc.set_motor_current_brake_amps(value)
+        self._command_sent()
+
+    def set_motor_speed_erpm(self, value):
+        """Set motor speed in ERPM"""
+        self._vesc.set_motor_speed_erpm(value)
+        self._command_sent()
+
+    def brake(self):
+        """ Brake: will set the motor current to 0 amps, efectivly coasting"""
+        self._vesc.brake()
+        self._command_sent()
+
+    def heart_beat(self):
+        """Send the heart beat, if no command was sent for heart_beat_period.
+        Should be called periodically from its own task, at least 2x faster than heart_beat_period"""
+        now = time.monotonic_ns()
+        if (now - self._last_command_time) >= self._heart_beat_period_ns:
+            self._vesc.send_heart_beat()
+            self._last_command_time = now
+            self.heart_beats += 1
+
+    def telemetry(self):
+        """Process the telemetry responses and ask for new telemetry when there is no request waiting.
+        Should be called periodically from its own task, like every 10ms
+        return: True if new motor data was received
+        """
+        new_data = self._vesc.process_data()
+        now = time.monotonic_ns()
+
+        if self._telemetry_pending:
+            if new_data:
+                self._telemetry_pending = False
+                self.telemetry_responses += 1
+                self.latency_ms = (now - self._telemetry_request_time) // 1000000
+                if self.latency_ms > self.latency_max_ms:
+                    self.latency_max_ms = self.latency_ms
+
+            elif (now - self._telemetry_request_time) > self._telemetry_timeout_ns:
+                # give up on this response, a new request will be sent
+                self._telemetry_pending = False
+                self.telemetry_timeouts += 1
+
+        if not self._telemetry_pending and (now - self._telemetry_request_time) >= self._telemetry_period_ns:
+            self._vesc.refresh_data()
+            self._telemetry_request_time = now
+            self._telemetry_pending = True
+            self.telemetry_requests += 1
+
+        return new_data
+
+# setpoint commands, to know when the command changes
+_SETPOINT_CURRENT = 0
+_SETPOINT_ERPM = 1
+_SETPOINT_CURRENT_MILLIAMPS = 2
+
+class VescSetpointPublisher(object):
+    """Sends the motor setpoints to VESC only on meaningful changes.
+    A new setpoint is sent when it changes more than the deadband, when it reaches 0, when the command changes
+    (current or ERPM) or when it was not sent for resend_period, so it also works as VESC heart beat."""
+
+    def __init__(self, vesc, current_deadband = 0.1, erpm_deadband = 20, resend_period = 0.1):
+        """VESC setpoint publisher
+        :param ~VescSession vesc: VESC session or transport used to send the setpoints
+        :param float current_deadband: min change of motor current in Amps to send a new value
+        :param int erpm_deadband: min change of motor speed in ERPM to send a new value
+        :param float resend_period: max time in seconds without sending the setpoint
+        """
+        self._vesc = vesc
+        self._current_deadband = current_deadband
+        self._current_deadband_ma = int(current_deadband * 1000)
+        self._erpm_deadband = erpm_deadband
+        self._resend_period_ns = int(resend_period * 1000000000)
+
+        self._command = None
+        self._value = 0
+        self._time = 0
+
+        # statistics
+        self.sent = 0
+        self.suppressed = 0
+
+    def _should_send(self, command, value, deadband):
+        now = time.monotonic_ns()
+        delta = value - self._value
+        if command != self._command or\
+           delta >= deadband or delta <= -deadband or\
+           (value == 0 and self._value != 0) or\
+           (now - self._time) >= self._resend_period_ns:
+
+            self._command = command
+            self._value = value
+            self._time = now
+            self.sent += 1
+            return True
+
+        self.suppressed += 1
+        return False
+
+    def set_motor_current_amps(self, value):
+        """Set battery Amps, if it changed enough"""
+        if self._should_send(_SETPOINT_CURRENT, value, self._current_deadband):
+            self._vesc.set_motor_current_amps(value)
+
+    def set_motor_current_milliamps(self, value):
+        """Set battery mA, if it changed enough"""
+        if self._should_send(_SETPOINT_CURRENT_MILLIAMPS, value, self._current_deadband_ma):
+            self._vesc.set_motor_current_milliamps(value)
+
+    def set_motor_speed_erpm(self, value):
+        """Set motor speed in ERPM, if it changed enough"""
+        if self._should_send(_SETPOINT_ERPM, value, self._erpm_deadband):
+            self._vesc.set_motor_speed_erpm(value)